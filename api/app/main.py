@@ -1,8 +1,21 @@
 from fastapi import FastAPI, HTTPException
+from typing import List
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
-from app.routers import providers, api_keys, models, free_quotas
+from contextlib import asynccontextmanager, suppress
+import asyncio
+from app.routers import providers, api_keys, models, free_quotas, usage, chat
 from app.db.database import init_pgvector, SessionLocal
+from app.services.pagination import NEXT_CURSOR_HEADER
+from app.services import usage_partition_service, free_quota_reset_service
+from app.services.usage_recorder import usage_recorder
+from app.services import free_quota_ledger as ledger
+from app.services import api_key_pool as key_pool
+from app.services import rate_limiter as limiter
+from app.services import model_router as routing
+from app.services import pricing
+from app.services.circuit_breaker import circuit_breakers
+from app.services.chat_fanout import FANOUT_ID_HEADER, chat_fanout
+from app.models.schemas import CircuitBreakerRead
 
 app = FastAPI(
     title="Model Providers API",
@@ -17,8 +30,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, FANOUT_ID_HEADER],
 )
 
+async def run_periodically(task, interval_seconds: float):
+    """Run a blocking maintenance task in a worker thread every interval_seconds."""
+    while True:
+        try:
+            await asyncio.to_thread(task)
+        except Exception as e:
+            print(f"Warning: periodic task {task.__name__} failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup tasks
@@ -27,9 +50,64 @@ async def lifespan(app: FastAPI):
         
     except Exception as e:
         print(f"Warning: Failed to initialize database: {e}")
+    
+    try:
+        # The current month's partition must exist before the usage recorder writes
+        await asyncio.to_thread(usage_partition_service.maintain_partitions)
+    except Exception as e:
+        print(f"Warning: Failed to maintain usage partitions: {e}")
+    
+    try:
+        await asyncio.to_thread(ledger.free_quota_ledger.reconcile)
+    except Exception as e:
+        print(f"Warning: Failed to load free quota ledger: {e}")
+    
+    background_tasks = [
+        asyncio.create_task(run_periodically(
+            usage_partition_service.maintain_partitions,
+            usage_partition_service.PARTITION_MAINTENANCE_INTERVAL_SECONDS
+        )),
+        asyncio.create_task(run_periodically(
+            ledger.free_quota_ledger.maintain,
+            ledger.FLUSH_INTERVAL_SECONDS
+        )),
+        asyncio.create_task(run_periodically(
+            free_quota_reset_service.sweep_due_resets,
+            free_quota_reset_service.RESET_SWEEP_INTERVAL_SECONDS
+        )),
+        asyncio.create_task(run_periodically(
+            key_pool.api_key_pool.refresh,
+            key_pool.REFRESH_INTERVAL_SECONDS
+        )),
+        asyncio.create_task(run_periodically(
+            limiter.rate_limiter.refresh,
+            limiter.REFRESH_INTERVAL_SECONDS
+        )),
+        asyncio.create_task(run_periodically(
+            routing.model_router.refresh,
+            routing.REFRESH_INTERVAL_SECONDS
+        )),
+        asyncio.create_task(run_periodically(
+            pricing.pricing_engine.refresh,
+            pricing.REFRESH_INTERVAL_SECONDS
+        )),
+    ]
+    await usage_recorder.start()
         
     yield
-    # Shutdown tasks (if any) can be added here
+    
+    # Shutdown tasks
+    # Write any buffered usage before the process exits
+    await usage_recorder.stop()
+    await chat_fanout.close()
+    for task in background_tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    try:
+        await asyncio.to_thread(ledger.free_quota_ledger.flush)
+    except Exception as e:
+        print(f"Warning: Failed to flush free quota ledger: {e}")
 
 app.router.lifespan_context = lifespan
     
@@ -38,6 +116,8 @@ app.include_router(providers.router)
 app.include_router(api_keys.router)
 app.include_router(models.router)
 app.include_router(free_quotas.router)
+app.include_router(usage.router)
+app.include_router(chat.router)
 
 @app.get("/")
 async def root():
@@ -45,4 +125,9 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/health/circuits", response_model=List[CircuitBreakerRead])
+async def circuit_breaker_states():
+    """State of every provider and implementation circuit breaker the router has used."""
+    return circuit_breakers.statuses()
\ No newline at end of file
@@ -1,2 +1,2 @@
 # Import all models here so Alembic can discover them
-from app.models.provider import ModelProvider, ApiKey, Model, ModelImplementation
\ No newline at end of file
+from app.models.provider import ModelProvider, ApiKey, Model, ModelImplementation, ApiKeyUsage, ApiKeyUsageHourly, ApiKeyUsageDaily, RateLimitBucket
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Float, String, ForeignKey, Enum,Boolean, Integer, ARRAY,CheckConstraint, UniqueConstraint
+from sqlalchemy import Column, DateTime, Float, String, ForeignKey, Enum,Boolean, Integer, BigInteger, ARRAY,CheckConstraint, UniqueConstraint, Index, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
@@ -30,6 +30,37 @@ class ResetPeriod(str, enum.Enum):
     def __json__(self):
         return self.value
 
+class RollupGranularity(str, enum.Enum):
+    HOUR = "HOUR"   # 按小时汇总
+    DAY = "DAY"     # 按天汇总
+    
+    def __str__(self):
+        return self.value
+    
+    def __json__(self):
+        return self.value
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "CLOSED"         # 正常放行
+    OPEN = "OPEN"             # 熔断，直接跳过
+    HALF_OPEN = "HALF_OPEN"   # 放行少量探测请求
+    
+    def __str__(self):
+        return self.value
+    
+    def __json__(self):
+        return self.value
+
+class CircuitKind(str, enum.Enum):
+    PROVIDER = "PROVIDER"               # 服务商级熔断
+    IMPLEMENTATION = "IMPLEMENTATION"   # 模型实现级熔断
+    
+    def __str__(self):
+        return self.value
+    
+    def __json__(self):
+        return self.value
+
 class ModelProvider(Base):
     __tablename__ = "model_providers"
     
@@ -38,6 +69,7 @@ class ModelProvider(Base):
     base_url = Column(String, nullable=False)
     description = Column(String(200), nullable=True)
     free_quota_type = Column(Enum(FreeQuotaType), nullable=True)  # 免费额度类型
+    rate_limits = Column(JSONB, nullable=True)  # 上游限流配置, see schemas.ProviderRateLimits
     
     # Relationships
     api_keys = relationship("ApiKey", back_populates="provider", cascade="all, delete-orphan")
@@ -55,6 +87,12 @@ class ApiKey(Base):
     alias = Column(String, nullable=False)
     key = Column(String, nullable=False)
     sort_order = Column(Integer, nullable=True, default=0)  # Add sort order field
+    weight = Column(Integer, nullable=False, default=1, server_default="1")  # Share of traffic under weighted round-robin
+    
+    # Keys are always listed per provider in sort order
+    __table_args__ = (
+        Index('ix_api_keys_provider_id_sort_order', 'provider_id', 'sort_order'),
+    )
     
     # Relationship back to provider
     provider = relationship("ModelProvider", back_populates="api_keys")
@@ -67,6 +105,12 @@ class ApiKey(Base):
 
 
 class ApiKeyUsage(Base):
+    """
+    Per-call token usage, range-partitioned by month on timestamp.
+    
+    Monthly partitions are created and dropped by usage_partition_service; the
+    default partition only catches rows outside the pre-created months.
+    """
     __tablename__ = "api_key_usage"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -77,7 +121,17 @@ class ApiKeyUsage(Base):
     total_tokens = Column(Integer, nullable=False)  # 总 token 数
     prompt_tokens_details = Column(JSONB, nullable=True)
     completion_tokens_details = Column(JSONB, nullable=True)
-    timestamp = Column(DateTime(timezone=True), nullable=False)
+    # The partition key has to be part of the primary key
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False)
+    
+    # Usage is queried per key or per implementation over a time window;
+    # the BRIN index keeps append-ordered time scans cheap at any table size
+    __table_args__ = (
+        Index('ix_api_key_usage_api_key_id_timestamp', 'api_key_id', 'timestamp'),
+        Index('ix_api_key_usage_model_implementation_id_timestamp', 'model_implementation_id', 'timestamp'),
+        Index('ix_api_key_usage_timestamp_brin', 'timestamp', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
     
     # Relationship back to api key
     api_key = relationship("ApiKey", back_populates="usages")
@@ -86,6 +140,45 @@ class ApiKeyUsage(Base):
     def __repr__(self):
         return f"<ApiKeyUsage(id={self.id}, api_key_id='{self.api_key_id}', timestamp='{self.timestamp}')>"
 
+class UsageRollupMixin:
+    """Token totals per API key and model implementation for one time bucket."""
+    api_key_id = Column(UUID(as_uuid=True), ForeignKey("api_keys.id", ondelete="CASCADE"), primary_key=True)
+    model_implementation_id = Column(UUID(as_uuid=True), ForeignKey("model_implementations.id", ondelete="CASCADE"), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # 时间桶起点 (UTC)
+    request_count = Column(BigInteger, nullable=False, default=0)
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    total_tokens = Column(BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<{type(self).__name__}(api_key_id='{self.api_key_id}', model_implementation_id='{self.model_implementation_id}', bucket='{self.bucket}')>"
+
+class ApiKeyUsageHourly(UsageRollupMixin, Base):
+    """Hourly rollup of ApiKeyUsage"""
+    __tablename__ = "api_key_usage_hourly"
+    
+    __table_args__ = (
+        Index('ix_api_key_usage_hourly_bucket', 'bucket'),
+        Index('ix_api_key_usage_hourly_model_implementation_id_bucket', 'model_implementation_id', 'bucket'),
+    )
+
+class ApiKeyUsageDaily(UsageRollupMixin, Base):
+    """Daily rollup of ApiKeyUsage"""
+    __tablename__ = "api_key_usage_daily"
+    
+    __table_args__ = (
+        Index('ix_api_key_usage_daily_bucket', 'bucket'),
+        Index('ix_api_key_usage_daily_model_implementation_id_bucket', 'model_implementation_id', 'bucket'),
+    )
+
+# A partitioned table rejects rows without a matching partition; usage_partition_service.ensure_partitions
+# moves rows out of the default partition when their month's partition is created
+event.listen(
+    ApiKeyUsage.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS api_key_usage_default PARTITION OF api_key_usage DEFAULT")
+)
+
 
 class Model(Base):
     __tablename__ = "models"
@@ -116,6 +209,12 @@ class ModelImplementation(Base):
     custom_parameters = Column(JSONB, nullable=True)
     sort_order = Column(Integer, nullable=False, default=0)  # Add sort order field
     
+    # Implementations are listed per model in sort order and joined per provider
+    __table_args__ = (
+        Index('ix_model_implementations_model_id_sort_order', 'model_id', 'sort_order'),
+        Index('ix_model_implementations_provider_id', 'provider_id'),
+    )
+    
     # Relationships
     provider = relationship("ModelProvider", back_populates="model_implementations")
     model = relationship("Model", back_populates="implementations")
@@ -161,9 +260,30 @@ class FreeQuotaUsage(Base):
     last_reset_date = Column(DateTime(timezone=True), nullable=True)
     next_reset_date = Column(DateTime(timezone=True), nullable=True)  # 下次重置时间
     
+    # One usage record per API key and quota
+    __table_args__ = (
+        UniqueConstraint('api_key_id', 'free_quota_id', name='uq_free_quota_usage_api_key_quota'),
+        Index('ix_free_quota_usages_free_quota_id', 'free_quota_id'),
+    )
+    
     # Relationships
     api_key = relationship("ApiKey", back_populates="free_quota_usage")
     free_quota = relationship("FreeQuota", back_populates="usages")
     
     def __repr__(self):
         return f"<FreeQuotaUsage(id={self.id}, api_key_id='{self.api_key_id}', used_amount={self.used_amount})>"
+
+
+class RateLimitBucket(Base):
+    """Token bucket state shared by all workers, used by rate_limiter.PostgresBackend"""
+    __tablename__ = "rate_limit_buckets"
+    
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    
+    # Bucket state is cheap to lose on a crash, so skip the WAL
+    __table_args__ = {'prefixes': ['UNLOGGED']}
+    
+    def __repr__(self):
+        return f"<RateLimitBucket(key='{self.key}', tokens={self.tokens})>"
@@ -1,15 +1,16 @@
-from pydantic import BaseModel, Field, field_validator, ConfigDict
+from pydantic import AliasChoices, BaseModel, Field, field_validator, ConfigDict
 from typing import List, Optional, Dict, Any, Union
 from uuid import UUID
 from datetime import datetime
 
-from app.models.provider import FreeQuotaType, ResetPeriod
+from app.models.provider import CircuitKind, CircuitState, FreeQuotaType, ResetPeriod
 
 # API Key schemas
 class ApiKeyBase(BaseModel):
     alias: str = Field(..., description="A human-readable alias for the API key")
     key: str = Field(..., description="The actual API key value")
     sort_order: int = Field(0, description="Sort order for drag-and-drop functionality")
+    weight: int = Field(1, ge=1, le=100, description="Relative share of requests under weighted round-robin selection")
     
     @field_validator('key')
     def validate_key_format(cls, v):
@@ -27,6 +28,7 @@ class ApiKeyUpdate(BaseModel):
     alias: Optional[str] = None
     key: Optional[str] = None
     sort_order: Optional[int] = None
+    weight: Optional[int] = Field(None, ge=1, le=100)
 
 class ApiKeyRead(ApiKeyBase):
     id: UUID
@@ -41,6 +43,7 @@ class ApiKeyReadWithMaskedKey(BaseModel):
     alias: str
     key_preview: str  = None # This will be a masked version of the key
     sort_order: int = 0
+    weight: int = 1
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -49,12 +52,91 @@ class OrderUpdate(BaseModel):
     orders: dict[UUID, int] = Field(..., description="Dictionary of API key IDs and their new sort orders")
 
 
+# Rate limit schemas
+class RateLimitConfig(BaseModel):
+    requests_per_minute: Optional[float] = Field(None, gt=0, description="Upstream request budget per minute")
+    tokens_per_minute: Optional[float] = Field(None, gt=0, description="Upstream token budget per minute")
+
+
+class ProviderRateLimits(BaseModel):
+    per_key: Optional[RateLimitConfig] = Field(None, description="Limits applied to each API key of the provider")
+    total: Optional[RateLimitConfig] = Field(None, description="Limits shared by all API keys of the provider")
+
+
+# Token counts that pricing_info units may refer to
+PRICE_UNITS = {"1k tokens": 1_000, "1m tokens": 1_000_000, "token": 1, "tokens": 1}
+
+
+# Billing modes of the web client's pricing_info; calls are costed from token and request prices,
+# per-minute pricing leaves an implementation unpriced
+BILLING_MODES = ("token", "request", "minute", "hybrid")
+
+
+class PricingTier(BaseModel):
+    tier_name: Optional[str] = None
+    volume_threshold: int = Field(..., ge=0, description="Smallest prompt, in tokens, the tier applies to")
+    input_price: Optional[float] = Field(None, ge=0, description="Price of prompt tokens, defaults to the top-level price")
+    output_price: Optional[float] = Field(None, ge=0, description="Price of completion tokens, defaults to the top-level price")
+    cached_input_price: Optional[float] = Field(None, ge=0, description="Price of cached prompt tokens, defaults to input_price")
+    request_price: Optional[float] = Field(None, ge=0, description="Price per call, defaults to the top-level price")
+    model_config = ConfigDict(extra="allow")
+
+
+class PricingInfo(BaseModel):
+    """
+    Prices of ModelImplementation.pricing_info, token prices per `unit` tokens,
+    in the shape used by the web client. Tiers pick the prices of a whole call
+    by its prompt size; the top-level prices apply below the smallest
+    volume_threshold. `input` and `output` are accepted for input_price and
+    output_price. Other keys are kept as they are.
+    """
+    input_price: Optional[float] = Field(None, ge=0, validation_alias=AliasChoices("input_price", "input"), description="Price of prompt tokens")
+    output_price: Optional[float] = Field(None, ge=0, validation_alias=AliasChoices("output_price", "output"), description="Price of completion tokens")
+    cached_input_price: Optional[float] = Field(None, ge=0, description="Price of cached prompt tokens, defaults to input_price")
+    request_price: Optional[float] = Field(None, ge=0, description="Price per call")
+    minute_price: Optional[float] = Field(None, ge=0, description="Price per minute, which usage rows cannot be costed by")
+    currency: Optional[str] = None
+    billing_mode: Optional[str] = None
+    unit: str = "1K tokens"
+    tiers: Optional[List[PricingTier]] = None
+    model_config = ConfigDict(extra="allow")
+
+    @field_validator('billing_mode')
+    def validate_billing_mode(cls, v):
+        if v is not None and v not in BILLING_MODES:
+            raise ValueError(f"billing_mode must be one of: {', '.join(BILLING_MODES)}")
+        return v
+
+    @field_validator('unit')
+    def validate_unit(cls, v):
+        if v.strip().lower() not in PRICE_UNITS:
+            raise ValueError(f"unit must be one of: {', '.join(sorted(PRICE_UNITS))}")
+        return v
+
+    @field_validator('tiers')
+    def validate_tiers(cls, v):
+        if v:
+            v = sorted(v, key=lambda tier: tier.volume_threshold)
+            thresholds = [tier.volume_threshold for tier in v]
+            if len(set(thresholds)) != len(thresholds):
+                raise ValueError("tiers must have distinct volume_threshold values")
+        return v
+
+
+def check_pricing_info(v: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # Stored as given, so pricing_info stays free-form apart from the priced fields
+    if v is not None:
+        PricingInfo.model_validate(v)
+    return v
+
+
 # Model Provider schemas
 class ModelProviderBase(BaseModel):
     name: str = Field(..., description="Name of the model provider")
     base_url: str = Field(..., description="Base URL for the provider's API")
     description: Optional[str] = Field(None, max_length=200, description="Optional description")
     free_quota_type: Optional[FreeQuotaType] = None
+    rate_limits: Optional[ProviderRateLimits] = None
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -67,6 +149,7 @@ class ModelProviderUpdate(BaseModel):
     base_url: Optional[str] = None
     description: Optional[str] = None
     free_quota_type: Optional[FreeQuotaType] = None
+    rate_limits: Optional[ProviderRateLimits] = None
 
 
 class ModelProviderRead(ModelProviderBase):
@@ -99,7 +182,9 @@ class ModelImplementationBase(BaseModel):
 
 
 class ModelImplementationCreate(ModelImplementationBase):
-    pass
+    @field_validator('pricing_info')
+    def validate_pricing_info(cls, v):
+        return check_pricing_info(v)
 
 
 class ModelImplementationUpdate(BaseModel):
@@ -111,6 +196,10 @@ class ModelImplementationUpdate(BaseModel):
     is_available: Optional[bool] = None
     custom_parameters: Optional[Dict[str, Any]] = None
 
+    @field_validator('pricing_info')
+    def validate_pricing_info(cls, v):
+        return check_pricing_info(v)
+
 
 class ModelImplementationRead(ModelImplementationBase):
     id: UUID
@@ -151,6 +240,65 @@ class ModelListRead(ModelRead):
 
     model_config = ConfigDict(from_attributes=True)
 
+class ModelListWithImplementationsRead(ModelListRead):
+    implementations: List['ModelImplementationRead'] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ModelRouteRead(BaseModel):
+    """An available implementation of a model with the endpoint and the API key selected to call it with"""
+    implementation_id: UUID
+    provider_id: UUID
+    provider_name: str
+    base_url: str
+    provider_model_id: str
+    context_window: Optional[int] = None
+    pricing_info: Optional[Dict[str, Any]] = None
+    custom_parameters: Optional[Dict[str, Any]] = None
+    api_key_id: UUID
+    api_key_alias: str
+    key_preview: str  # Masked key; callers look the key up by api_key_id
+    score: Optional[float] = Field(None, description="Routing score under the SCORED policy, lower is better")
+    probe: bool = Field(False, description="Holds the probe slot of a half-open circuit until the outcome is reported; do not cache")
+
+
+class CircuitBreakerRead(BaseModel):
+    """State of the circuit breaker of one provider or implementation"""
+    kind: CircuitKind
+    id: UUID
+    state: CircuitState
+    calls: int = Field(..., description="Calls in the sliding window")
+    error_rate: float
+    slow_call_rate: float
+    retry_after: Optional[float] = Field(None, description="Seconds until an open circuit admits a probe")
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ChatFanoutRequest(BaseModel):
+    """One prompt asked of several model implementations at once"""
+    prompt: str = Field(..., min_length=1)
+    implementation_ids: List[UUID] = Field(..., min_length=1, description="Model implementations to ask, duplicates are ignored")
+    system_prompt: Optional[str] = None
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    max_tokens: Optional[int] = Field(None, ge=1)
+
+    @field_validator('implementation_ids')
+    def deduplicate_implementation_ids(cls, v):
+        return list(dict.fromkeys(v))
+
+
+class RouteOutcome(BaseModel):
+    """Result of one upstream call made through a resolved route"""
+    implementation_id: UUID
+    api_key_id: Optional[UUID] = None
+    success: bool
+    latency_ms: Optional[float] = Field(None, ge=0, description="Time until the full response was received")
+    status_code: Optional[int] = Field(None, description="Upstream HTTP status of a failed call")
+    retry_after: Optional[float] = Field(None, ge=0, description="Retry-After of a rate limited call, in seconds")
+    prompt_tokens: Optional[int] = Field(None, ge=0, description="Prompt tokens of the call, debited from the key's free quotas")
+    completion_tokens: Optional[int] = Field(None, ge=0, description="Completion tokens of the call, debited from the key's free quotas")
+
 
 # Free Quota Schemas
 class FreeQuotaBase(BaseModel):
@@ -188,3 +336,47 @@ class FreeQuotaUsage(FreeQuotaUsageBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class FreeQuotaRemaining(BaseModel):
+    api_key_id: UUID
+    alias: str
+    model_implementation_id: Optional[UUID] = None
+    amount: float = Field(0, description="Total free quota applicable to the key")
+    used_amount: float = Field(0, description="Amount used in the current period")
+    remaining_amount: float = Field(0, description="Amount still available in the current period")
+    next_reset_date: Optional[datetime] = None
+
+
+# API Key Usage schemas
+class ApiKeyUsageCreate(BaseModel):
+    api_key_id: UUID
+    model_implementation_id: UUID
+    prompt_tokens: int = Field(..., ge=0, description="Number of input tokens")
+    completion_tokens: int = Field(..., ge=0, description="Number of output tokens")
+    total_tokens: Optional[int] = Field(None, ge=0, description="Defaults to prompt_tokens + completion_tokens")
+    prompt_tokens_details: Optional[Dict[str, Any]] = None
+    completion_tokens_details: Optional[Dict[str, Any]] = None
+    timestamp: Optional[datetime] = Field(None, description="Defaults to the time the record is queued")
+
+class UsageCounters(BaseModel):
+    request_count: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+class UsageBucketRead(UsageCounters):
+    bucket: datetime
+
+class UsageTotalRead(UsageCounters):
+    api_key_id: UUID
+    model_implementation_id: UUID
+
+class UsageCostRead(BaseModel):
+    api_key_id: UUID
+    model_implementation_id: UUID
+    request_count: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    cost: Optional[float] = Field(None, description="None when the implementation has no usable pricing_info")
+    currency: Optional[str] = None
+
@@ -1,22 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status, Path
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, Path
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 
 from app.db.database import get_db
 from app.models.schemas import ApiKeyCreate, ApiKeyRead, ApiKeyUpdate, ApiKeyReadWithMaskedKey
 from app.services.provider_service import ApiKeyService, ProviderService
+from app.services.pagination import NEXT_CURSOR_HEADER, InvalidCursorError
 
 router = APIRouter(tags=["api_keys"])
 
 @router.get("/providers/{provider_id}/keys", response_model=List[ApiKeyReadWithMaskedKey])
 def get_provider_api_keys(
     provider_id: UUID,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header of the previous page"),
     db: Session = Depends(get_db)
 ):
-    """Get all API keys for a specific provider with pagination."""
+    """Get all API keys for a specific provider ordered by sort order, with pagination."""
     # Check if provider exists
     provider = ProviderService.get_provider(db, provider_id)
     if provider is None:
@@ -25,7 +28,15 @@ def get_provider_api_keys(
             detail=f"Provider with ID {provider_id} not found"
         )
     
-    api_keys = ApiKeyService.get_api_keys(db, provider_id, skip=skip, limit=limit)
+    try:
+        api_keys, next_cursor = ApiKeyService.get_api_key_page(db, provider_id, skip=skip, limit=limit, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Return masked API keys for security
     masked_keys = []
@@ -34,7 +45,8 @@ def get_provider_api_keys(
             "id": key.id,
             "provider_id": key.provider_id,
             "alias": key.alias,
-            "key_preview": ApiKeyService.mask_api_key(key.key)
+            "key_preview": ApiKeyService.mask_api_key(key.key),
+            "weight": key.weight
         })
     
     return masked_keys
@@ -61,7 +73,8 @@ def create_api_key(
         "id": db_api_key.id,
         "provider_id": db_api_key.provider_id,
         "alias": db_api_key.alias,
-        "key_preview": ApiKeyService.mask_api_key(db_api_key.key)
+        "key_preview": ApiKeyService.mask_api_key(db_api_key.key),
+        "weight": db_api_key.weight
     }
 
 @router.get("/providers/{provider_id}/keys/{api_key_id}", response_model=ApiKeyReadWithMaskedKey)
@@ -82,7 +95,8 @@ def get_api_key(
         "id": api_key.id,
         "provider_id": api_key.provider_id,
         "alias": api_key.alias,
-        "key_preview": ApiKeyService.mask_api_key(api_key.key)
+        "key_preview": ApiKeyService.mask_api_key(api_key.key),
+        "weight": api_key.weight
     }
 
 @router.put("/providers/{provider_id}/keys/{api_key_id}", response_model=ApiKeyReadWithMaskedKey)
@@ -107,7 +121,8 @@ def update_api_key(
         "id": updated_api_key.id,
         "provider_id": updated_api_key.provider_id,
         "alias": updated_api_key.alias,
-        "key_preview": ApiKeyService.mask_api_key(updated_api_key.key)
+        "key_preview": ApiKeyService.mask_api_key(updated_api_key.key),
+        "weight": updated_api_key.weight
     }
 
 @router.delete("/providers/{provider_id}/keys/{api_key_id}", status_code=status.HTTP_204_NO_CONTENT)
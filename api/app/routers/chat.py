@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+from uuid import UUID, uuid4
+
+from app.models.schemas import ChatFanoutRequest
+from app.services.chat_fanout import FANOUT_ID_HEADER, MAX_MODELS, FanoutPrompt, chat_fanout
+from app.services.model_router import ImplementationNotFoundError
+
+router = APIRouter(prefix="/chat", tags=["chat"])
+
+@router.post("/fanout")
+def chat_fanout_stream(request: ChatFanoutRequest):
+    """
+    Ask several model implementations the same prompt concurrently and stream
+    their answers back as server-sent events tagged with implementation_id.
+    """
+    if len(request.implementation_ids) > MAX_MODELS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_MODELS} implementations can be asked at once"
+        )
+    try:
+        routes = [chat_fanout.router.route(implementation_id) for implementation_id in request.implementation_ids]
+    except ImplementationNotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+
+    messages = [{"role": "system", "content": request.system_prompt}] if request.system_prompt else []
+    messages.append({"role": "user", "content": request.prompt})
+    prompt = FanoutPrompt(messages=messages, temperature=request.temperature, max_tokens=request.max_tokens)
+    fanout_id = uuid4()
+    return StreamingResponse(
+        chat_fanout.stream(fanout_id, routes, prompt),
+        media_type="text/event-stream",
+        headers={FANOUT_ID_HEADER: str(fanout_id), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.delete("/fanout/{fanout_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_chat_fanout(fanout_id: UUID):
+    """Cancel every model still answering in a fan-out."""
+    # Runs on the event loop, since tasks may only be cancelled from their own loop
+    if not chat_fanout.cancel(fanout_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No running fan-out with ID {fanout_id}"
+        )
+    return None
+
+@router.delete("/fanout/{fanout_id}/models/{implementation_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_chat_fanout_model(fanout_id: UUID, implementation_id: UUID):
+    """Cancel one model of a fan-out while the others keep streaming."""
+    if not chat_fanout.cancel(fanout_id, implementation_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Implementation {implementation_id} is not running in fan-out {fanout_id}"
+        )
+    return None
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import List, Optional
 from uuid import UUID
 
 from app.db.database import get_db
-from app.models.schemas import FreeQuota, FreeQuotaCreate, FreeQuotaUpdate
+from app.models.schemas import FreeQuota, FreeQuotaCreate, FreeQuotaUpdate, FreeQuotaRemaining
+from app.services import free_quota_service
 from app.services.free_quota_service import FreeQuotaService
+from app.services.free_quota_ledger import free_quota_ledger
 from app.services.provider_service import ProviderService
 
 router = APIRouter(tags=["free_quotas"])
@@ -34,6 +36,22 @@ def get_provider_free_quota(
     
     return free_quota
 
+@router.get("/providers/{provider_id}/free-quota/remaining", response_model=List[FreeQuotaRemaining])
+def get_provider_remaining_free_quota(
+    provider_id: UUID,
+    db: Session = Depends(get_db)
+):
+    """Get the remaining free quota of every API key of a provider."""
+    # Verify provider exists
+    provider = ProviderService.get_provider(db, provider_id)
+    if not provider:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Provider with ID {provider_id} not found"
+        )
+    
+    return free_quota_service.get_provider_remaining_quotas(db, provider_id)
+
 @router.post("/providers/{provider_id}/free-quota", response_model=FreeQuota, status_code=status.HTTP_201_CREATED)
 def create_provider_free_quota(
     provider_id: UUID,
@@ -73,6 +91,7 @@ def create_provider_free_quota(
             detail="Failed to create free quota"
         )
     
+    free_quota_ledger.invalidate()
     return db_free_quota
 
 @router.put("/providers/{provider_id}/free-quota/{quota_id}", response_model=FreeQuota)
@@ -91,6 +110,7 @@ def update_provider_free_quota(
             detail=f"Free quota with ID {quota_id} not found for provider {provider_id}"
         )
     
+    free_quota_ledger.invalidate()
     return db_free_quota
 
 @router.delete("/providers/{provider_id}/free-quota/{quota_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -108,4 +128,5 @@ def delete_provider_free_quota(
             detail=f"Free quota with ID {quota_id} not found for provider {provider_id}"
         )
     
+    free_quota_ledger.invalidate()
     return None
\ No newline at end of file
@@ -1,36 +1,137 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Union
 from uuid import UUID
 
 from app.db.database import get_db
 from app.models.schemas import (
-    ModelCreate, ModelRead, ModelDetailedRead, ModelUpdate, ModelListRead, 
+    ModelCreate, ModelRead, ModelDetailedRead, ModelUpdate, ModelListRead, ModelListWithImplementationsRead,
     ModelImplementationCreate, ModelImplementationRead, ModelImplementationUpdate,
-    OrderUpdate
+    ModelRouteRead, RouteOutcome, OrderUpdate
 )
 from app.services.model_service import ModelService, ModelImplementationService
+from app.services.provider_service import ApiKeyService
+from app.services.api_key_pool import KeySelectionStrategy
+from app.services.model_router import (
+    model_router, ImplementationNotFoundError, ModelNotFoundError, NoRouteAvailableError, RoutingPolicy
+)
+from app.services.free_quota_ledger import free_quota_ledger
+from app.services.pricing import pricing_engine
+from app.services.pagination import NEXT_CURSOR_HEADER, InvalidCursorError
 
 router = APIRouter(prefix="/models", tags=["models"])
 
-@router.get("/", response_model=List[ModelListRead])
+@router.get("/", response_model=List[Union[ModelListWithImplementationsRead, ModelListRead]])
 def get_models(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header of the previous page"),
+    include: Optional[str] = Query(None, pattern="^implementations$", description="Set to 'implementations' to embed each model's implementations"),
     db: Session = Depends(get_db)
 ):
-    """Get all models with pagination and implementation counts."""
-    models = ModelService.get_models(db, skip=skip, limit=limit)
-    
-    # Transform the models to include implementation count
-    result = []
-    for model in models:
-        model_data = ModelListRead.model_validate(model)
-        model_data.implementations_count = len(model.implementations)
-        result.append(model_data)
+    """Get all models ordered by name, with pagination and implementation counts."""
+    try:
+        if include != "implementations":
+            result, next_cursor = ModelService.get_models_with_implementation_counts(db, skip=skip, limit=limit, cursor=cursor)
+        else:
+            models, next_cursor = ModelService.get_models_with_implementations(db, skip=skip, limit=limit, cursor=cursor)
+            
+            # Implementations are already loaded, so counting them costs no extra queries
+            result = []
+            for model in models:
+                model_data = ModelListWithImplementationsRead.model_validate(model)
+                model_data.implementations_count = len(model.implementations)
+                result.append(model_data)
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     return result
 
+@router.get("/routes/{model_name}", response_model=List[ModelRouteRead])
+def get_model_routes(
+    model_name: str,
+    strategy: Optional[KeySelectionStrategy] = Query(None, description="API key selection strategy, defaults to API_KEY_POOL_STRATEGY"),
+    policy: Optional[RoutingPolicy] = Query(None, description="Route ordering policy, defaults to MODEL_ROUTER_POLICY")
+):
+    """
+    Resolve a model name to its available implementations, best first, each
+    with its provider endpoint and the API key selected for the next call.
+    Keys are identified by api_key_id and a masked preview, never returned
+    in plain text.
+    Served from the in-memory routing snapshot without querying the database.
+
+    The first route is taken for the caller's next call: its key advances
+    the key rotation of its provider, and when its circuit is half-open it
+    holds the probe slot (probe is true) until the call's outcome is
+    reported to /models/routes/outcomes. Fallback routes are only listed
+    while their circuits are closed.
+    """
+    try:
+        resolved = model_router.claim(model_name, strategy, policy=policy)
+    except ModelNotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except NoRouteAvailableError as e:
+        headers = {"Retry-After": str(max(1, round(e.retry_after)))} if e.retry_after is not None else None
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers=headers
+        )
+    
+    return [
+        ModelRouteRead(
+            implementation_id=item.route.implementation_id,
+            provider_id=item.route.provider_id,
+            provider_name=item.route.provider_name,
+            base_url=item.route.base_url,
+            provider_model_id=item.route.provider_model_id,
+            context_window=item.route.context_window,
+            pricing_info=item.route.pricing_info,
+            custom_parameters=item.route.custom_parameters,
+            api_key_id=item.api_key.id,
+            api_key_alias=item.api_key.alias,
+            key_preview=ApiKeyService.mask_api_key(item.api_key.key),
+            score=item.score,
+            probe=item.probe,
+        )
+        for item in resolved
+    ]
+
+@router.post("/routes/outcomes", status_code=status.HTTP_204_NO_CONTENT)
+def report_route_outcome(outcome: RouteOutcome):
+    """
+    Report how a call through a resolved route went. Feeds the latency and
+    error rate averages used for routing and the health of the API key, and
+    debits the reported tokens from the key's free quotas.
+    """
+    latency = outcome.latency_ms / 1000 if outcome.latency_ms is not None else None
+    model_router.report(outcome.implementation_id, latency, outcome.success)
+    if outcome.api_key_id is not None:
+        if outcome.success:
+            model_router.key_pool.report_success(outcome.api_key_id)
+        else:
+            model_router.key_pool.report_failure(outcome.api_key_id, outcome.status_code, outcome.retry_after)
+        prompt_tokens, completion_tokens = outcome.prompt_tokens or 0, outcome.completion_tokens or 0
+        if prompt_tokens or completion_tokens:
+            try:
+                route = model_router.route(outcome.implementation_id)
+            except ImplementationNotFoundError:
+                return None
+            cost = pricing_engine.cost(route.implementation_id, prompt_tokens, completion_tokens)
+            free_quota_ledger.record_usage(
+                outcome.api_key_id, route.provider_id, route.implementation_id, prompt_tokens + completion_tokens, cost
+            )
+    return None
+
 @router.get("/{model_id}", response_model=ModelDetailedRead)
 def get_model(
     model_id: UUID,
@@ -114,11 +215,27 @@ def delete_model(
 
 @router.get("/{model_id}/implementations", response_model=List[ModelImplementationRead])
 def get_model_implementations(
-    model_id: str,
+    model_id: UUID,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header of the previous page"),
+    provider_id: Optional[UUID] = Query(None, description="Only implementations served by this provider"),
     db: Session = Depends(get_db)
 ):
-    """Get all implementations for a specific model."""
-    implementations = ModelImplementationService.get_model_implementations(db, model_id)
+    """Get the implementations of a specific model ordered by sort order, with pagination."""
+    try:
+        implementations, next_cursor = ModelImplementationService.get_implementation_page(
+            db, skip=skip, limit=limit, cursor=cursor, model_id=model_id, provider_id=provider_id
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
     return implementations
 
 @router.post("/{model_id}/implementations", response_model=ModelImplementationRead, status_code=status.HTTP_201_CREATED)
@@ -1,30 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 
 from app.db.database import get_db
 from app.models.schemas import ModelProviderCreate, ModelProviderRead, ModelProviderDetailedRead, ModelProviderUpdate, ModelProviderListRead, OrderUpdate
 from app.services.provider_service import ProviderService, ApiKeyService
 from app.services import free_quota_service
+from app.services.pagination import NEXT_CURSOR_HEADER, InvalidCursorError
 from app.models.provider import ApiKey
 
 router = APIRouter(prefix="/providers", tags=["providers"])
 
 @router.get("/", response_model=List[ModelProviderListRead])
 def get_providers(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the {NEXT_CURSOR_HEADER} header of the previous page"),
     db: Session = Depends(get_db)
 ):
-    """Get all model providers with pagination and API key counts."""
-    providers = ProviderService.get_providers(db, skip=skip, limit=limit)
+    """Get all model providers ordered by name, with pagination and API key counts."""
+    try:
+        providers, next_cursor = ProviderService.get_providers_with_key_counts(db, skip=skip, limit=limit, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Transform the providers to include API key count
     result = []
-    for provider in providers:
+    for provider, api_keys_count in providers:
         provider_data = ModelProviderListRead.model_validate(provider)
-        provider_data.api_keys_count = len(provider.api_keys)
+        provider_data.api_keys_count = api_keys_count
         result.append(provider_data)
     
     return result
@@ -54,7 +65,8 @@ def get_provider(
             "provider_id": key.provider_id,
             "alias": key.alias,
             "key_preview": ApiKeyService.mask_api_key(key.key),
-            "sort_order": key.sort_order
+            "sort_order": key.sort_order,
+            "weight": key.weight
         }
         for key in provider.api_keys
     ]
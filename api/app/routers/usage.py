@@ -0,0 +1,78 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from typing import List, Optional, Tuple
+from uuid import UUID
+from datetime import datetime, timedelta, timezone
+
+from app.db.database import get_db
+from app.models.provider import RollupGranularity
+from app.models.schemas import UsageBucketRead, UsageTotalRead, UsageCostRead
+from app.services import usage_rollup_service
+from app.services.pricing import pricing_engine
+
+router = APIRouter(prefix="/usage", tags=["usage"])
+
+DEFAULT_WINDOW = timedelta(days=30)
+
+def resolve_window(start: Optional[datetime], end: Optional[datetime]) -> Tuple[datetime, datetime]:
+    """Default to the last 30 days and reject empty windows."""
+    end = usage_rollup_service.as_utc(end) if end else datetime.now(timezone.utc)
+    start = usage_rollup_service.as_utc(start) if start else end - DEFAULT_WINDOW
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must be earlier than end"
+        )
+    return start, end
+
+@router.get("/timeseries", response_model=List[UsageBucketRead])
+def get_usage_timeseries(
+    granularity: RollupGranularity = Query(RollupGranularity.DAY),
+    start: Optional[datetime] = Query(None, description="Window start, widened to the start of its bucket, defaults to 30 days before end"),
+    end: Optional[datetime] = Query(None, description="Window end (exclusive), widened to the end of its bucket, defaults to now"),
+    api_key_id: Optional[UUID] = None,
+    model_implementation_id: Optional[UUID] = None,
+    db: Session = Depends(get_db)
+):
+    """Get token usage per hour or day, served from the usage rollups."""
+    start, end = resolve_window(start, end)
+    return usage_rollup_service.get_usage_timeseries(
+        db, granularity, start, end,
+        api_key_id=api_key_id,
+        model_implementation_id=model_implementation_id
+    )
+
+@router.get("/totals", response_model=List[UsageTotalRead])
+def get_usage_totals(
+    start: Optional[datetime] = Query(None, description="Window start, defaults to 30 days before end"),
+    end: Optional[datetime] = Query(None, description="Window end (exclusive), defaults to now"),
+    api_key_id: Optional[UUID] = None,
+    model_implementation_id: Optional[UUID] = None,
+    db: Session = Depends(get_db)
+):
+    """Get token usage totals per API key and model implementation, served from the usage rollups."""
+    start, end = resolve_window(start, end)
+    return usage_rollup_service.get_usage_totals(
+        db, start, end,
+        api_key_id=api_key_id,
+        model_implementation_id=model_implementation_id
+    )
+
+@router.get("/costs", response_model=List[UsageCostRead])
+def get_usage_costs(
+    start: Optional[datetime] = Query(None, description="Window start, defaults to 30 days before end"),
+    end: Optional[datetime] = Query(None, description="Window end (exclusive), defaults to now"),
+    api_key_id: Optional[UUID] = None,
+    model_implementation_id: Optional[UUID] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Get token counts and cost per API key and model implementation, computed
+    from the raw usage rows and each implementation's pricing_info.
+    """
+    start, end = resolve_window(start, end)
+    return pricing_engine.cost_report(
+        db, start, end,
+        api_key_id=api_key_id,
+        model_implementation_id=model_implementation_id
+    )
@@ -0,0 +1,301 @@
+from sqlalchemy.orm import Session, sessionmaker
+from uuid import UUID
+from typing import Callable, Dict, List, Optional
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import enum
+import os
+import threading
+import time
+
+from app.db.database import SessionLocal
+from app.models.provider import ApiKey
+from app.services.free_quota_ledger import free_quota_ledger
+
+# Strategy used when select() is not given one
+DEFAULT_STRATEGY = os.getenv("API_KEY_POOL_STRATEGY", "PRIORITY")
+# How often every pool is reloaded, picking up key changes made by other workers
+REFRESH_INTERVAL_SECONDS = float(os.getenv("API_KEY_POOL_REFRESH_INTERVAL_SECONDS", "60"))
+# Cooldown after a 429 without a Retry-After header
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv("API_KEY_POOL_RATE_LIMIT_COOLDOWN_SECONDS", "60"))
+# Cooldown after the first 5xx or connection failure; doubles per consecutive failure
+ERROR_COOLDOWN_SECONDS = float(os.getenv("API_KEY_POOL_ERROR_COOLDOWN_SECONDS", "5"))
+MAX_COOLDOWN_SECONDS = float(os.getenv("API_KEY_POOL_MAX_COOLDOWN_SECONDS", "300"))
+
+
+class KeySelectionStrategy(str, enum.Enum):
+    PRIORITY = "PRIORITY"                         # 按 sort_order 优先，其余作为备份
+    WEIGHTED_ROUND_ROBIN = "WEIGHTED_ROUND_ROBIN" # 按权重轮询
+    LEAST_RECENTLY_USED = "LEAST_RECENTLY_USED"   # 最久未使用优先
+
+    def __str__(self):
+        return self.value
+
+
+class NoApiKeyAvailableError(RuntimeError):
+    """Raised when every key of a provider is cooling down or out of free quota."""
+
+    def __init__(self, provider_id: UUID, retry_after: Optional[float] = None):
+        self.provider_id = provider_id
+        self.retry_after = retry_after
+        message = f"No API key available for provider {provider_id}"
+        if retry_after is not None:
+            message += f", retry in {retry_after:.1f}s"
+        super().__init__(message)
+
+
+@dataclass
+class PooledKey:
+    id: UUID
+    provider_id: UUID
+    alias: str
+    key: str
+    sort_order: int
+    weight: int
+    # Health state, kept across refreshes
+    failures: int = 0
+    cooldown_until: float = 0  # time.monotonic() deadline
+
+    def available(self, now: float) -> bool:
+        return self.cooldown_until <= now
+
+
+@dataclass
+class _ProviderPool:
+    keys: List[PooledKey]                # Priority order
+    schedule: List[PooledKey]            # Smooth weighted round-robin sequence
+    position: int = 0
+    recent: "OrderedDict[UUID, PooledKey]" = field(default_factory=OrderedDict)  # Least recently used first
+
+
+def _weighted_schedule(keys: List[PooledKey]) -> List[PooledKey]:
+    """Interleave keys in proportion to their weights (nginx smooth weighted round-robin)."""
+    total = sum(key.weight for key in keys)
+    current = {key.id: 0 for key in keys}
+    schedule = []
+    for _ in range(total):
+        for key in keys:
+            current[key.id] += key.weight
+        chosen = max(keys, key=lambda key: current[key.id])
+        current[chosen.id] -= total
+        schedule.append(chosen)
+    return schedule
+
+
+class ApiKeyPool:
+    """
+    In-memory pools of API keys per provider that hand out one key per upstream call.
+
+    Pools are built from the database on first use and rebuilt when
+    invalidate() is called after a key changes or on the periodic refresh(), so
+    select() never queries the database. Keys that reported a 429 or 5xx cool
+    down for a while, and keys whose free quota is used up according to the
+    free quota ledger are skipped. Selection is O(1) while the preferred key is
+    healthy and only scans further when keys are skipped.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        is_exhausted: Callable[[UUID, UUID, Optional[UUID]], bool] = free_quota_ledger.is_exhausted,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.session_factory = session_factory
+        self.is_exhausted = is_exhausted
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pools: Dict[UUID, _ProviderPool] = {}
+        self._keys: Dict[UUID, PooledKey] = {}
+
+    def select(
+        self,
+        provider_id: UUID,
+        strategy: Optional[KeySelectionStrategy] = None,
+        model_implementation_id: Optional[UUID] = None,
+        skip_exhausted: bool = True,
+    ) -> PooledKey:
+        """
+        Pick a key of the provider for one call and advance the rotation past it.
+
+        Raises NoApiKeyAvailableError when the provider has no usable key.
+        """
+        strategy = KeySelectionStrategy(strategy or DEFAULT_STRATEGY)
+        pool = self._pool(provider_id)
+        with self._lock:
+            chosen = self._choose(pool, provider_id, strategy, model_implementation_id, skip_exhausted)
+            self._advance(pool, chosen, strategy)
+            return chosen
+
+    def peek(
+        self,
+        provider_id: UUID,
+        strategy: Optional[KeySelectionStrategy] = None,
+        model_implementation_id: Optional[UUID] = None,
+        skip_exhausted: bool = True,
+    ) -> PooledKey:
+        """
+        The key select() would pick, leaving the rotation untouched, for
+        listing routes that may not be called. take() advances the rotation
+        once the key is actually used.
+
+        Raises NoApiKeyAvailableError when the provider has no usable key.
+        """
+        strategy = KeySelectionStrategy(strategy or DEFAULT_STRATEGY)
+        pool = self._pool(provider_id)
+        with self._lock:
+            return self._choose(pool, provider_id, strategy, model_implementation_id, skip_exhausted)
+
+    def take(self, key: PooledKey, strategy: Optional[KeySelectionStrategy] = None) -> None:
+        """Advance the rotation past a key returned by peek(), as select() would have."""
+        strategy = KeySelectionStrategy(strategy or DEFAULT_STRATEGY)
+        with self._lock:
+            pool = self._pools.get(key.provider_id)
+            # The pool may have been rebuilt without the key since it was peeked
+            if pool is not None and key.id in pool.recent:
+                self._advance(pool, key, strategy)
+
+    def report_success(self, api_key_id: UUID) -> None:
+        """Clear the failure streak of a key after a successful call."""
+        with self._lock:
+            key = self._keys.get(api_key_id)
+            if key:
+                key.failures = 0
+                key.cooldown_until = 0
+
+    def report_failure(self, api_key_id: UUID, status_code: Optional[int] = None, retry_after: Optional[float] = None) -> None:
+        """
+        Put a key on cooldown after a failed call.
+
+        429 responses cool down for retry_after seconds (or the rate limit
+        default). Other failures back off exponentially with each consecutive
+        failure. Client errors other than 429 are not the key's health problem
+        and are ignored.
+        """
+        if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+            return
+        with self._lock:
+            key = self._keys.get(api_key_id)
+            if key is None:
+                return
+            key.failures += 1
+            if status_code == 429:
+                cooldown = retry_after if retry_after is not None else RATE_LIMIT_COOLDOWN_SECONDS
+            else:
+                cooldown = ERROR_COOLDOWN_SECONDS * 2 ** (key.failures - 1)
+            key.cooldown_until = self.clock() + min(cooldown, MAX_COOLDOWN_SECONDS)
+
+    def invalidate(self, provider_id: Optional[UUID] = None) -> None:
+        """Drop the pool of a provider (or all pools) so the next select() reloads it."""
+        with self._lock:
+            if provider_id is None:
+                self._pools.clear()
+            else:
+                self._pools.pop(provider_id, None)
+
+    def refresh(self) -> None:
+        """Rebuild the pools of every provider; run periodically by the FastAPI lifespan."""
+        db = self.session_factory()
+        try:
+            keys = db.query(ApiKey).order_by(ApiKey.provider_id, ApiKey.sort_order, ApiKey.id).all()
+            grouped: Dict[UUID, List[ApiKey]] = {}
+            for key in keys:
+                grouped.setdefault(key.provider_id, []).append(key)
+        finally:
+            db.close()
+        with self._lock:
+            # Forget the health of deleted keys
+            previous, self._keys = self._keys, {}
+            self._pools = {provider_id: self._build(rows, previous) for provider_id, rows in grouped.items()}
+
+    def _pool(self, provider_id: UUID) -> _ProviderPool:
+        pool = self._pools.get(provider_id)
+        if pool is None:
+            pool = self._load_provider(provider_id)
+        return pool
+
+    def _choose(
+        self,
+        pool: _ProviderPool,
+        provider_id: UUID,
+        strategy: KeySelectionStrategy,
+        model_implementation_id: Optional[UUID],
+        skip_exhausted: bool,
+    ) -> PooledKey:
+        # Called with the lock held; leaves the rotation untouched
+        now = self.clock()
+
+        def usable(key: PooledKey) -> bool:
+            if not key.available(now):
+                return False
+            return not (skip_exhausted and self.is_exhausted(key.id, provider_id, model_implementation_id))
+
+        chosen = None
+        if strategy == KeySelectionStrategy.PRIORITY:
+            chosen = next((key for key in pool.keys if usable(key)), None)
+        elif strategy == KeySelectionStrategy.WEIGHTED_ROUND_ROBIN:
+            size = len(pool.schedule)
+            for offset in range(size):
+                key = pool.schedule[(pool.position + offset) % size]
+                if usable(key):
+                    chosen = key
+                    break
+        else:
+            chosen = next((key for key in pool.recent.values() if usable(key)), None)
+
+        if chosen is None:
+            cooling = [key.cooldown_until - now for key in pool.keys if not key.available(now)]
+            raise NoApiKeyAvailableError(provider_id, min(cooling) if cooling else None)
+        return chosen
+
+    @staticmethod
+    def _advance(pool: _ProviderPool, key: PooledKey, strategy: KeySelectionStrategy) -> None:
+        # Called with the lock held
+        if strategy == KeySelectionStrategy.WEIGHTED_ROUND_ROBIN:
+            size = len(pool.schedule)
+            for offset in range(size):
+                index = (pool.position + offset) % size
+                if pool.schedule[index].id == key.id:
+                    pool.position = (index + 1) % size
+                    break
+        pool.recent.move_to_end(key.id)
+
+    def _load_provider(self, provider_id: UUID) -> _ProviderPool:
+        db = self.session_factory()
+        try:
+            rows = self._query_keys(db, provider_id)
+        finally:
+            db.close()
+        with self._lock:
+            pool = self._pools[provider_id] = self._build(rows, self._keys)
+        return pool
+
+    @staticmethod
+    def _query_keys(db: Session, provider_id: UUID) -> List[ApiKey]:
+        return db.query(ApiKey).filter(ApiKey.provider_id == provider_id).order_by(ApiKey.sort_order, ApiKey.id).all()
+
+    def _build(self, rows: List[ApiKey], health: Dict[UUID, PooledKey]) -> _ProviderPool:
+        # Called with the lock held; health state survives the rebuild
+        keys = []
+        for row in rows:
+            previous = health.get(row.id)
+            key = PooledKey(
+                id=row.id,
+                provider_id=row.provider_id,
+                alias=row.alias,
+                key=row.key,
+                sort_order=row.sort_order or 0,
+                weight=max(1, row.weight or 1),
+                failures=previous.failures if previous else 0,
+                cooldown_until=previous.cooldown_until if previous else 0,
+            )
+            self._keys[key.id] = key
+            keys.append(key)
+        return _ProviderPool(
+            keys=keys,
+            schedule=_weighted_schedule(keys),
+            recent=OrderedDict((key.id, key) for key in keys),
+        )
+
+
+# Process-wide pool refreshed by the FastAPI lifespan
+api_key_pool = ApiKeyPool()
@@ -0,0 +1,283 @@
+from uuid import UUID
+from typing import Any, AsyncIterator, Dict, List, Optional
+from dataclasses import dataclass
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from app.models.schemas import ApiKeyUsageCreate
+from app.services.api_key_pool import NoApiKeyAvailableError, PooledKey
+from app.services.free_quota_ledger import FreeQuotaLedger, free_quota_ledger
+from app.services.model_router import ModelRouter, Route, model_router
+from app.services.pricing import PricingEngine, pricing_engine
+from app.services.rate_limiter import RateLimiter, RateLimitExceeded, rate_limiter
+from app.services.usage_recorder import UsageRecorder, usage_recorder
+
+# Response header carrying the ID used to cancel single models of a fan-out
+FANOUT_ID_HEADER = "X-Fanout-Id"
+# Most implementations one fan-out request may ask
+MAX_MODELS = int(os.getenv("CHAT_FANOUT_MAX_MODELS", "8"))
+# Timeouts of upstream calls; the read timeout applies between streamed chunks
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("CHAT_FANOUT_CONNECT_TIMEOUT_SECONDS", "10"))
+READ_TIMEOUT_SECONDS = float(os.getenv("CHAT_FANOUT_READ_TIMEOUT_SECONDS", "60"))
+# Longest a model waits for rate limit budget before it is reported as failed
+MAX_QUEUE_SECONDS = float(os.getenv("CHAT_FANOUT_MAX_QUEUE_SECONDS", "10"))
+
+# Marks the end of one model's events in the shared queue
+_FINISHED = object()
+
+
+class UpstreamError(RuntimeError):
+    """Raised when an upstream call fails or is refused before it is made."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+@dataclass
+class FanoutPrompt:
+    """What every model of a fan-out is asked."""
+    messages: List[Dict[str, str]]
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class ChatFanout:
+    """
+    Asks several model implementations the same prompt at once and
+    multiplexes their token streams into one server-sent event stream.
+
+    Each implementation runs as its own task calling the provider's
+    OpenAI-compatible /chat/completions endpoint with streaming enabled, so a
+    slow or failing model never holds up the others. Every event carries the
+    implementation_id it belongs to. A model can be cancelled on its own while
+    the rest keep streaming; closing the connection cancels all of them.
+
+    Calls go through the same machinery as routed calls: keys come from the
+    API key pool, open circuits are refused without calling upstream, rate
+    limit budgets are acquired first, and each outcome is reported to the
+    router, recorded as usage and debited from the key's free quotas.
+    In-flight fan-outs are tracked per process.
+    """
+
+    def __init__(
+        self,
+        router: ModelRouter = model_router,
+        limiter: RateLimiter = rate_limiter,
+        recorder: UsageRecorder = usage_recorder,
+        ledger: FreeQuotaLedger = free_quota_ledger,
+        pricing: PricingEngine = pricing_engine,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.router = router
+        self.limiter = limiter
+        self.recorder = recorder
+        self.ledger = ledger
+        self.pricing = pricing
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._fanouts: Dict[UUID, Dict[UUID, asyncio.Task]] = {}
+
+    def cancel(self, fanout_id: UUID, implementation_id: Optional[UUID] = None) -> bool:
+        """Cancel one model of a fan-out, or all of them. False if nothing was still running."""
+        tasks = self._fanouts.get(fanout_id, {})
+        if implementation_id is not None:
+            tasks = {implementation_id: tasks[implementation_id]} if implementation_id in tasks else {}
+        return sum(task.cancel() for task in tasks.values()) > 0
+
+    async def stream(self, fanout_id: UUID, routes: List[Route], prompt: FanoutPrompt) -> AsyncIterator[str]:
+        """Server-sent events of all models, in the order they arrive, ending with an "end" event."""
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[UUID, asyncio.Task] = {}
+        for route in routes:
+            task = asyncio.create_task(self._call(route, prompt, queue.put_nowait))
+            # Runs even when the task is cancelled before it starts
+            task.add_done_callback(lambda task, route=route: self._finished(task, route, queue))
+            tasks[route.implementation_id] = task
+        self._fanouts[fanout_id] = tasks
+
+        try:
+            yield sse_event("fanout", {
+                "fanout_id": fanout_id,
+                "implementation_ids": [route.implementation_id for route in routes],
+            })
+            remaining = len(tasks)
+            while remaining:
+                event = await queue.get()
+                if event is _FINISHED:
+                    remaining -= 1
+                    continue
+                yield sse_event(*event)
+            yield sse_event("end", {"fanout_id": fanout_id})
+        finally:
+            # The client went away or every model is done
+            self._fanouts.pop(fanout_id, None)
+            for task in tasks.values():
+                task.cancel()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _finished(task: asyncio.Task, route: Route, queue: asyncio.Queue) -> None:
+        if task.cancelled():
+            queue.put_nowait(("cancelled", {"implementation_id": route.implementation_id}))
+        queue.put_nowait(_FINISHED)
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=self.transport,
+                timeout=httpx.Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            )
+        return self._client
+
+    async def _call(self, route: Route, prompt: FanoutPrompt, emit) -> None:
+        implementation_id = route.implementation_id
+        api_key: Optional[PooledKey] = None
+        started, first_token = None, None
+        # Whether this call holds probe slots of half-open circuits until its outcome is reported
+        admitted = False
+        try:
+            try:
+                api_key = self.router.key_pool.select(route.provider_id, model_implementation_id=implementation_id)
+            except NoApiKeyAvailableError as e:
+                raise UpstreamError(str(e), retry_after=e.retry_after)
+            if not self.router.breakers.allow(route.provider_id, implementation_id):
+                raise UpstreamError(
+                    "Circuit open", retry_after=self.router.breakers.retry_after(route.provider_id, implementation_id)
+                )
+            admitted = True
+            try:
+                await self.limiter.acquire(route.provider_id, api_key.id, implementation_id, max_wait=MAX_QUEUE_SECONDS)
+            except RateLimitExceeded as e:
+                raise UpstreamError(str(e), retry_after=e.retry_after)
+
+            emit(("start", {
+                "implementation_id": implementation_id,
+                "provider_name": route.provider_name,
+                "provider_model_id": route.provider_model_id,
+            }))
+            started = time.monotonic()
+            usage, finish_reason = None, None
+            async for chunk in self._chunks(route, api_key, prompt):
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                    content = (choice.get("delta") or {}).get("content")
+                    if not content:
+                        continue
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                        emit(("first_token", {
+                            "implementation_id": implementation_id, "latency_ms": round(first_token * 1000),
+                        }))
+                    emit(("delta", {"implementation_id": implementation_id, "content": content}))
+        except asyncio.CancelledError:
+            # Cancelling is no outcome, but the probe slot must not stay taken until it times out
+            if admitted:
+                self.router.breakers.release(route.provider_id, implementation_id)
+            raise
+        except Exception as e:
+            # Anything else, e.g. a chunk that is not a JSON object, still ends this model's stream with an outcome
+            if not isinstance(e, (UpstreamError, httpx.HTTPError, ValueError)):
+                print(f"Warning: fan-out call to implementation {implementation_id} failed: {e!r}")
+            status_code = getattr(e, "status_code", None)
+            retry_after = getattr(e, "retry_after", None)
+            emit(("error", {
+                "implementation_id": implementation_id,
+                "error": str(e) or type(e).__name__,
+                "status_code": status_code,
+                "retry_after": retry_after,
+            }))
+            # Refusals before the upstream call say nothing about the implementation's health
+            if started is not None:
+                self.router.report(implementation_id, None, success=False)
+                self.router.key_pool.report_failure(api_key.id, status_code, retry_after)
+            elif admitted:
+                self.router.breakers.release(route.provider_id, implementation_id)
+            return
+
+        latency = time.monotonic() - started
+        emit(("done", {
+            "implementation_id": implementation_id,
+            "latency_ms": round(latency * 1000),
+            "first_token_ms": round(first_token * 1000) if first_token is not None else None,
+            "finish_reason": finish_reason,
+            "usage": usage,
+        }))
+        self.router.report(implementation_id, latency, success=True)
+        self.router.key_pool.report_success(api_key.id)
+        if usage:
+            await self._record_usage(route, api_key, usage)
+
+    async def _chunks(self, route: Route, api_key: PooledKey, prompt: FanoutPrompt) -> AsyncIterator[Dict[str, Any]]:
+        """Parsed chunks of one streamed OpenAI-compatible chat completion."""
+        body: Dict[str, Any] = {
+            "model": route.provider_model_id,
+            "messages": prompt.messages,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        if prompt.temperature is not None:
+            body["temperature"] = prompt.temperature
+        if prompt.max_tokens is not None:
+            body["max_tokens"] = prompt.max_tokens
+        url = route.base_url.rstrip("/") + "/chat/completions"
+        headers = {"Authorization": f"Bearer {api_key.key}", "Accept": "text/event-stream"}
+        async with self._http().stream("POST", url, json=body, headers=headers) as response:
+            if response.status_code >= 400:
+                detail = (await response.aread()).decode(errors="replace")[:500]
+                raise UpstreamError(
+                    f"Upstream returned {response.status_code}: {detail}", response.status_code, _retry_after(response)
+                )
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)
+
+    async def _record_usage(self, route: Route, api_key: PooledKey, usage: Dict[str, Any]) -> None:
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        total_tokens = usage.get("total_tokens") or prompt_tokens + completion_tokens
+        self.limiter.record_usage(route.provider_id, api_key.id, route.implementation_id, 0, total_tokens)
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        cost = self.pricing.cost(route.implementation_id, prompt_tokens, completion_tokens, cached_tokens)
+        self.ledger.record_usage(api_key.id, route.provider_id, route.implementation_id, total_tokens, cost)
+        if not self.recorder.running:
+            return
+        await self.recorder.record(ApiKeyUsageCreate(
+            api_key_id=api_key.id,
+            model_implementation_id=route.implementation_id,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=total_tokens,
+            prompt_tokens_details=usage.get("prompt_tokens_details"),
+            completion_tokens_details=usage.get("completion_tokens_details"),
+        ))
+
+
+# Process-wide fan-out service; cancellation only reaches fan-outs streamed by this process
+chat_fanout = ChatFanout()
@@ -0,0 +1,230 @@
+from uuid import UUID
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from dataclasses import dataclass
+import os
+import threading
+import time
+
+from app.models.provider import CircuitKind, CircuitState
+
+# Number of recent calls the failure and slow call rates are computed over
+WINDOW_SIZE = int(os.getenv("CIRCUIT_BREAKER_WINDOW_SIZE", "20"))
+# Calls needed in the window before a circuit may open
+MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "5"))
+# Share of failed calls that opens a circuit
+ERROR_RATE_THRESHOLD = float(os.getenv("CIRCUIT_BREAKER_ERROR_RATE_THRESHOLD", "0.5"))
+# Calls slower than this count as slow, and this share of slow calls opens a circuit
+SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL_SECONDS", "30"))
+SLOW_CALL_RATE_THRESHOLD = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL_RATE_THRESHOLD", "0.8"))
+# How long an open circuit rejects calls before letting probes through
+OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "30"))
+# Concurrent probe calls allowed while half-open
+HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_PROBES", "1"))
+# A probe whose outcome is never reported frees its slot after this long
+PROBE_TIMEOUT_SECONDS = float(os.getenv("CIRCUIT_BREAKER_PROBE_TIMEOUT_SECONDS", "60"))
+
+
+@dataclass
+class CircuitStatus:
+    """Point-in-time view of one breaker, for the admin endpoint."""
+    kind: CircuitKind
+    id: UUID
+    state: CircuitState
+    calls: int
+    error_rate: float
+    slow_call_rate: float
+    retry_after: Optional[float]  # Seconds until an open circuit lets probes through
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker over a sliding window of recent calls.
+
+    The circuit opens when, with at least MIN_CALLS in the window, the share
+    of failed or of slow calls reaches its threshold. After OPEN_SECONDS it
+    turns half-open and admits up to HALF_OPEN_PROBES probe calls: a healthy
+    probe closes it, a failed or slow one opens it again.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.state = CircuitState.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=WINDOW_SIZE)  # (failed, slow)
+        self._probes: List[float] = []  # Start times of probes in flight
+
+    def allow(self) -> bool:
+        """Whether a call may go through now; in half-open state this takes a probe slot."""
+        now = self.clock()
+        if self.state == CircuitState.OPEN:
+            if now - self.opened_at < OPEN_SECONDS:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            self._probes = []
+        if self.state == CircuitState.HALF_OPEN:
+            self._probes = [started for started in self._probes if now - started < PROBE_TIMEOUT_SECONDS]
+            if len(self._probes) >= HALF_OPEN_PROBES:
+                return False
+            self._probes.append(now)
+        return True
+
+    def available(self) -> bool:
+        """Whether allow() would let a call through, without taking a probe slot."""
+        now = self.clock()
+        if self.state == CircuitState.OPEN:
+            return now - self.opened_at >= OPEN_SECONDS and HALF_OPEN_PROBES > 0
+        if self.state == CircuitState.HALF_OPEN:
+            return sum(1 for started in self._probes if now - started < PROBE_TIMEOUT_SECONDS) < HALF_OPEN_PROBES
+        return True
+
+    def release(self) -> None:
+        """Give back a probe slot taken by allow() for a call that was never made."""
+        if self.state == CircuitState.HALF_OPEN and self._probes:
+            self._probes.pop()
+
+    def is_open(self) -> bool:
+        """Whether the circuit is open and still within its open period."""
+        return self.state == CircuitState.OPEN and self.clock() - self.opened_at < OPEN_SECONDS
+
+    @property
+    def calls(self) -> int:
+        return len(self._outcomes)
+
+    def record(self, success: bool, latency: Optional[float] = None) -> None:
+        slow = latency is not None and latency >= SLOW_CALL_SECONDS
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes:
+                self._probes.pop(0)
+            if success and not slow:
+                self.state = CircuitState.CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        self._outcomes.append((not success, slow))
+        if self.state == CircuitState.CLOSED and len(self._outcomes) >= MIN_CALLS:
+            error_rate, slow_call_rate = self.rates()
+            if error_rate >= ERROR_RATE_THRESHOLD or slow_call_rate >= SLOW_CALL_RATE_THRESHOLD:
+                self._open()
+
+    def rates(self) -> Tuple[float, float]:
+        """(error rate, slow call rate) over the window."""
+        if not self._outcomes:
+            return 0.0, 0.0
+        failed = sum(1 for failure, _ in self._outcomes if failure)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        return failed / len(self._outcomes), slow / len(self._outcomes)
+
+    def retry_after(self) -> Optional[float]:
+        if self.state != CircuitState.OPEN:
+            return None
+        return max(0.0, OPEN_SECONDS - (self.clock() - self.opened_at))
+
+    def _open(self) -> None:
+        self.state = CircuitState.OPEN
+        self.opened_at = self.clock()
+        self._probes = []
+
+
+class CircuitBreakerRegistry:
+    """
+    Breakers per ModelProvider.id and per ModelImplementation.id.
+
+    A call through an implementation needs both its provider's and its own
+    circuit to let it through, so a provider outage trips every one of its
+    implementations at once while a single broken model only trips itself.
+    State is process-local and guarded by one lock.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._breakers: Dict[Tuple[CircuitKind, UUID], CircuitBreaker] = {}
+
+    def allow(self, provider_id: UUID, implementation_id: UUID) -> bool:
+        """Whether a call may go through both circuits; half-open circuits hand out probe slots."""
+        with self._lock:
+            provider = self._breaker(CircuitKind.PROVIDER, provider_id)
+            implementation = self._breaker(CircuitKind.IMPLEMENTATION, implementation_id)
+            # Check both without side effects first so a rejected call takes no probe slot
+            if not (provider.available() and implementation.available()):
+                return False
+            provider.allow()
+            implementation.allow()
+            return True
+
+    def available(self, provider_id: UUID, implementation_id: UUID) -> bool:
+        """Whether allow() would let a call through both circuits, without taking probe slots."""
+        with self._lock:
+            return (
+                self._breaker(CircuitKind.PROVIDER, provider_id).available()
+                and self._breaker(CircuitKind.IMPLEMENTATION, implementation_id).available()
+            )
+
+    def closed(self, provider_id: UUID, implementation_id: UUID) -> bool:
+        """Whether both circuits are closed, so calls need no probe slot."""
+        with self._lock:
+            return (
+                self._breaker(CircuitKind.PROVIDER, provider_id).state == CircuitState.CLOSED
+                and self._breaker(CircuitKind.IMPLEMENTATION, implementation_id).state == CircuitState.CLOSED
+            )
+
+    def release(self, provider_id: UUID, implementation_id: UUID) -> None:
+        """Give back the probe slots taken by allow() when the call is not made after all."""
+        with self._lock:
+            self._breaker(CircuitKind.PROVIDER, provider_id).release()
+            self._breaker(CircuitKind.IMPLEMENTATION, implementation_id).release()
+
+    def record(
+        self, provider_id: Optional[UUID], implementation_id: UUID, success: bool, latency: Optional[float] = None
+    ) -> None:
+        """Count the outcome of a call against its implementation and, when known, its provider."""
+        with self._lock:
+            if provider_id is not None:
+                self._breaker(CircuitKind.PROVIDER, provider_id).record(success, latency)
+            self._breaker(CircuitKind.IMPLEMENTATION, implementation_id).record(success, latency)
+
+    def retry_after(self, provider_id: UUID, implementation_id: UUID) -> Optional[float]:
+        """Seconds until the circuits of a route let probes through, None if not open."""
+        with self._lock:
+            waits = [
+                breaker.retry_after()
+                for breaker in (self._breakers.get((CircuitKind.PROVIDER, provider_id)),
+                                self._breakers.get((CircuitKind.IMPLEMENTATION, implementation_id)))
+                if breaker is not None and breaker.retry_after() is not None
+            ]
+        return max(waits) if waits else None
+
+    def statuses(self) -> List[CircuitStatus]:
+        with self._lock:
+            statuses = []
+            for (kind, breaker_id), breaker in self._breakers.items():
+                error_rate, slow_call_rate = breaker.rates()
+                state = CircuitState.HALF_OPEN if breaker.state == CircuitState.OPEN and not breaker.is_open() else breaker.state
+                statuses.append(CircuitStatus(
+                    kind=kind,
+                    id=breaker_id,
+                    state=state,
+                    calls=breaker.calls,
+                    error_rate=error_rate,
+                    slow_call_rate=slow_call_rate,
+                    retry_after=breaker.retry_after() if state == CircuitState.OPEN else None,
+                ))
+            return statuses
+
+    def reset(self) -> None:
+        """Close every circuit and forget its history."""
+        with self._lock:
+            self._breakers.clear()
+
+    def _breaker(self, kind: CircuitKind, breaker_id: UUID) -> CircuitBreaker:
+        # Called with the lock held
+        breaker = self._breakers.get((kind, breaker_id))
+        if breaker is None:
+            breaker = self._breakers[(kind, breaker_id)] = CircuitBreaker(self.clock)
+        return breaker
+
+
+# Process-wide breakers consulted by the model router
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,261 @@
+from sqlalchemy.orm import Session, sessionmaker
+from uuid import UUID
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import os
+import threading
+
+from app.db.database import SessionLocal
+from app.models.provider import ModelProvider, FreeQuota, FreeQuotaUsage, FreeQuotaType, ResetPeriod
+from app.services import free_quota_service
+from app.services.free_quota_reset_service import next_reset_date
+
+# How often coalesced increments are written to Postgres
+FLUSH_INTERVAL_SECONDS = float(os.getenv("FREE_QUOTA_LEDGER_FLUSH_INTERVAL_SECONDS", "5"))
+# How often limits and counters are reloaded from Postgres, picking up
+# quota configuration changes and increments made by other workers
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("FREE_QUOTA_LEDGER_RECONCILE_INTERVAL_SECONDS", "60"))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class _Quota:
+    id: UUID
+    provider_id: UUID
+    model_implementation_id: Optional[UUID]
+    amount: float
+    reset_period: ResetPeriod
+
+
+@dataclass
+class _Counter:
+    used_amount: float = 0
+    next_reset_date: Optional[datetime] = None
+    pending: float = 0  # Consumed locally but not yet written to Postgres
+
+
+@dataclass
+class _Snapshot:
+    provider_types: Dict[UUID, Optional[FreeQuotaType]] = field(default_factory=dict)
+    quotas_by_provider: Dict[UUID, List[_Quota]] = field(default_factory=dict)
+    quotas: Dict[UUID, _Quota] = field(default_factory=dict)
+
+
+class FreeQuotaLedger:
+    """
+    Process-local free quota limits and usage counters with write-behind persistence.
+
+    remaining() and consume() only touch in-memory state guarded by a lock.
+    Increments are coalesced per (api_key_id, free_quota_id) and written by
+    flush() with a single batched upsert, so Postgres stays the source of
+    truth: reconcile() reloads limits and counters from it at startup,
+    periodically, and after a failed flush. Increments not yet flushed when
+    the process dies are lost, which bounds the error to one flush interval.
+
+    record_usage() debits a call from every quota that applies to it.
+    invalidate() marks the limits stale after free quotas or quota types
+    change; usage recorded until the next reconcile() is held back and
+    debited against the reloaded quotas, so quotas created in between are
+    not missed.
+    """
+
+    def __init__(self, session_factory: sessionmaker = SessionLocal):
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot()
+        self._counters: Dict[Tuple[UUID, UUID], _Counter] = {}
+        self._last_reconcile: Optional[datetime] = None
+        # Bumped by invalidate(); the snapshot is stale until a reconcile started after the bump
+        self._generation = 0
+        self._loaded_generation: Optional[int] = None
+        self._held_back: List[Tuple[UUID, UUID, Optional[UUID], float, Optional[float]]] = []
+
+    def remaining(self, api_key_id: UUID, provider_id: UUID, model_implementation_id: Optional[UUID] = None) -> float:
+        """Remaining free quota of an API key, with the same rules as free_quota_service.get_remaining_quota."""
+        now = _now()
+        with self._lock:
+            remaining = 0
+            for quota in self._applicable_quotas(provider_id, model_implementation_id):
+                counter = self._counters.get((api_key_id, quota.id))
+                used = 0
+                if counter and not (counter.next_reset_date and counter.next_reset_date <= now):
+                    used = counter.used_amount
+                remaining += max(0, quota.amount - used)
+            return remaining
+
+    def is_exhausted(self, api_key_id: UUID, provider_id: UUID, model_implementation_id: Optional[UUID] = None) -> bool:
+        """Whether the key has applicable free quotas and all of them are used up."""
+        with self._lock:
+            has_quotas = bool(self._applicable_quotas(provider_id, model_implementation_id))
+        return has_quotas and self.remaining(api_key_id, provider_id, model_implementation_id) <= 0
+
+    def consume(self, api_key_id: UUID, free_quota_id: UUID, amount: float) -> None:
+        """
+        Record usage against a quota; it is persisted on the next flush.
+
+        A quota created since the last reconcile() is counted as pending
+        usage and picked up by the reconcile this triggers.
+        """
+        with self._lock:
+            self._consume(api_key_id, free_quota_id, amount, _now())
+
+    def record_usage(
+        self,
+        api_key_id: UUID,
+        provider_id: UUID,
+        model_implementation_id: Optional[UUID],
+        total_tokens: float,
+        cost: Optional[float] = None,
+    ) -> None:
+        """
+        Debit one call from the quotas that apply to it: its cost from
+        CREDIT quotas and its total tokens from token quotas. Calls without
+        a known cost are not debited from CREDIT quotas.
+        """
+        with self._lock:
+            if self._loaded_generation != self._generation:
+                self._held_back.append((api_key_id, provider_id, model_implementation_id, total_tokens, cost))
+                return
+            self._record_usage(api_key_id, provider_id, model_implementation_id, total_tokens, cost, _now())
+
+    def invalidate(self) -> None:
+        """Reload limits on the next maintain(), holding back usage until then."""
+        with self._lock:
+            self._generation += 1
+            self._last_reconcile = None
+
+    def flush(self) -> int:
+        """
+        Write coalesced increments to Postgres in one transaction.
+
+        Returns the number of usage rows written. On failure the increments
+        are kept for the next flush.
+        """
+        with self._lock:
+            pending = {key: counter.pending for key, counter in self._counters.items() if counter.pending}
+            for key in pending:
+                self._counters[key].pending = 0
+        if not pending:
+            return 0
+
+        db = self.session_factory()
+        try:
+            free_quota_service.add_usage_amounts(db, pending)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for key, amount in pending.items():
+                    self._counters.setdefault(key, _Counter()).pending += amount
+            raise
+        finally:
+            db.close()
+        return len(pending)
+
+    def reconcile(self) -> None:
+        """Reload limits and counters from Postgres, keeping unflushed increments on top."""
+        with self._lock:
+            generation = self._generation
+        db = self.session_factory()
+        try:
+            snapshot, counters = self._load(db)
+        finally:
+            db.close()
+
+        with self._lock:
+            for key, counter in self._counters.items():
+                if not counter.pending:
+                    continue
+                loaded = counters.setdefault(key, _Counter(next_reset_date=counter.next_reset_date))
+                loaded.used_amount += counter.pending
+                loaded.pending = counter.pending
+            self._snapshot = snapshot
+            self._counters = counters
+            self._last_reconcile = _now()
+            if generation == self._generation:
+                # Otherwise invalidate() ran while loading and the usage waits for the next reconcile
+                self._loaded_generation = generation
+                held_back, self._held_back = self._held_back, []
+                for usage in held_back:
+                    self._record_usage(*usage, self._last_reconcile)
+
+    def maintain(self) -> None:
+        """Flush increments and reconcile when due; run periodically by the FastAPI lifespan."""
+        try:
+            self.flush()
+        except Exception:
+            # The database may be down; reload everything once it is back
+            self._last_reconcile = None
+            raise
+        due = self._last_reconcile is None or (_now() - self._last_reconcile).total_seconds() >= RECONCILE_INTERVAL_SECONDS
+        if due:
+            self.reconcile()
+
+    def _consume(self, api_key_id: UUID, free_quota_id: UUID, amount: float, now: datetime) -> None:
+        counter = self._counters.setdefault((api_key_id, free_quota_id), _Counter())
+        quota = self._snapshot.quotas.get(free_quota_id)
+        if quota is None:
+            # Unknown until the next reconcile, which keeps the pending amount; flush() skips quotas that do not exist
+            counter.used_amount += amount
+            counter.pending += amount
+            self._last_reconcile = None
+            return
+        if counter.next_reset_date is None and counter.used_amount == 0:
+            counter.next_reset_date = next_reset_date(quota.reset_period, now)
+        elif counter.next_reset_date and counter.next_reset_date <= now:
+            # Usage from the finished period is discarded, just like the database rollover does
+            counter.used_amount = 0
+            counter.pending = 0
+            counter.next_reset_date = next_reset_date(quota.reset_period, now)
+        counter.used_amount += amount
+        counter.pending += amount
+
+    def _record_usage(
+        self, api_key_id: UUID, provider_id: UUID, model_implementation_id: Optional[UUID],
+        total_tokens: float, cost: Optional[float], now: datetime,
+    ) -> None:
+        amount = cost if self._snapshot.provider_types.get(provider_id) == FreeQuotaType.CREDIT else total_tokens
+        if not amount:
+            return
+        for quota in self._applicable_quotas(provider_id, model_implementation_id):
+            self._consume(api_key_id, quota.id, amount, now)
+
+    def _applicable_quotas(self, provider_id: UUID, model_implementation_id: Optional[UUID]) -> List[_Quota]:
+        quota_type = self._snapshot.provider_types.get(provider_id)
+        if not quota_type:
+            return []
+        if quota_type == FreeQuotaType.PER_MODEL_TOKENS:
+            if not model_implementation_id:
+                return []  # Need model ID for per-model quotas
+            return [q for q in self._snapshot.quotas_by_provider.get(provider_id, []) if q.model_implementation_id == model_implementation_id]
+        return [q for q in self._snapshot.quotas_by_provider.get(provider_id, []) if q.model_implementation_id is None]
+
+    @staticmethod
+    def _load(db: Session) -> Tuple[_Snapshot, Dict[Tuple[UUID, UUID], _Counter]]:
+        snapshot = _Snapshot()
+        for provider_id, quota_type in db.query(ModelProvider.id, ModelProvider.free_quota_type).filter(
+            ModelProvider.free_quota_type.isnot(None)
+        ):
+            snapshot.provider_types[provider_id] = quota_type
+        for row in db.query(
+            FreeQuota.id, FreeQuota.provider_id, FreeQuota.model_implementation_id, FreeQuota.amount, FreeQuota.reset_period
+        ):
+            quota = _Quota(*row)
+            snapshot.quotas[quota.id] = quota
+            snapshot.quotas_by_provider.setdefault(quota.provider_id, []).append(quota)
+
+        counters = {
+            (api_key_id, free_quota_id): _Counter(used_amount=used_amount, next_reset_date=reset_date)
+            for api_key_id, free_quota_id, used_amount, reset_date in db.query(
+                FreeQuotaUsage.api_key_id, FreeQuotaUsage.free_quota_id, FreeQuotaUsage.used_amount, FreeQuotaUsage.next_reset_date
+            )
+        }
+        return snapshot, counters
+
+
+# Process-wide ledger reconciled and flushed by the FastAPI lifespan
+free_quota_ledger = FreeQuotaLedger()
@@ -0,0 +1,101 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+import os
+
+from app.db.database import SessionLocal
+from app.models.provider import ResetPeriod
+
+# How often the lifespan task resets usage rows whose period has ended
+RESET_SWEEP_INTERVAL_SECONDS = float(os.getenv("FREE_QUOTA_RESET_SWEEP_INTERVAL_SECONDS", "60"))
+
+# Periods start at the beginning of the UTC day, ISO week, month or year.
+# NEVER has no boundary, so usage of such quotas is never reset.
+PERIOD_UNITS = {
+    ResetPeriod.DAILY: "day",
+    ResetPeriod.WEEKLY: "week",
+    ResetPeriod.MONTHLY: "month",
+    ResetPeriod.YEARLY: "year",
+}
+
+
+def period_start(reset_period: ResetPeriod, now: datetime) -> Optional[datetime]:
+    """Return the start (UTC) of the period containing now, or None for NEVER."""
+    unit = PERIOD_UNITS.get(reset_period)
+    if unit is None:
+        return None
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+    day = now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if unit == "day":
+        return day
+    if unit == "week":
+        return day - timedelta(days=day.weekday())
+    if unit == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def next_reset_date(reset_period: ResetPeriod, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Return the end of the period containing now, i.e. when its usage is reset next."""
+    start = period_start(reset_period, now or datetime.now(timezone.utc))
+    if start is None:
+        return None
+    unit = PERIOD_UNITS[reset_period]
+    if unit == "day":
+        return start + timedelta(days=1)
+    if unit == "week":
+        return start + timedelta(weeks=1)
+    if unit == "month":
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    return start.replace(year=start.year + 1)
+
+
+def next_reset_date_sql(reset_period: str = "free_quotas.reset_period", now: str = "now()") -> str:
+    """
+    SQL expression computing next_reset_date in Postgres, matching next_reset_date().
+
+    reset_period and now are SQL expressions, by default the reset_period
+    column of free_quotas and the transaction timestamp.
+    """
+    cases = "\n".join(
+        f"        WHEN '{period.value}' THEN date_trunc('{unit}', {now}, 'UTC') + interval '1 {unit}'"
+        for period, unit in PERIOD_UNITS.items()
+    )
+    return f"\n    CASE {reset_period}\n{cases}\n    END\n"
+
+
+# Start a new period for every usage row whose period has ended, in one statement
+_RESET_DUE_USAGES_SQL = f"""
+    UPDATE free_quota_usages
+    SET used_amount = 0,
+        last_reset_date = now(),
+        next_reset_date = {next_reset_date_sql()}
+    FROM free_quotas
+    WHERE free_quotas.id = free_quota_usages.free_quota_id
+        AND free_quota_usages.next_reset_date <= now()
+"""
+
+
+def reset_due_usages(db: Session) -> int:
+    """
+    Reset the used amount of every free quota usage past its next_reset_date.
+
+    A single set-based UPDATE, so the cost does not depend on how many keys
+    are read in between. Returns the number of rows reset.
+    """
+    result = db.execute(text(_RESET_DUE_USAGES_SQL))
+    db.commit()
+    return result.rowcount
+
+
+def sweep_due_resets() -> None:
+    """Reset due free quota usage in a dedicated session; run periodically by the FastAPI lifespan."""
+    db = SessionLocal()
+    try:
+        reset_due_usages(db)
+    finally:
+        db.close()
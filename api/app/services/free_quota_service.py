@@ -1,12 +1,14 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import exc
+from sqlalchemy import exc, select, text
 from fastapi import HTTPException, status
 from uuid import UUID
-from typing import List, Optional
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import uuid
 
-from app.models.provider import ModelProvider, FreeQuota, FreeQuotaUsage, ApiKey, FreeQuotaType, ResetPeriod
+from app.models.provider import ModelProvider, FreeQuota, FreeQuotaUsage, ApiKey, FreeQuotaType
 from app.models.schemas import FreeQuotaCreate, FreeQuotaUpdate
+from app.services.free_quota_reset_service import next_reset_date_sql
 
 class FreeQuotaService:
     @staticmethod
@@ -204,68 +206,106 @@ def get_free_quota_usage(db: Session, api_key_id: UUID, free_quota_id: UUID) ->
         FreeQuotaUsage.free_quota_id == free_quota_id
     ).first()
 
+# Next reset boundary of a quota's period, evaluated by Postgres against now()
+_NEXT_RESET_DATE_SQL = next_reset_date_sql()
+
+# Insert the first usage row or add to the existing one in a single statement.
+# A row whose next_reset_date has passed is reset to this call's amount instead.
+# Every SET expression sees the old row, so the rollover check is consistent.
+# Nothing is written when the quota or the API key does not exist.
+_ADD_TO_EXISTING_USAGE_SQL = """
+    ON CONFLICT (api_key_id, free_quota_id) DO UPDATE SET
+        used_amount = CASE WHEN free_quota_usages.next_reset_date <= now()
+            THEN EXCLUDED.used_amount
+            ELSE free_quota_usages.used_amount + EXCLUDED.used_amount END,
+        last_reset_date = CASE WHEN free_quota_usages.next_reset_date <= now()
+            THEN EXCLUDED.last_reset_date
+            ELSE free_quota_usages.last_reset_date END,
+        next_reset_date = CASE WHEN free_quota_usages.next_reset_date <= now()
+            THEN EXCLUDED.next_reset_date
+            ELSE free_quota_usages.next_reset_date END
+"""
+
+_UPSERT_FREE_QUOTA_USAGE_SQL = f"""
+    INSERT INTO free_quota_usages (id, api_key_id, free_quota_id, used_amount, last_reset_date, next_reset_date)
+    SELECT :id, api_keys.id, free_quotas.id, :amount, now(), {_NEXT_RESET_DATE_SQL}
+    FROM free_quotas
+    JOIN api_keys ON api_keys.id = :api_key_id
+    WHERE free_quotas.id = :free_quota_id
+""" + _ADD_TO_EXISTING_USAGE_SQL
+
+# The same upsert for many increments at once, passed as parallel arrays and
+# expanded with unnest(); the joins drop increments of deleted keys or quotas
+_UPSERT_FREE_QUOTA_USAGES_SQL = f"""
+    INSERT INTO free_quota_usages (id, api_key_id, free_quota_id, used_amount, last_reset_date, next_reset_date)
+    SELECT increments.id, api_keys.id, free_quotas.id, increments.amount, now(), {_NEXT_RESET_DATE_SQL}
+    FROM unnest(
+        CAST(:ids AS uuid[]), CAST(:api_key_ids AS uuid[]), CAST(:free_quota_ids AS uuid[]),
+        CAST(:amounts AS double precision[])
+    ) WITH ORDINALITY AS increments (id, api_key_id, free_quota_id, amount, position)
+    JOIN free_quotas ON free_quotas.id = increments.free_quota_id
+    JOIN api_keys ON api_keys.id = increments.api_key_id
+    ORDER BY increments.position
+""" + _ADD_TO_EXISTING_USAGE_SQL
+
+def _usage_params(api_key_id: UUID, free_quota_id: UUID, amount: float) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "api_key_id": str(api_key_id),
+        "free_quota_id": str(free_quota_id),
+        "amount": amount,
+    }
+
 def create_or_update_usage(db: Session, api_key_id: UUID, free_quota_id: UUID, amount_used: float) -> FreeQuotaUsage:
     """
-    Create or update a free quota usage record
+    Atomically add amount_used to the free quota usage of an API key
+    
+    Runs as one INSERT ... ON CONFLICT DO UPDATE, so concurrent calls on the
+    same key never lose updates, and a usage row past its next_reset_date is
+    rolled over to the new period in the same statement.
     """
-    # Verify the free quota and API key exist
-    free_quota = db.query(FreeQuota).filter(FreeQuota.id == free_quota_id).first()
-    if not free_quota:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Free quota with id {free_quota_id} not found"
-        )
+    statement = select(FreeQuotaUsage).from_statement(
+        text(_UPSERT_FREE_QUOTA_USAGE_SQL + " RETURNING free_quota_usages.*")
+    )
+    db_usage = db.scalars(
+        statement,
+        _usage_params(api_key_id, free_quota_id, amount_used),
+        execution_options={"populate_existing": True}
+    ).first()
     
-    api_key = db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
-    if not api_key:
+    if db_usage is None:
+        db.rollback()
+        if db.query(ApiKey.id).filter(ApiKey.id == api_key_id).first() is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"API key with id {api_key_id} not found"
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"API key with id {api_key_id} not found"
-        )
-    
-    # Check if usage record already exists
-    db_usage = get_free_quota_usage(db, api_key_id, free_quota_id)
-    
-    # Calculate reset dates if applicable
-    next_reset_date = None
-    if free_quota.reset_period != ResetPeriod.NEVER:
-        now = datetime.now()
-        if free_quota.reset_period == ResetPeriod.DAILY:
-            next_reset_date = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        elif free_quota.reset_period == ResetPeriod.WEEKLY:
-            days_until_next_week = 7 - now.weekday()
-            next_reset_date = (now + timedelta(days=days_until_next_week)).replace(hour=0, minute=0, second=0, microsecond=0)
-        elif free_quota.reset_period == ResetPeriod.MONTHLY:
-            if now.month == 12:
-                next_reset_date = datetime(now.year + 1, 1, 1)
-            else:
-                next_reset_date = datetime(now.year, now.month + 1, 1)
-        elif free_quota.reset_period == ResetPeriod.YEARLY:
-            next_reset_date = datetime(now.year + 1, 1, 1)
-    
-    # Create or update the usage record
-    if not db_usage:
-        db_usage = FreeQuotaUsage(
-            api_key_id=api_key_id,
-            free_quota_id=free_quota_id,
-            used_amount=amount_used,
-            last_reset_date=datetime.now(),
-            next_reset_date=next_reset_date
+            detail=f"Free quota with id {free_quota_id} not found"
         )
-        db.add(db_usage)
-    else:
-        # Check if it's time to reset
-        if db_usage.next_reset_date and db_usage.next_reset_date <= datetime.now():
-            db_usage.used_amount = amount_used
-            db_usage.last_reset_date = datetime.now()
-            db_usage.next_reset_date = next_reset_date
-        else:
-            db_usage.used_amount += amount_used
     
     db.commit()
-    db.refresh(db_usage)
     return db_usage
 
+def add_usage_amounts(db: Session, amounts: Dict[Tuple[UUID, UUID], float]) -> None:
+    """
+    Apply many (api_key_id, free_quota_id) usage increments with a single INSERT ... SELECT FROM unnest() upsert
+    
+    Same semantics as create_or_update_usage, but increments for keys or quotas
+    that no longer exist are skipped. Does not commit.
+    """
+    if not amounts:
+        return
+    # A fixed order makes concurrent flushes lock rows in the same sequence
+    increments = sorted(amounts.items(), key=lambda item: (str(item[0][0]), str(item[0][1])))
+    db.execute(text(_UPSERT_FREE_QUOTA_USAGES_SQL), {
+        "ids": [str(uuid.uuid4()) for _ in increments],
+        "api_key_ids": [str(api_key_id) for (api_key_id, _), _ in increments],
+        "free_quota_ids": [str(free_quota_id) for (_, free_quota_id), _ in increments],
+        "amounts": [float(amount) for _, amount in increments],
+    })
+
 def get_remaining_quota(db: Session, api_key_id: UUID, provider_id: UUID, model_implementation_id: Optional[UUID] = None) -> float:
     """
     Calculate the remaining free quota for an API key
@@ -295,37 +335,61 @@ def get_remaining_quota(db: Session, api_key_id: UUID, provider_id: UUID, model_
     if not free_quotas:
         return 0
     
-    # Calculate remaining quota
+    # Calculate remaining quota without writing; due resets are applied by
+    # free_quota_reset_service.sweep_due_resets
+    now = datetime.now(timezone.utc)
     remaining = 0
     for quota in free_quotas:
         # Get usage for this quota
         usage = get_free_quota_usage(db, api_key_id, quota.id)
         
-        # Reset quota if needed
-        if usage and usage.next_reset_date and usage.next_reset_date <= datetime.now():
-            usage.used_amount = 0
-            usage.last_reset_date = datetime.now()
-            
-            # Calculate next reset date
-            now = datetime.now()
-            if quota.reset_period == ResetPeriod.DAILY:
-                usage.next_reset_date = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-            elif quota.reset_period == ResetPeriod.WEEKLY:
-                days_until_next_week = 7 - now.weekday()
-                usage.next_reset_date = (now + timedelta(days=days_until_next_week)).replace(hour=0, minute=0, second=0, microsecond=0)
-            elif quota.reset_period == ResetPeriod.MONTHLY:
-                if now.month == 12:
-                    usage.next_reset_date = datetime(now.year + 1, 1, 1)
-                else:
-                    usage.next_reset_date = datetime(now.year, now.month + 1, 1)
-            elif quota.reset_period == ResetPeriod.YEARLY:
-                usage.next_reset_date = datetime(now.year + 1, 1, 1)
-            
-            db.commit()
-            db.refresh(usage)
+        # Usage from a finished period counts as zero until the sweeper resets it
+        if usage and usage.next_reset_date and usage.next_reset_date <= now:
+            usage = None
         
         # Add remaining quota
         used = usage.used_amount if usage else 0
         remaining += max(0, quota.amount - used)
     
-    return remaining
\ No newline at end of file
+    return remaining
+
+# Remaining free quota of every key of a provider, using the same quota
+# selection as get_remaining_quota: per-model quotas for PER_MODEL_TOKENS
+# providers, provider-wide quotas otherwise. Usage past its reset date counts
+# as zero and reports the upcoming period boundary.
+_PROVIDER_REMAINING_QUOTAS_SQL = f"""
+    SELECT
+        api_keys.id AS api_key_id,
+        api_keys.alias AS alias,
+        free_quotas.model_implementation_id AS model_implementation_id,
+        coalesce(sum(free_quotas.amount), 0) AS amount,
+        coalesce(sum(current_usage.used_amount), 0) AS used_amount,
+        coalesce(sum(greatest(free_quotas.amount - coalesce(current_usage.used_amount, 0), 0)), 0) AS remaining_amount,
+        min(coalesce(current_usage.next_reset_date, {_NEXT_RESET_DATE_SQL})) AS next_reset_date
+    FROM api_keys
+    JOIN model_providers ON model_providers.id = api_keys.provider_id
+    LEFT JOIN free_quotas ON free_quotas.provider_id = api_keys.provider_id
+        AND model_providers.free_quota_type IS NOT NULL
+        AND (model_providers.free_quota_type = 'PER_MODEL_TOKENS') = (free_quotas.model_implementation_id IS NOT NULL)
+    LEFT JOIN LATERAL (
+        SELECT free_quota_usages.used_amount, free_quota_usages.next_reset_date
+        FROM free_quota_usages
+        WHERE free_quota_usages.api_key_id = api_keys.id
+            AND free_quota_usages.free_quota_id = free_quotas.id
+            AND (free_quota_usages.next_reset_date IS NULL OR free_quota_usages.next_reset_date > now())
+    ) AS current_usage ON true
+    WHERE api_keys.provider_id = :provider_id
+    GROUP BY api_keys.id, api_keys.alias, api_keys.sort_order, free_quotas.model_implementation_id
+    ORDER BY api_keys.sort_order, api_keys.id
+"""
+
+def get_provider_remaining_quotas(db: Session, provider_id: UUID) -> List[dict]:
+    """
+    Get the remaining free quota of every API key of a provider in one aggregate query
+    
+    Returns one row per API key (and model implementation for PER_MODEL_TOKENS
+    providers) with the quota amount, used and remaining amounts and the next
+    reset date. Keys without an applicable quota report zero amounts.
+    """
+    rows = db.execute(text(_PROVIDER_REMAINING_QUOTAS_SQL), {"provider_id": str(provider_id)}).mappings().all()
+    return [dict(row) for row in rows]
@@ -0,0 +1,366 @@
+from sqlalchemy.orm import sessionmaker
+from uuid import UUID
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass, replace
+import enum
+import os
+import random
+import threading
+
+from app.db.database import SessionLocal
+from app.models.provider import Model, ModelImplementation, ModelProvider
+from app.services.api_key_pool import ApiKeyPool, KeySelectionStrategy, NoApiKeyAvailableError, PooledKey, api_key_pool
+from app.services.free_quota_ledger import free_quota_ledger
+from app.services.circuit_breaker import CircuitBreakerRegistry, circuit_breakers
+from app.services.pricing import compile_pricing
+
+# How often the routing snapshot is reloaded, picking up changes made by other workers
+REFRESH_INTERVAL_SECONDS = float(os.getenv("MODEL_ROUTER_REFRESH_INTERVAL_SECONDS", "60"))
+# Policy used when resolve() is not given one
+DEFAULT_POLICY = os.getenv("MODEL_ROUTER_POLICY", "SCORED")
+# Weight of the newest sample in the latency and error rate moving averages
+EWMA_ALPHA = float(os.getenv("MODEL_ROUTER_EWMA_ALPHA", "0.2"))
+# Share of requests that try a random implementation first, so stale statistics get refreshed
+EXPLORATION_RATE = float(os.getenv("MODEL_ROUTER_EXPLORATION_RATE", "0.05"))
+
+
+class RoutingPolicy(str, enum.Enum):
+    SORT_ORDER = "SORT_ORDER"  # 按 sort_order 固定顺序
+    SCORED = "SCORED"          # 按延迟、错误率、价格与免费额度综合评分
+
+    def __str__(self):
+        return self.value
+
+
+@dataclass(frozen=True)
+class RoutingWeights:
+    """How much each input counts in a route's score; lower scores are preferred."""
+    latency: float = float(os.getenv("MODEL_ROUTER_LATENCY_WEIGHT", "1"))
+    error_rate: float = float(os.getenv("MODEL_ROUTER_ERROR_RATE_WEIGHT", "2"))
+    price: float = float(os.getenv("MODEL_ROUTER_PRICE_WEIGHT", "1"))
+    free_quota: float = float(os.getenv("MODEL_ROUTER_FREE_QUOTA_WEIGHT", "1"))
+
+
+def unit_price(pricing_info: Optional[Dict[str, Any]]) -> Optional[float]:
+    """
+    Input plus output price per 1K tokens of the lowest pricing tier, or None
+    when pricing_info has no usable token prices. Currencies are compared as-is.
+    """
+    try:
+        pricing = compile_pricing(pricing_info)
+    except ValueError:
+        return None
+    if pricing is None:
+        return None
+    tier = int(pricing.tier(0))
+    price = float(pricing.input[tier] + pricing.output[tier]) * 1_000
+    if price == 0 and pricing.request[tier] > 0:
+        # Priced per call only, which cannot be compared per token
+        return None
+    return price
+
+
+class ModelNotFoundError(LookupError):
+    """Raised when no model has the requested name."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        super().__init__(f"Model '{model_name}' not found")
+
+
+class ImplementationNotFoundError(LookupError):
+    """Raised when no available implementation has the requested ID."""
+
+    def __init__(self, implementation_id: UUID):
+        self.implementation_id = implementation_id
+        super().__init__(f"Model implementation {implementation_id} not found or not available")
+
+
+class NoRouteAvailableError(RuntimeError):
+    """Raised when a model has no available implementation with a usable API key."""
+
+    def __init__(self, model_name: str, retry_after: Optional[float] = None):
+        self.model_name = model_name
+        self.retry_after = retry_after
+        message = f"No available implementation of model '{model_name}'"
+        if retry_after is not None:
+            message += f", retry in {retry_after:.1f}s"
+        super().__init__(message)
+
+
+@dataclass(frozen=True)
+class Route:
+    """An available implementation of a model and the provider endpoint serving it."""
+    model_id: UUID
+    model_name: str
+    implementation_id: UUID
+    provider_id: UUID
+    provider_name: str
+    base_url: str
+    provider_model_id: str
+    context_window: Optional[int]
+    pricing_info: Optional[Dict[str, Any]]
+    custom_parameters: Optional[Dict[str, Any]]
+    sort_order: int
+
+
+@dataclass(frozen=True)
+class ResolvedRoute:
+    """A route together with the API key selected for one call."""
+    route: Route
+    api_key: PooledKey
+    score: Optional[float] = None  # Set by the SCORED policy
+    probe: bool = False  # Holds the probe slot of a half-open circuit, set by claim()
+
+
+@dataclass
+class RouteStats:
+    """Moving averages of one implementation's recent calls."""
+    latency: Optional[float] = None  # Seconds, successful calls only
+    error_rate: float = 0
+    calls: int = 0
+
+
+class ModelRouter:
+    """
+    Resolves a logical Model.name to its available implementations, best
+    first, with the provider endpoint and an API key for each.
+
+    Routes are served from an in-memory snapshot of models, available
+    implementations and providers that is loaded in one query, rebuilt after
+    invalidate() or on the periodic refresh(), and swapped in atomically, so
+    resolve() never queries the database. Keys come from the API key pool,
+    which skips keys that are cooling down or out of free quota, and routes
+    whose provider or implementation circuit is open are skipped without
+    being tried.
+
+    Under the SCORED policy routes are ordered per request by a weighted sum
+    of their latency and error rate moving averages (fed by report()), their
+    price from pricing_info and whether the selected key still has free
+    quota, falling back to sort_order on ties. A small share of requests puts
+    a random route first so that every implementation keeps being measured.
+
+    resolve() only lists routes: it peeks at keys without advancing the
+    pool rotation and leaves half-open circuits untouched. select() takes
+    the probe slot and the key of the route it picks, so only the call
+    actually made counts as a probe and uses up a turn of its key; claim()
+    does the same for the first route and adds the fallbacks that need no
+    probe slot. Callers that pick a route from resolve() themselves take it
+    with breakers.allow() and key_pool.take(), and give the probe slot back
+    with breakers.release() if they end up not calling.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        key_pool: ApiKeyPool = api_key_pool,
+        free_quota_remaining: Callable[[UUID, UUID, Optional[UUID]], float] = free_quota_ledger.remaining,
+        weights: Optional[RoutingWeights] = None,
+        exploration_rate: float = EXPLORATION_RATE,
+        rng: Optional[random.Random] = None,
+        breakers: CircuitBreakerRegistry = circuit_breakers,
+    ):
+        self.session_factory = session_factory
+        self.key_pool = key_pool
+        self.free_quota_remaining = free_quota_remaining
+        self.weights = weights or RoutingWeights()
+        self.exploration_rate = exploration_rate
+        self.rng = rng or random.Random()
+        self.breakers = breakers
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Tuple[Route, ...]] = {}
+        self._implementations: Dict[UUID, Route] = {}
+        self._prices: Dict[UUID, Optional[float]] = {}  # unit_price() per implementation
+        self._stats: Dict[UUID, RouteStats] = {}
+        self._loaded = False
+
+    def routes(self, model_name: str) -> Tuple[Route, ...]:
+        """Available implementations of a model in sort order. Raises ModelNotFoundError."""
+        if not self._loaded:
+            self.refresh()
+        routes = self._routes.get(model_name)
+        if routes is None:
+            raise ModelNotFoundError(model_name)
+        return routes
+
+    def route(self, implementation_id: UUID) -> Route:
+        """The route of one available implementation. Raises ImplementationNotFoundError."""
+        if not self._loaded:
+            self.refresh()
+        route = self._implementations.get(implementation_id)
+        if route is None:
+            raise ImplementationNotFoundError(implementation_id)
+        return route
+
+    def resolve(
+        self,
+        model_name: str,
+        strategy: Optional[KeySelectionStrategy] = None,
+        skip_exhausted: bool = True,
+        policy: Optional[RoutingPolicy] = None,
+    ) -> List[ResolvedRoute]:
+        """
+        Routes of a model that have a usable API key, best first, each with
+        the key to call it with.
+
+        Raises ModelNotFoundError for unknown names and NoRouteAvailableError
+        when no implementation can be called right now.
+        """
+        resolved = []
+        retry_after = None
+        for route in self.routes(model_name):
+            try:
+                # Peeked, so listing routes that are not called does not rotate the keys of their provider
+                api_key = self.key_pool.peek(route.provider_id, strategy, route.implementation_id, skip_exhausted)
+            except NoApiKeyAvailableError as e:
+                retry_after = _earliest(retry_after, e.retry_after)
+                continue
+            # Listing a route takes no probe slot; the caller does that for the route it calls
+            if not self.breakers.available(route.provider_id, route.implementation_id):
+                retry_after = _earliest(retry_after, self.breakers.retry_after(route.provider_id, route.implementation_id))
+                continue
+            resolved.append(ResolvedRoute(route=route, api_key=api_key))
+        if not resolved:
+            raise NoRouteAvailableError(model_name, retry_after)
+        if RoutingPolicy(policy or DEFAULT_POLICY) == RoutingPolicy.SCORED and len(resolved) > 1:
+            resolved = self._rank(resolved)
+        return resolved
+
+    def select(
+        self, model_name: str, strategy: Optional[KeySelectionStrategy] = None, policy: Optional[RoutingPolicy] = None
+    ) -> ResolvedRoute:
+        """
+        The preferred route of a model for one call, holding the probe slot
+        of a half-open circuit and with its key taken from the pool rotation.
+        """
+        return self.claim(model_name, strategy, policy)[0]
+
+    def claim(
+        self, model_name: str, strategy: Optional[KeySelectionStrategy] = None, policy: Optional[RoutingPolicy] = None
+    ) -> List[ResolvedRoute]:
+        """
+        Routes of a model for one caller, best first, with the first route
+        taken as by select(). The rest are fallbacks and take nothing, so
+        only those whose circuits are closed are kept: a half-open fallback
+        would be called without a probe slot.
+
+        The probe slot of the first route is freed when its outcome is
+        reported, or after PROBE_TIMEOUT_SECONDS if it never is.
+        """
+        resolved = self.resolve(model_name, strategy, policy=policy)
+        for index, item in enumerate(resolved):
+            if not self.breakers.allow(item.route.provider_id, item.route.implementation_id):
+                continue
+            self.key_pool.take(item.api_key, strategy)
+            probe = not self.breakers.closed(item.route.provider_id, item.route.implementation_id)
+            fallbacks = [
+                fallback for fallback in resolved[index + 1:]
+                if self.breakers.closed(fallback.route.provider_id, fallback.route.implementation_id)
+            ]
+            return [replace(item, probe=probe)] + fallbacks
+        # Concurrent callers took the last probe slots since the routes were listed
+        raise NoRouteAvailableError(model_name)
+
+    def report(self, implementation_id: UUID, latency: Optional[float], success: bool) -> None:
+        """Fold the outcome of one call into the implementation's moving averages and circuit breakers."""
+        route = self._implementations.get(implementation_id)
+        self.breakers.record(route.provider_id if route else None, implementation_id, success, latency)
+        with self._lock:
+            stats = self._stats.setdefault(implementation_id, RouteStats())
+            stats.calls += 1
+            stats.error_rate += EWMA_ALPHA * ((0 if success else 1) - stats.error_rate)
+            if success and latency is not None:
+                stats.latency = latency if stats.latency is None else stats.latency + EWMA_ALPHA * (latency - stats.latency)
+
+    def stats(self, implementation_id: UUID) -> RouteStats:
+        with self._lock:
+            return replace(self._stats.get(implementation_id, RouteStats()))
+
+    def _rank(self, resolved: List[ResolvedRoute]) -> List[ResolvedRoute]:
+        with self._lock:
+            stats = [self._stats.get(item.route.implementation_id) for item in resolved]
+        latencies = [s.latency if s else None for s in stats]
+        prices = [self._prices.get(item.route.implementation_id) for item in resolved]
+        free = [
+            self.free_quota_remaining(item.api_key.id, item.route.provider_id, item.route.implementation_id) > 0
+            for item in resolved
+        ]
+        # A route still on free quota costs nothing
+        prices = [0.0 if has_free else price for price, has_free in zip(prices, free)]
+        latencies, prices = _normalize(latencies), _normalize(prices)
+
+        weights = self.weights
+        scored = []
+        for item, stat, latency, price, has_free in zip(resolved, stats, latencies, prices, free):
+            score = (
+                weights.latency * latency
+                + weights.error_rate * (stat.error_rate if stat else 0)
+                + weights.price * price
+                - weights.free_quota * has_free
+            )
+            scored.append(replace(item, score=score))
+        # sorted() is stable, so equal scores keep sort order
+        scored = sorted(scored, key=lambda item: item.score)
+        if self.exploration_rate and self.rng.random() < self.exploration_rate:
+            scored.insert(0, scored.pop(self.rng.randrange(len(scored))))
+        return scored
+
+    def invalidate(self) -> None:
+        """Reload the snapshot before the next resolution."""
+        self._loaded = False
+
+    def refresh(self) -> None:
+        """Load the routing snapshot; run periodically by the FastAPI lifespan."""
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(
+                    Model.id, Model.name, ModelImplementation.id, ModelImplementation.provider_id, ModelProvider.name,
+                    ModelProvider.base_url, ModelImplementation.provider_model_id, ModelImplementation.context_window,
+                    ModelImplementation.pricing_info, ModelImplementation.custom_parameters, ModelImplementation.sort_order,
+                )
+                .outerjoin(
+                    ModelImplementation,
+                    (ModelImplementation.model_id == Model.id) & ModelImplementation.is_available.is_(True),
+                )
+                .outerjoin(ModelProvider, ModelProvider.id == ModelImplementation.provider_id)
+                .order_by(Model.name, ModelImplementation.sort_order, ModelImplementation.id)
+                .all()
+            )
+        finally:
+            db.close()
+
+        routes: Dict[str, List[Route]] = {}
+        for row in rows:
+            # Models without available implementations are known but have no routes
+            model_routes = routes.setdefault(row[1], [])
+            if row[2] is not None:
+                model_routes.append(Route(*row[:10], sort_order=row[10] or 0))
+        implementations = {route.implementation_id: route for model_routes in routes.values() for route in model_routes}
+        # Compiled once per snapshot rather than on every ranking
+        prices = {implementation_id: unit_price(route.pricing_info) for implementation_id, route in implementations.items()}
+        with self._lock:
+            self._routes = {name: tuple(model_routes) for name, model_routes in routes.items()}
+            self._implementations = implementations
+            self._prices = prices
+            self._loaded = True
+
+
+def _earliest(current: Optional[float], candidate: Optional[float]) -> Optional[float]:
+    if candidate is None:
+        return current
+    return candidate if current is None else min(current, candidate)
+
+
+def _normalize(values: List[Optional[float]]) -> List[float]:
+    """Scale values into [0, 1] by the largest one; unknown values get the mean of the known ones."""
+    known = [value for value in values if value is not None]
+    if not known:
+        return [0.0] * len(values)
+    top = max(known) or 1.0
+    mean = sum(known) / len(known)
+    return [(mean if value is None else value) / top for value in values]
+
+
+# Process-wide router refreshed by the FastAPI lifespan
+model_router = ModelRouter()
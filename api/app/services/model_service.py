@@ -1,15 +1,58 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.sql import func
+from typing import List, Optional, Dict, Tuple
 from uuid import UUID
 
 from app.models.provider import Model, ModelImplementation
-from app.models.schemas import ModelCreate, ModelUpdate, ModelImplementationCreate, ModelImplementationUpdate
+from app.models.schemas import ModelCreate, ModelUpdate, ModelListRead, ModelImplementationCreate, ModelImplementationUpdate
+from app.services.pagination import paginate
+from app.services.rate_limiter import rate_limiter
+from app.services.model_router import model_router
+from app.services.pricing import pricing_engine
+
+# Stable orderings used for keyset pagination; the trailing id breaks ties
+MODEL_ORDER = (Model.name, Model.id)
+IMPLEMENTATION_ORDER = (ModelImplementation.sort_order, ModelImplementation.id)
 
 class ModelService:
     @staticmethod
     def get_models(db: Session, skip: int = 0, limit: int = 100) -> List[Model]:
         """Get all models with pagination."""
-        return db.query(Model).offset(skip).limit(limit).all()
+        return db.query(Model).order_by(*MODEL_ORDER).offset(skip).limit(limit).all()
+    
+    @staticmethod
+    def get_models_with_implementation_counts(
+        db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+    ) -> Tuple[List[ModelListRead], Optional[str]]:
+        """Get a page of models with implementation counts computed in a single query."""
+        implementation_counts = (
+            db.query(
+                ModelImplementation.model_id,
+                func.count(ModelImplementation.id).label("implementations_count")
+            )
+            .group_by(ModelImplementation.model_id)
+            .subquery()
+        )
+        query = (
+            db.query(Model, func.coalesce(implementation_counts.c.implementations_count, 0))
+            .outerjoin(implementation_counts, implementation_counts.c.model_id == Model.id)
+        )
+        rows, next_cursor = paginate(query, MODEL_ORDER, cursor=cursor, skip=skip, limit=limit)
+        
+        result = []
+        for model, implementations_count in rows:
+            model_data = ModelListRead.model_validate(model)
+            model_data.implementations_count = implementations_count
+            result.append(model_data)
+        return result, next_cursor
+    
+    @staticmethod
+    def get_models_with_implementations(
+        db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+    ) -> Tuple[List[Model], Optional[str]]:
+        """Get a page of models with their implementations eagerly loaded in one extra query."""
+        query = db.query(Model).options(selectinload(Model.implementations))
+        return paginate(query, MODEL_ORDER, cursor=cursor, skip=skip, limit=limit)
     
     @staticmethod
     def get_model(db: Session, model_id: UUID) -> Optional[Model]:
@@ -33,6 +76,7 @@ class ModelService:
         db.add(db_model)
         db.commit()
         db.refresh(db_model)
+        model_router.invalidate()
         return db_model
     
     @staticmethod
@@ -48,6 +92,8 @@ class ModelService:
             
         db.commit()
         db.refresh(db_model)
+        if "name" in update_data:
+            model_router.invalidate()
         return db_model
     
     @staticmethod
@@ -59,13 +105,31 @@ class ModelService:
             
         db.delete(db_model)
         db.commit()
+        model_router.invalidate()
         return True
 
 class ModelImplementationService:
     @staticmethod
     def get_implementations(db: Session, skip: int = 0, limit: int = 100) -> List[ModelImplementation]:
         """Get all model implementations with pagination."""
-        return db.query(ModelImplementation).offset(skip).limit(limit).all()
+        return db.query(ModelImplementation).order_by(*IMPLEMENTATION_ORDER).offset(skip).limit(limit).all()
+    
+    @staticmethod
+    def get_implementation_page(
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        model_id: Optional[UUID] = None,
+        provider_id: Optional[UUID] = None
+    ) -> Tuple[List[ModelImplementation], Optional[str]]:
+        """Get a page of model implementations, optionally filtered, plus the next page cursor."""
+        query = db.query(ModelImplementation)
+        if model_id is not None:
+            query = query.filter(ModelImplementation.model_id == model_id)
+        if provider_id is not None:
+            query = query.filter(ModelImplementation.provider_id == provider_id)
+        return paginate(query, IMPLEMENTATION_ORDER, cursor=cursor, skip=skip, limit=limit)
     
     @staticmethod
     def get_implementation(db: Session, implementation_id: UUID) -> Optional[ModelImplementation]:
@@ -101,6 +165,11 @@ class ModelImplementationService:
         db.add(db_implementation)
         db.commit()
         db.refresh(db_implementation)
+        model_router.invalidate()
+        if implementation.custom_parameters:
+            rate_limiter.invalidate()
+        if implementation.pricing_info:
+            pricing_engine.invalidate()
         return db_implementation
     
     @staticmethod
@@ -116,6 +185,7 @@ class ModelImplementationService:
                     implementation.sort_order = order
             
             db.commit()
+            model_router.invalidate()
             return True
         except Exception as e:
             db.rollback()
@@ -139,6 +209,11 @@ class ModelImplementationService:
             
         db.commit()
         db.refresh(db_implementation)
+        model_router.invalidate()
+        if "custom_parameters" in update_data:
+            rate_limiter.invalidate()
+        if "pricing_info" in update_data:
+            pricing_engine.invalidate()
         return db_implementation
     
     @staticmethod
@@ -150,4 +225,5 @@ class ModelImplementationService:
             
         db.delete(db_implementation)
         db.commit()
+        model_router.invalidate()
         return True
\ No newline at end of file
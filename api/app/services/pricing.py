@@ -0,0 +1,244 @@
+from sqlalchemy import String, cast, select
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql import func
+from uuid import UUID
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from dataclasses import dataclass
+from datetime import datetime
+import os
+import threading
+
+import numpy as np
+
+from app.db.database import SessionLocal
+from app.models.provider import ApiKeyUsage, ModelImplementation
+from app.models.schemas import PRICE_UNITS, PricingInfo
+
+# How often compiled pricing is reloaded, picking up changes made by other workers
+REFRESH_INTERVAL_SECONDS = float(os.getenv("PRICING_REFRESH_INTERVAL_SECONDS", "300"))
+# Raw usage rows fetched per round trip when costing a time window
+REPORT_BATCH_SIZE = int(os.getenv("PRICING_REPORT_BATCH_SIZE", "100000"))
+
+
+@dataclass(frozen=True)
+class CompiledPricing:
+    """
+    Pricing of one implementation as per-token and per-call rates.
+
+    Entry 0 holds the top-level prices and entry i the prices of tier i,
+    which apply to calls with at least thresholds[i - 1] prompt tokens.
+    Cached prompt tokens are charged at cached_input instead of input.
+    """
+    currency: Optional[str]
+    thresholds: np.ndarray
+    input: np.ndarray
+    cached_input: np.ndarray
+    output: np.ndarray
+    request: np.ndarray
+
+    def tier(self, prompt_tokens: np.ndarray) -> np.ndarray:
+        """Index of the prices that apply to calls of the given prompt sizes."""
+        return np.searchsorted(self.thresholds, prompt_tokens, side="right")
+
+    def cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """Cost of one call."""
+        return float(self.cost_many(np.array([prompt_tokens]), np.array([completion_tokens]), np.array([cached_tokens]))[0])
+
+    def cost_many(self, prompt_tokens: np.ndarray, completion_tokens: np.ndarray, cached_tokens: np.ndarray) -> np.ndarray:
+        """Cost of each of many calls to this implementation."""
+        tier = self.tier(prompt_tokens)
+        cached = np.clip(cached_tokens, 0, prompt_tokens)
+        return (
+            (prompt_tokens - cached) * self.input[tier]
+            + cached * self.cached_input[tier]
+            + completion_tokens * self.output[tier]
+            + self.request[tier]
+        )
+
+
+def compile_pricing(pricing_info: Optional[Dict[str, Any]]) -> Optional[CompiledPricing]:
+    """
+    Validate pricing_info and turn it into per-token rates, or None when it
+    has no prices or is billed per minute, which usage rows carry no duration
+    for. Raises ValueError for invalid pricing_info.
+    """
+    if not pricing_info:
+        return None
+    pricing = PricingInfo.model_validate(pricing_info)
+    if pricing.billing_mode == "minute" or pricing.minute_price:
+        # Costing only the token and request prices would understate the cost
+        return None
+    tiers = pricing.tiers or []
+    levels = [pricing, *tiers]
+    if all(
+        level.input_price is None and level.output_price is None and level.request_price is None
+        for level in levels
+    ):
+        return None
+
+    def price(level, name: str) -> float:
+        # Tiers fall back to the top-level price, and missing top-level prices are free
+        value = getattr(level, name)
+        if value is None and level is not pricing:
+            value = getattr(pricing, name)
+        return value or 0.0
+
+    input_prices = [price(level, "input_price") for level in levels]
+    per_token = 1 / PRICE_UNITS[pricing.unit.strip().lower()]
+    return CompiledPricing(
+        currency=pricing.currency,
+        thresholds=np.array([tier.volume_threshold for tier in tiers], dtype=np.float64),
+        input=np.array(input_prices, dtype=np.float64) * per_token,
+        cached_input=np.array([
+            input_price if level.cached_input_price is None else level.cached_input_price
+            for level, input_price in zip(levels, input_prices)
+        ], dtype=np.float64) * per_token,
+        output=np.array([price(level, "output_price") for level in levels], dtype=np.float64) * per_token,
+        request=np.array([price(level, "request_price") for level in levels], dtype=np.float64),
+    )
+
+
+def cost_batch(
+    pricings: Sequence[Optional[CompiledPricing]],
+    codes: np.ndarray,
+    prompt_tokens: np.ndarray,
+    completion_tokens: np.ndarray,
+    cached_tokens: np.ndarray,
+) -> np.ndarray:
+    """
+    Cost of many calls at once; codes[i] indexes the pricing of call i.
+    Calls without pricing cost NaN.
+    """
+    costs = np.full(len(codes), np.nan)
+    # Sorting by code makes each pricing's calls one contiguous slice
+    order = np.argsort(codes, kind="stable")
+    starts = np.searchsorted(codes[order], np.arange(len(pricings) + 1), side="left")
+    for code, pricing in enumerate(pricings):
+        if pricing is None or starts[code] == starts[code + 1]:
+            continue
+        rows = order[starts[code]:starts[code + 1]]
+        costs[rows] = pricing.cost_many(prompt_tokens[rows], completion_tokens[rows], cached_tokens[rows])
+    return costs
+
+
+class PricingEngine:
+    """
+    Compiled pricing per model implementation, and costing of single calls
+    and of raw usage in bulk.
+
+    Pricing is compiled from ModelImplementation.pricing_info once per
+    snapshot, rebuilt after invalidate() or on the periodic refresh().
+    Invalid pricing_info is reported and treated as unpriced.
+
+    cost_report() streams ApiKeyUsage rows in batches of REPORT_BATCH_SIZE
+    and costs each batch with NumPy, so the per-row work in Python is
+    transposing the rows and one dictionary lookup for the (key,
+    implementation) group.
+    """
+
+    def __init__(self, session_factory: sessionmaker = SessionLocal):
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self._pricing: Dict[UUID, Optional[CompiledPricing]] = {}
+        self._loaded = False
+
+    def pricing(self, implementation_id: UUID) -> Optional[CompiledPricing]:
+        if not self._loaded:
+            self.refresh()
+        return self._pricing.get(implementation_id)
+
+    def cost(
+        self, implementation_id: UUID, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0
+    ) -> Optional[float]:
+        """Cost of one call, or None when the implementation has no pricing."""
+        pricing = self.pricing(implementation_id)
+        if pricing is None:
+            return None
+        return pricing.cost(prompt_tokens, completion_tokens, cached_tokens)
+
+    def cost_report(
+        self,
+        db: Session,
+        start: datetime,
+        end: datetime,
+        api_key_id: Optional[UUID] = None,
+        model_implementation_id: Optional[UUID] = None,
+    ) -> List[Dict[str, Any]]:
+        """Token counts and cost per API key and model implementation over a time window."""
+        if not self._loaded:
+            self.refresh()
+        cached = func.coalesce(ApiKeyUsage.prompt_tokens_details["cached_tokens"].as_integer(), 0)
+        # IDs come back as text: building and hashing millions of uuid.UUID objects costs more than the costing
+        statement = select(
+            cast(ApiKeyUsage.api_key_id, String), cast(ApiKeyUsage.model_implementation_id, String),
+            ApiKeyUsage.prompt_tokens, ApiKeyUsage.completion_tokens, cached,
+        ).where(ApiKeyUsage.timestamp >= start, ApiKeyUsage.timestamp < end)
+        if api_key_id is not None:
+            statement = statement.where(ApiKeyUsage.api_key_id == api_key_id)
+        if model_implementation_id is not None:
+            statement = statement.where(ApiKeyUsage.model_implementation_id == model_implementation_id)
+
+        groups: Dict[Tuple[str, str], int] = {}
+        pricings: List[Optional[CompiledPricing]] = []
+        # Per group: request count, prompt, cached and completion tokens, cost
+        totals = np.zeros((0, 5))
+        result = db.execute(statement.execution_options(yield_per=REPORT_BATCH_SIZE))
+        for rows in result.partitions():
+            key_ids, implementation_ids, *counts = zip(*rows)
+            pairs = list(zip(key_ids, implementation_ids))
+            for pair in set(pairs).difference(groups):
+                groups[pair] = len(groups)
+                pricings.append(self._pricing.get(UUID(pair[1])))
+            codes = np.fromiter(map(groups.__getitem__, pairs), dtype=np.int64, count=len(pairs))
+            prompt_tokens, completion_tokens, cached_tokens = (np.array(column, dtype=np.float64) for column in counts)
+            costs = cost_batch(pricings, codes, prompt_tokens, completion_tokens, cached_tokens)
+
+            size = len(groups)
+            totals = np.pad(totals, ((0, size - len(totals)), (0, 0)))
+            totals[:, 0] += np.bincount(codes, minlength=size)
+            for column, values in enumerate((prompt_tokens, np.minimum(cached_tokens, prompt_tokens), completion_tokens), 1):
+                totals[:, column] += np.bincount(codes, weights=values, minlength=size)
+            # Unpriced groups add nothing here and are reported without a cost
+            totals[:, 4] += np.bincount(codes, weights=np.nan_to_num(costs), minlength=size)
+
+        report = []
+        for (key_id, implementation_id), code in groups.items():
+            pricing = pricings[code]
+            report.append({
+                "api_key_id": UUID(key_id),
+                "model_implementation_id": UUID(implementation_id),
+                "request_count": int(totals[code, 0]),
+                "prompt_tokens": int(totals[code, 1]),
+                "cached_tokens": int(totals[code, 2]),
+                "completion_tokens": int(totals[code, 3]),
+                "cost": float(totals[code, 4]) if pricing is not None else None,
+                "currency": pricing.currency if pricing is not None else None,
+            })
+        return sorted(report, key=lambda row: (str(row["api_key_id"]), str(row["model_implementation_id"])))
+
+    def invalidate(self) -> None:
+        """Recompile pricing before the next lookup."""
+        self._loaded = False
+
+    def refresh(self) -> None:
+        """Compile the pricing of every implementation; run periodically by the FastAPI lifespan."""
+        db = self.session_factory()
+        try:
+            rows = db.query(ModelImplementation.id, ModelImplementation.pricing_info).all()
+        finally:
+            db.close()
+
+        pricing = {}
+        for implementation_id, pricing_info in rows:
+            try:
+                pricing[implementation_id] = compile_pricing(pricing_info)
+            except ValueError as e:
+                print(f"Warning: ignoring invalid pricing of implementation {implementation_id}: {e}")
+                pricing[implementation_id] = None
+        with self._lock:
+            self._pricing = pricing
+            self._loaded = True
+
+
+# Process-wide pricing refreshed by the FastAPI lifespan
+pricing_engine = PricingEngine()
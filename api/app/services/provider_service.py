@@ -1,15 +1,45 @@
 from sqlalchemy.orm import Session
 from uuid import UUID
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from sqlalchemy.sql import func
 
 from app.models.provider import ModelProvider, ApiKey
 from app.models.schemas import ModelProviderCreate, ModelProviderUpdate, ApiKeyCreate, ApiKeyUpdate
+from app.services.pagination import paginate
+from app.services.api_key_pool import api_key_pool
+from app.services.free_quota_ledger import free_quota_ledger
+from app.services.rate_limiter import rate_limiter
+from app.services.model_router import model_router
+
+# Stable orderings used for keyset pagination; the trailing id breaks ties
+PROVIDER_ORDER = (ModelProvider.name, ModelProvider.id)
+# sort_order is nullable, and NULL rows would never compare greater than a cursor
+API_KEY_ORDER = (func.coalesce(ApiKey.sort_order, 0), ApiKey.id)
 
 class ProviderService:
     @staticmethod
     def get_providers(db: Session, skip: int = 0, limit: int = 100) -> List[ModelProvider]:
-        return db.query(ModelProvider).offset(skip).limit(limit).all()
+        return db.query(ModelProvider).order_by(*PROVIDER_ORDER).offset(skip).limit(limit).all()
+
+    @staticmethod
+    def get_providers_with_key_counts(
+        db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+    ) -> Tuple[List[Tuple[ModelProvider, int]], Optional[str]]:
+        """
+        Get a page of providers with their API key counts in a single aggregated query.
+        
+        Returns the (provider, api_keys_count) rows and the cursor of the next page.
+        """
+        key_counts = (
+            db.query(ApiKey.provider_id, func.count(ApiKey.id).label("api_keys_count"))
+            .group_by(ApiKey.provider_id)
+            .subquery()
+        )
+        query = (
+            db.query(ModelProvider, func.coalesce(key_counts.c.api_keys_count, 0))
+            .outerjoin(key_counts, key_counts.c.provider_id == ModelProvider.id)
+        )
+        return paginate(query, PROVIDER_ORDER, cursor=cursor, skip=skip, limit=limit)
 
     @staticmethod
     def get_provider(db: Session, provider_id: UUID) -> Optional[ModelProvider]:
@@ -27,6 +57,7 @@ class ProviderService:
             base_url=provider.base_url,
             description=provider.description,
             free_quota_type=provider.free_quota_type,
+            rate_limits=provider.rate_limits.model_dump() if provider.rate_limits else None,
         )
         db.add(db_provider)
         db.commit()
@@ -37,11 +68,13 @@ class ProviderService:
             db_api_key = ApiKey(
                 provider_id=db_provider.id,
                 alias=provider.initial_api_key.alias,
-                key=provider.initial_api_key.key
+                key=provider.initial_api_key.key,
+                weight=provider.initial_api_key.weight
             )
             db.add(db_api_key)
             db.commit()
             db.refresh(db_provider)
+            api_key_pool.invalidate(db_provider.id)
 
         return db_provider
 
@@ -57,6 +90,12 @@ class ProviderService:
             
         db.commit()
         db.refresh(db_provider)
+        if "rate_limits" in update_data:
+            rate_limiter.invalidate()
+        if "name" in update_data or "base_url" in update_data:
+            model_router.invalidate()
+        if "free_quota_type" in update_data:
+            free_quota_ledger.invalidate()
         return db_provider
 
     @staticmethod
@@ -67,13 +106,23 @@ class ProviderService:
             
         db.delete(db_provider)
         db.commit()
+        api_key_pool.invalidate(provider_id)
+        model_router.invalidate()
         return True
 
 
 class ApiKeyService:
     @staticmethod
     def get_api_keys(db: Session, provider_id: UUID, skip: int = 0, limit: int = 100) -> List[ApiKey]:
-        return db.query(ApiKey).filter(ApiKey.provider_id == provider_id).order_by(ApiKey.sort_order).offset(skip).limit(limit).all()
+        return db.query(ApiKey).filter(ApiKey.provider_id == provider_id).order_by(*API_KEY_ORDER).offset(skip).limit(limit).all()
+
+    @staticmethod
+    def get_api_key_page(
+        db: Session, provider_id: UUID, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+    ) -> Tuple[List[ApiKey], Optional[str]]:
+        """Get a page of a provider's API keys ordered by sort order, plus the next page cursor."""
+        query = db.query(ApiKey).filter(ApiKey.provider_id == provider_id)
+        return paginate(query, API_KEY_ORDER, cursor=cursor, skip=skip, limit=limit)
 
     @staticmethod
     def get_api_key(db: Session, api_key_id: UUID) -> Optional[ApiKey]:
@@ -93,11 +142,13 @@ class ApiKeyService:
             provider_id=provider_id,
             alias=api_key.alias,
             key=api_key.key,
-            sort_order=max_sort_order + 1  # Add new key at the end
+            sort_order=max_sort_order + 1,  # Add new key at the end
+            weight=api_key.weight
         )
         db.add(db_api_key)
         db.commit()
         db.refresh(db_api_key)
+        api_key_pool.invalidate(provider_id)
         return db_api_key
 
     @staticmethod
@@ -117,6 +168,7 @@ class ApiKeyService:
             
         db.commit()
         db.refresh(db_api_key)
+        api_key_pool.invalidate(db_api_key.provider_id)
         return db_api_key
 
     @staticmethod
@@ -147,6 +199,7 @@ class ApiKeyService:
 
         db_api_key.sort_order = new_order
         db.commit()
+        api_key_pool.invalidate(provider_id)
         return True
 
     @staticmethod
@@ -155,8 +208,10 @@ class ApiKeyService:
         if db_api_key is None:
             return False
             
+        provider_id = db_api_key.provider_id
         db.delete(db_api_key)
         db.commit()
+        api_key_pool.invalidate(provider_id)
         return True
         
     @staticmethod
@@ -179,6 +234,8 @@ class ApiKeyService:
                 ]
             )
             db.commit()
+            # The keys may belong to several providers
+            api_key_pool.invalidate()
             return True
         except Exception as e:
             db.rollback()
@@ -0,0 +1,258 @@
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text
+from pydantic import ValidationError
+from uuid import UUID
+from typing import Callable, Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+import asyncio
+import os
+import threading
+import time
+
+from app.db.database import SessionLocal
+from app.models.provider import ModelProvider, ModelImplementation, RateLimitBucket
+from app.models.schemas import ProviderRateLimits, RateLimitConfig
+
+# "memory" keeps buckets in this process; "postgres" shares them between workers
+BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# How often limits are reloaded from providers and implementations
+REFRESH_INTERVAL_SECONDS = float(os.getenv("RATE_LIMIT_REFRESH_INTERVAL_SECONDS", "60"))
+
+# Key of the per-key limits in ModelImplementation.custom_parameters
+IMPLEMENTATION_LIMIT_PARAMETER = "rate_limit"
+
+# (bucket key, capacity, refill rate per second, cost)
+Reservation = Tuple[str, float, float, float]
+
+
+class RateLimitExceeded(RuntimeError):
+    """Raised when a call would have to wait longer than the caller allows."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.1f}s")
+
+
+class RateLimitBackend(ABC):
+    """Token bucket storage. reserve() must be atomic per bucket key."""
+
+    # Whether reserve() does I/O and should run off the event loop
+    blocking = False
+
+    @abstractmethod
+    def reserve(self, key: str, capacity: float, rate: float, cost: float) -> float:
+        """
+        Take cost tokens from a bucket holding at most capacity tokens and
+        refilling at rate tokens per second; a negative cost gives tokens back.
+
+        The balance may go negative, which reserves future tokens for this
+        caller. Returns the seconds until the balance is back to zero, i.e.
+        how long the caller has to wait before its call is within budget.
+        """
+
+
+class InMemoryBackend(RateLimitBackend):
+    """Buckets in a dict guarded by a lock, for single-process deployments."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def reserve(self, key: str, capacity: float, rate: float, cost: float) -> float:
+        with self._lock:
+            now = self.clock()
+            state = self._buckets.get(key)
+            tokens = capacity if state is None else min(capacity, state[0] + (now - state[1]) * rate)
+            tokens = min(capacity, tokens - cost)
+            self._buckets[key] = (tokens, now)
+        return max(0.0, -tokens) / rate
+
+
+# Refill and take from a bucket in one statement; the row lock serialises workers
+_RESERVE_SQL = f"""
+    INSERT INTO {RateLimitBucket.__tablename__} (key, tokens, updated_at)
+    VALUES (:key, least(:capacity, :capacity - :cost), clock_timestamp())
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = least(
+            :capacity,
+            least(:capacity, {RateLimitBucket.__tablename__}.tokens
+                + extract(epoch FROM clock_timestamp() - {RateLimitBucket.__tablename__}.updated_at) * :rate)
+            - :cost
+        ),
+        updated_at = clock_timestamp()
+    RETURNING tokens
+"""
+
+
+class PostgresBackend(RateLimitBackend):
+    """Buckets in the unlogged rate_limit_buckets table, shared by every worker."""
+
+    blocking = True
+
+    def __init__(self, session_factory: sessionmaker = SessionLocal):
+        self.session_factory = session_factory
+
+    def reserve(self, key: str, capacity: float, rate: float, cost: float) -> float:
+        db = self.session_factory()
+        try:
+            tokens = db.execute(
+                text(_RESERVE_SQL), {"key": key, "capacity": capacity, "rate": rate, "cost": cost}
+            ).scalar()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return max(0.0, -tokens) / rate
+
+
+class RateLimiter:
+    """
+    Request and token budgets per provider, per API key and per API key and
+    implementation, enforced in front of upstream calls.
+
+    Limits come from ModelProvider.rate_limits (per_key and total) and from
+    the "rate_limit" entry of ModelImplementation.custom_parameters, which
+    applies to each key calling that implementation. Budgets are per minute
+    and may be spent in a burst of up to one minute's worth.
+
+    acquire() reserves one request and the estimated tokens from every
+    applicable bucket and waits until all of them are within budget, so
+    callers queue up instead of being rejected; record_usage() corrects the
+    token buckets once the real count is known.
+    """
+
+    def __init__(self, backend: Optional[RateLimitBackend] = None, session_factory: sessionmaker = SessionLocal):
+        self.backend = backend or InMemoryBackend()
+        self.session_factory = session_factory
+        self._provider_limits: Dict[UUID, ProviderRateLimits] = {}
+        self._implementation_limits: Dict[UUID, RateLimitConfig] = {}
+        self._loaded = False
+
+    def reservations(
+        self, provider_id: UUID, api_key_id: UUID, model_implementation_id: Optional[UUID] = None, tokens: float = 0
+    ) -> List[Reservation]:
+        """Buckets a call draws from, with what it costs in each."""
+        limits: List[Tuple[str, RateLimitConfig]] = []
+        provider = self._provider_limits.get(provider_id)
+        if provider and provider.total:
+            limits.append((f"provider:{provider_id}", provider.total))
+        if provider and provider.per_key:
+            limits.append((f"key:{api_key_id}", provider.per_key))
+        implementation = self._implementation_limits.get(model_implementation_id)
+        if implementation:
+            limits.append((f"key:{api_key_id}:implementation:{model_implementation_id}", implementation))
+
+        reservations = []
+        for name, limit in limits:
+            if limit.requests_per_minute:
+                reservations.append((f"{name}:requests", limit.requests_per_minute, limit.requests_per_minute / 60, 1))
+            if limit.tokens_per_minute and tokens:
+                reservations.append((f"{name}:tokens", limit.tokens_per_minute, limit.tokens_per_minute / 60, tokens))
+        return reservations
+
+    def reserve(
+        self,
+        provider_id: UUID,
+        api_key_id: UUID,
+        model_implementation_id: Optional[UUID] = None,
+        tokens: float = 0,
+        max_wait: Optional[float] = None,
+    ) -> float:
+        """
+        Reserve budget for one call and return how long to wait before making it.
+
+        Raises RateLimitExceeded, without keeping the reservation, when the
+        wait would exceed max_wait.
+        """
+        if not self._loaded:
+            self.refresh()
+        reservations = self.reservations(provider_id, api_key_id, model_implementation_id, tokens)
+        delay = max((self.backend.reserve(*reservation) for reservation in reservations), default=0.0)
+        if max_wait is not None and delay > max_wait:
+            for key, capacity, rate, cost in reservations:
+                self.backend.reserve(key, capacity, rate, -cost)
+            raise RateLimitExceeded(delay)
+        return delay
+
+    async def acquire(
+        self,
+        provider_id: UUID,
+        api_key_id: UUID,
+        model_implementation_id: Optional[UUID] = None,
+        tokens: float = 0,
+        max_wait: Optional[float] = None,
+    ) -> float:
+        """Reserve budget for one call and sleep until it may be made. Returns the seconds waited."""
+        args = (provider_id, api_key_id, model_implementation_id, tokens, max_wait)
+        if self.backend.blocking or not self._loaded:
+            delay = await asyncio.to_thread(self.reserve, *args)
+        else:
+            delay = self.reserve(*args)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def record_usage(
+        self,
+        provider_id: UUID,
+        api_key_id: UUID,
+        model_implementation_id: Optional[UUID],
+        estimated_tokens: float,
+        actual_tokens: float,
+    ) -> None:
+        """Charge or refund the difference between the estimated and the actual token count."""
+        difference = actual_tokens - estimated_tokens
+        if not difference:
+            return
+        for key, capacity, rate, _ in self.reservations(provider_id, api_key_id, model_implementation_id, abs(difference)):
+            if key.endswith(":tokens"):
+                self.backend.reserve(key, capacity, rate, difference)
+
+    def invalidate(self) -> None:
+        """Reload limits before the next reservation."""
+        self._loaded = False
+
+    def refresh(self) -> None:
+        """Load limits from providers and implementations; run periodically by the FastAPI lifespan."""
+        db = self.session_factory()
+        try:
+            providers = db.query(ModelProvider.id, ModelProvider.rate_limits).filter(ModelProvider.rate_limits.isnot(None)).all()
+            implementations = db.query(ModelImplementation.id, ModelImplementation.custom_parameters).filter(
+                ModelImplementation.custom_parameters.has_key(IMPLEMENTATION_LIMIT_PARAMETER)
+            ).all()
+        finally:
+            db.close()
+
+        provider_limits = {}
+        for provider_id, rate_limits in providers:
+            try:
+                provider_limits[provider_id] = ProviderRateLimits.model_validate(rate_limits)
+            except ValidationError as e:
+                print(f"Warning: ignoring invalid rate limits of provider {provider_id}: {e}")
+        implementation_limits = {}
+        for implementation_id, custom_parameters in implementations:
+            try:
+                implementation_limits[implementation_id] = RateLimitConfig.model_validate(
+                    custom_parameters[IMPLEMENTATION_LIMIT_PARAMETER]
+                )
+            except ValidationError as e:
+                print(f"Warning: ignoring invalid rate limit of implementation {implementation_id}: {e}")
+
+        self._provider_limits = provider_limits
+        self._implementation_limits = implementation_limits
+        self._loaded = True
+
+
+def create_backend(name: str = BACKEND) -> RateLimitBackend:
+    if name == "memory":
+        return InMemoryBackend()
+    if name == "postgres":
+        return PostgresBackend()
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+# Process-wide limiter refreshed by the FastAPI lifespan
+rate_limiter = RateLimiter(create_backend())
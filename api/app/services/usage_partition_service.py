@@ -0,0 +1,151 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+from uuid import UUID
+from typing import List, Optional
+from datetime import datetime, timezone
+import os
+import re
+
+from app.db.database import SessionLocal
+from app.models.provider import ApiKeyUsage
+
+USAGE_TABLE = ApiKeyUsage.__tablename__
+# Catch-all partition created with the table, see app.models.provider
+DEFAULT_PARTITION = f"{USAGE_TABLE}_default"
+
+# Number of future monthly partitions kept ready ahead of incoming rows
+PARTITION_MONTHS_AHEAD = int(os.getenv("USAGE_PARTITION_MONTHS_AHEAD", "2"))
+# Number of past months of raw usage to keep; older partitions are dropped
+USAGE_RETENTION_MONTHS = int(os.getenv("USAGE_RETENTION_MONTHS", "13"))
+# How often the lifespan task runs partition maintenance
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("USAGE_PARTITION_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+
+_PARTITION_NAME_PATTERN = re.compile(rf"^{USAGE_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+
+def month_start(moment: datetime) -> datetime:
+    """Return the first instant (UTC) of the month containing the given moment."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    """Shift a month start by a number of months."""
+    index = moment.year * 12 + (moment.month - 1) + months
+    return moment.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start: datetime) -> str:
+    """Name of the monthly partition starting at the given month start."""
+    return f"{USAGE_TABLE}_p{start.year:04d}{start.month:02d}"
+
+
+def list_partitions(db: Session) -> List[str]:
+    """List the monthly partitions currently attached to the usage table."""
+    rows = db.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+        ORDER BY child.relname
+    """), {"table": USAGE_TABLE}).scalars().all()
+    return [name for name in rows if _PARTITION_NAME_PATTERN.match(name)]
+
+
+def ensure_partitions(db: Session, now: Optional[datetime] = None, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """
+    Create the partitions for the current month and the next months_ahead months.
+
+    Postgres refuses to create a partition for a range the default partition
+    already holds rows in, so when rows landed there first the default
+    partition is detached, the new partitions are created, the rows are moved
+    into them and the default partition is attached again, all in one
+    transaction.
+    Returns the names of the partitions that were created.
+    """
+    current = month_start(now or datetime.now(timezone.utc))
+    existing = set(list_partitions(db))
+    missing = [
+        start for start in (add_months(current, offset) for offset in range(months_ahead + 1))
+        if partition_name(start) not in existing
+    ]
+    stranded = [start for start in missing if _default_has_rows(db, start, add_months(start, 1))]
+    if stranded:
+        db.execute(text(f"ALTER TABLE {USAGE_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+
+    created = []
+    for start in missing:
+        name = partition_name(start)
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {USAGE_TABLE} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+        ))
+        created.append(name)
+
+    if stranded:
+        for start in stranded:
+            bounds = {"start": start, "end": add_months(start, 1)}
+            db.execute(text(
+                f"INSERT INTO {partition_name(start)} SELECT * FROM {DEFAULT_PARTITION} "
+                "WHERE timestamp >= :start AND timestamp < :end"
+            ), bounds)
+            db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end"), bounds)
+        db.execute(text(f"ALTER TABLE {USAGE_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    db.commit()
+    return created
+
+
+def _default_has_rows(db: Session, start: datetime, end: datetime) -> bool:
+    return db.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end)"
+    ), {"start": start, "end": end}).scalar()
+
+
+def drop_expired_partitions(db: Session, now: Optional[datetime] = None, retention_months: int = USAGE_RETENTION_MONTHS) -> List[str]:
+    """
+    Drop whole monthly partitions that ended before the retention window.
+
+    Dropping a partition is a metadata operation, unlike a DELETE which would
+    have to scan, lock and vacuum every expired row. Expired rows in the
+    default partition, which only holds rows outside the monthly partitions,
+    are deleted instead. Rows of past months still inside the window stay in
+    the default partition and are read from there.
+    Returns the names of the dropped partitions.
+    """
+    cutoff = add_months(month_start(now or datetime.now(timezone.utc)), -retention_months)
+    dropped = []
+    for name in list_partitions(db):
+        year, month = (int(part) for part in _PARTITION_NAME_PATTERN.match(name).groups())
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        if add_months(start, 1) <= cutoff:
+            db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < :cutoff"), {"cutoff": cutoff})
+    db.commit()
+    return dropped
+
+
+def maintain_partitions() -> None:
+    """Create upcoming partitions and drop expired ones in a dedicated session."""
+    db = SessionLocal()
+    try:
+        ensure_partitions(db)
+        drop_expired_partitions(db)
+    finally:
+        db.close()
+
+
+def get_api_key_usage(db: Session, api_key_id: UUID, start: datetime, end: datetime) -> List[ApiKeyUsage]:
+    """
+    Get the usage records of an API key within [start, end).
+
+    The bounded timestamp range lets Postgres prune every partition outside the window.
+    """
+    return db.query(ApiKeyUsage).filter(
+        ApiKeyUsage.api_key_id == api_key_id,
+        ApiKeyUsage.timestamp >= start,
+        ApiKeyUsage.timestamp < end
+    ).order_by(ApiKeyUsage.timestamp).all()
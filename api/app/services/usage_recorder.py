@@ -0,0 +1,236 @@
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+from uuid import UUID
+import asyncio
+import csv
+import io
+import json
+import os
+import uuid
+
+from app.db.database import SessionLocal
+from app.models.provider import ApiKeyUsage
+from app.models.schemas import ApiKeyUsageCreate
+from app.services import usage_rollup_service
+
+# Flush once this many records are pending
+BATCH_SIZE = int(os.getenv("USAGE_RECORDER_BATCH_SIZE", "500"))
+# Flush at the latest this many seconds after the first pending record
+FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_RECORDER_FLUSH_INTERVAL_SECONDS", "1.0"))
+# record() waits once this many records are queued
+MAX_PENDING = int(os.getenv("USAGE_RECORDER_MAX_PENDING", "10000"))
+# "copy" or "executemany"
+WRITE_METHOD = os.getenv("USAGE_RECORDER_WRITE_METHOD", "copy")
+
+USAGE_COLUMNS = (
+    "id",
+    "api_key_id",
+    "model_implementation_id",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "prompt_tokens_details",
+    "completion_tokens_details",
+    "timestamp",
+)
+
+# Queue marker asking the writer task to exit after writing what it holds
+_STOP = object()
+
+
+class UsageWriteError(RuntimeError):
+    """Raised by flush() when records could not be written; they stay queued for a retry."""
+
+    def __init__(self, pending: int):
+        self.pending = pending
+        super().__init__(f"{pending} usage records could not be written and are waiting for a retry")
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return None  # Written as an unquoted empty field, which COPY reads as NULL
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def usage_row(usage: ApiKeyUsageCreate) -> Dict[str, Any]:
+    """Column values of the ApiKeyUsage row for a usage record, with ID, total and timestamp filled in."""
+    row = usage.model_dump()
+    row["id"] = uuid.uuid4()
+    if row["total_tokens"] is None:
+        row["total_tokens"] = row["prompt_tokens"] + row["completion_tokens"]
+    if row["timestamp"] is None:
+        row["timestamp"] = datetime.now(timezone.utc)
+    return row
+
+
+def copy_usage_rows(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """Write usage rows with a single COPY on the session's connection."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_value(row[column]) for column in USAGE_COLUMNS])
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {ApiKeyUsage.__tablename__} ({', '.join(USAGE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def insert_usage_rows(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """Write usage rows with a single executemany INSERT."""
+    db.execute(insert(ApiKeyUsage.__table__), rows)
+
+
+class UsageRecorder:
+    """
+    Buffers ApiKeyUsage records in memory and writes them in batches.
+
+    A background task collects queued records and writes a batch once
+    batch_size records are pending or flush_interval seconds have passed since
+    the first one, whichever comes first. Each batch is written with one COPY
+    (or executemany INSERT) in a single transaction, which also adds the batch
+    to the hourly and daily usage rollups. The queue is bounded by
+    max_pending, so record() waits when the database falls behind instead of
+    growing memory without limit.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL_SECONDS,
+        max_pending: int = MAX_PENDING,
+        method: str = WRITE_METHOD,
+    ):
+        if method not in ("copy", "executemany"):
+            raise ValueError(f"Unknown usage write method: {method}")
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.method = method
+
+        self.rows_written = 0
+        self.batches_written = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._failed: List[Dict[str, Any]] = []
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        """Start the background writer task on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def record(self, usage: ApiKeyUsageCreate) -> None:
+        """Queue a usage record, waiting while the queue is full."""
+        if not self.running:
+            raise RuntimeError("Usage recorder is not running")
+        await self._queue.put(usage_row(usage))
+
+    async def flush(self) -> None:
+        """
+        Write every record queued so far and wait until it is committed.
+        Raises UsageWriteError when the write failed and records are left for a retry.
+        """
+        if not self.running:
+            return
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put(done)
+        await done
+
+    async def stop(self) -> None:
+        """Write all queued records and stop the writer task."""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        if self._failed:
+            print(f"Warning: dropped {len(self._failed)} usage records that could not be written")
+            self._failed = []
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        batch: List[Dict[str, Any]] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - loop.time())
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if isinstance(item, dict):
+                batch.append(item)
+                if deadline is None:
+                    deadline = loop.time() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            # Size or time threshold reached, or a flush/stop was requested
+            if batch or self._failed:
+                await self._write(batch)
+            batch = []
+            # Retry a failed write after another interval even if nothing new arrives
+            deadline = loop.time() + self.flush_interval if self._failed else None
+
+            # The flushing caller may have been cancelled meanwhile
+            if isinstance(item, asyncio.Future) and not item.done():
+                if self._failed:
+                    item.set_exception(UsageWriteError(len(self._failed)))
+                else:
+                    item.set_result(None)
+            elif item is _STOP:
+                return
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        # Records from a failed write are retried ahead of the new batch
+        rows = self._failed + batch
+        self._failed = []
+        try:
+            await asyncio.to_thread(self._write_rows, rows)
+        except Exception as e:
+            print(f"Warning: failed to write {len(rows)} usage records: {e}")
+            self._failed = rows[-self.max_pending:]
+            return
+        self.rows_written += len(rows)
+        self.batches_written += 1
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        db = self.session_factory()
+        try:
+            if self.method == "copy":
+                copy_usage_rows(db, rows)
+            else:
+                insert_usage_rows(db, rows)
+            # Keep the rollups in step with the raw rows in the same transaction
+            usage_rollup_service.apply_usage_rows(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+# Process-wide recorder started and flushed by the FastAPI lifespan
+usage_recorder = UsageRecorder()
@@ -0,0 +1,218 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from uuid import UUID
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+
+from app.models.provider import ApiKeyUsage, ApiKeyUsageHourly, ApiKeyUsageDaily, RollupGranularity
+
+ROLLUP_MODELS = {
+    RollupGranularity.HOUR: ApiKeyUsageHourly,
+    RollupGranularity.DAY: ApiKeyUsageDaily,
+}
+
+COUNTER_COLUMNS = ("request_count", "prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def as_utc(moment: datetime) -> datetime:
+    """Interpret naive timestamps as UTC and convert aware ones to UTC."""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def bucket_start(moment: datetime, granularity: RollupGranularity) -> datetime:
+    """Truncate a timestamp to the start of its UTC hour or day."""
+    moment = as_utc(moment)
+    if granularity == RollupGranularity.HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_end(moment: datetime, granularity: RollupGranularity) -> datetime:
+    """Round a timestamp up to the next UTC hour or day boundary unless it is one."""
+    moment = as_utc(moment)
+    start = bucket_start(moment, granularity)
+    if start == moment:
+        return start
+    return start + (timedelta(hours=1) if granularity == RollupGranularity.HOUR else timedelta(days=1))
+
+
+def aggregate_usage_rows(rows: Iterable[Dict[str, Any]], granularity: RollupGranularity) -> List[Dict[str, Any]]:
+    """Sum raw usage rows into rollup rows for one granularity."""
+    totals: Dict[Tuple[UUID, UUID, datetime], Dict[str, Any]] = {}
+    for row in rows:
+        key = (row["api_key_id"], row["model_implementation_id"], bucket_start(row["timestamp"], granularity))
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = {
+                "api_key_id": key[0],
+                "model_implementation_id": key[1],
+                "bucket": key[2],
+                "request_count": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+            }
+        total["request_count"] += 1
+        total["prompt_tokens"] += row["prompt_tokens"]
+        total["completion_tokens"] += row["completion_tokens"]
+        total["total_tokens"] += row["total_tokens"]
+    # A fixed order makes concurrent upserts lock rows in the same sequence
+    return [totals[key] for key in sorted(totals, key=lambda k: (str(k[0]), str(k[1]), k[2]))]
+
+
+def apply_usage_rows(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    Add a batch of raw usage rows to the hourly and daily rollups.
+
+    Meant to run in the same transaction that writes the raw rows, so the
+    rollups never diverge from api_key_usage. Does not commit.
+    """
+    for granularity, model in ROLLUP_MODELS.items():
+        values = aggregate_usage_rows(rows, granularity)
+        if not values:
+            continue
+        stmt = pg_insert(model.__table__).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["api_key_id", "model_implementation_id", "bucket"],
+            set_={column: model.__table__.c[column] + stmt.excluded[column] for column in COUNTER_COLUMNS}
+        )
+        db.execute(stmt)
+
+
+def rebuild_rollups(db: Session, start: datetime, end: datetime) -> None:
+    """
+    Recompute the rollups of every bucket in [start, end) from raw usage.
+
+    Used to backfill rows written outside the usage recorder. start and end
+    should be aligned to day boundaries so daily buckets are rebuilt whole.
+    The rollup tables are locked against concurrent upserts for the duration,
+    so batches still being ingested add on top of the rebuilt totals.
+    """
+    for granularity, model in ROLLUP_MODELS.items():
+        table = model.__tablename__
+        unit = "hour" if granularity == RollupGranularity.HOUR else "day"
+        params = {"start": bucket_start(start, granularity), "end": end}
+        db.execute(text(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE"))
+        db.execute(text(f"DELETE FROM {table} WHERE bucket >= :start AND bucket < :end"), params)
+        db.execute(text(f"""
+            INSERT INTO {table}
+                (api_key_id, model_implementation_id, bucket,
+                 request_count, prompt_tokens, completion_tokens, total_tokens)
+            SELECT api_key_id, model_implementation_id, date_trunc('{unit}', timestamp, 'UTC'),
+                   count(*), sum(prompt_tokens), sum(completion_tokens), sum(total_tokens)
+            FROM {ApiKeyUsage.__tablename__}
+            WHERE timestamp >= :start AND timestamp < :end
+            GROUP BY 1, 2, 3
+        """), params)
+    db.commit()
+
+
+def _filtered_rollups(db: Session, model, columns, start: datetime, end: datetime,
+                      api_key_id: Optional[UUID], model_implementation_id: Optional[UUID]):
+    query = db.query(
+        *columns,
+        func.sum(model.request_count).label("request_count"),
+        func.sum(model.prompt_tokens).label("prompt_tokens"),
+        func.sum(model.completion_tokens).label("completion_tokens"),
+        func.sum(model.total_tokens).label("total_tokens"),
+    ).filter(model.bucket >= start, model.bucket < end)
+    if api_key_id is not None:
+        query = query.filter(model.api_key_id == api_key_id)
+    if model_implementation_id is not None:
+        query = query.filter(model.model_implementation_id == model_implementation_id)
+    return query.group_by(*columns).order_by(*columns)
+
+
+def _filtered_raw_usage(db: Session, columns, start: datetime, end: datetime,
+                        api_key_id: Optional[UUID], model_implementation_id: Optional[UUID]):
+    query = db.query(
+        *columns,
+        func.count().label("request_count"),
+        func.sum(ApiKeyUsage.prompt_tokens).label("prompt_tokens"),
+        func.sum(ApiKeyUsage.completion_tokens).label("completion_tokens"),
+        func.sum(ApiKeyUsage.total_tokens).label("total_tokens"),
+    ).filter(ApiKeyUsage.timestamp >= start, ApiKeyUsage.timestamp < end)
+    if api_key_id is not None:
+        query = query.filter(ApiKeyUsage.api_key_id == api_key_id)
+    if model_implementation_id is not None:
+        query = query.filter(ApiKeyUsage.model_implementation_id == model_implementation_id)
+    return query.group_by(*columns).order_by(*columns)
+
+
+def get_usage_timeseries(
+    db: Session,
+    granularity: RollupGranularity,
+    start: datetime,
+    end: datetime,
+    api_key_id: Optional[UUID] = None,
+    model_implementation_id: Optional[UUID] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get usage totals per bucket, served from the rollups.
+
+    The window is widened to whole buckets: every bucket overlapping
+    [start, end) is returned in full, including the partial bucket that
+    contains end, such as the current hour or day.
+    """
+    model = ROLLUP_MODELS[granularity]
+    start, end = bucket_start(start, granularity), bucket_end(end, granularity)
+    rows = _filtered_rollups(db, model, [model.bucket], start, end, api_key_id, model_implementation_id).all()
+    return [dict(row._mapping) for row in rows]
+
+
+def get_usage_totals(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    api_key_id: Optional[UUID] = None,
+    model_implementation_id: Optional[UUID] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get usage totals per API key and implementation within [start, end).
+
+    Whole days are read from the daily rollup, whole hours around them from
+    the hourly rollup, and only the partial hours at either end of the window
+    from raw usage.
+    """
+    start, end = as_utc(start), as_utc(end)
+    first_full_hour, last_full_hour = bucket_end(start, RollupGranularity.HOUR), bucket_start(end, RollupGranularity.HOUR)
+    if first_full_hour >= last_full_hour:
+        ranges = [(ApiKeyUsage, start, end)]
+    else:
+        first_full_day = bucket_end(first_full_hour, RollupGranularity.DAY)
+        last_full_day = bucket_start(last_full_hour, RollupGranularity.DAY)
+        if first_full_day < last_full_day:
+            hours = [
+                (ApiKeyUsageHourly, first_full_hour, first_full_day),
+                (ApiKeyUsageDaily, first_full_day, last_full_day),
+                (ApiKeyUsageHourly, last_full_day, last_full_hour),
+            ]
+        else:
+            hours = [(ApiKeyUsageHourly, first_full_hour, last_full_hour)]
+        ranges = [(ApiKeyUsage, start, first_full_hour), *hours, (ApiKeyUsage, last_full_hour, end)]
+
+    merged: Dict[Tuple[UUID, UUID], Dict[str, Any]] = {}
+    for model, range_start, range_end in ranges:
+        if range_start >= range_end:
+            continue
+        columns = [model.api_key_id, model.model_implementation_id]
+        if model is ApiKeyUsage:
+            query = _filtered_raw_usage(db, columns, range_start, range_end, api_key_id, model_implementation_id)
+        else:
+            query = _filtered_rollups(db, model, columns, range_start, range_end, api_key_id, model_implementation_id)
+        _merge_totals(merged, query.all())
+    return [merged[key] for key in sorted(merged, key=lambda k: (str(k[0]), str(k[1])))]
+
+
+def _merge_totals(merged: Dict[Tuple[UUID, UUID], Dict[str, Any]], rows) -> None:
+    for row in rows:
+        data = dict(row._mapping)
+        key = (data["api_key_id"], data["model_implementation_id"])
+        if key not in merged:
+            merged[key] = data
+        else:
+            for column in COUNTER_COLUMNS:
+                merged[key][column] += data[column]
@@ -0,0 +1,126 @@
+import pytest
+from collections import Counter
+
+from app.models.provider import ModelProvider, ApiKey
+from app.services.api_key_pool import ApiKeyPool, KeySelectionStrategy, NoApiKeyAvailableError
+from app.tests.conftest import TestingSessionLocal
+
+@pytest.fixture
+def keys(db):
+    """Create a provider with three keys of weights 3, 1 and 1 in sort order."""
+    provider = ModelProvider(name="PoolProvider", base_url="https://api.pool.com")
+    db.add(provider)
+    db.flush()
+    keys = [
+        ApiKey(provider_id=provider.id, alias=f"Key{i}", key=f"sk-pool-key-{i}", sort_order=i, weight=weight)
+        for i, weight in enumerate([3, 1, 1])
+    ]
+    db.add_all(keys)
+    db.commit()
+    return provider.id, [key.id for key in keys]
+
+@pytest.fixture
+def exhausted():
+    return set()
+
+@pytest.fixture
+def pool(clock, exhausted):
+    return ApiKeyPool(
+        session_factory=TestingSessionLocal,
+        is_exhausted=lambda api_key_id, provider_id, model_implementation_id: api_key_id in exhausted,
+        clock=clock,
+    )
+
+def test_priority_prefers_first_key_and_fails_over(keys, pool):
+    """Test that the first healthy key in sort order is used and a cooling key is skipped."""
+    provider_id, key_ids = keys
+    assert pool.select(provider_id).id == key_ids[0]
+    assert pool.select(provider_id).id == key_ids[0]
+
+    pool.report_failure(key_ids[0], status_code=429, retry_after=30)
+    assert pool.select(provider_id).id == key_ids[1]
+
+def test_weighted_round_robin_follows_weights(keys, pool):
+    """Test that traffic is spread in proportion to key weights."""
+    provider_id, key_ids = keys
+    picks = [pool.select(provider_id, KeySelectionStrategy.WEIGHTED_ROUND_ROBIN).id for _ in range(50)]
+    counts = Counter(picks)
+    assert counts == {key_ids[0]: 30, key_ids[1]: 10, key_ids[2]: 10}
+    # Smooth: the heavy key is never picked three times in a row
+    assert all(len(set(picks[i:i + 3])) > 1 for i in range(len(picks) - 2))
+
+def test_least_recently_used_rotates(keys, pool):
+    """Test that the least recently used key is handed out next."""
+    provider_id, key_ids = keys
+    picks = [pool.select(provider_id, KeySelectionStrategy.LEAST_RECENTLY_USED).id for _ in range(6)]
+    assert picks == key_ids + key_ids
+
+def test_peek_leaves_rotation_until_taken(keys, pool):
+    """Test that peek() returns the next key without advancing and take() advances past it."""
+    provider_id, key_ids = keys
+    strategy = KeySelectionStrategy.LEAST_RECENTLY_USED
+    assert [pool.peek(provider_id, strategy).id for _ in range(3)] == [key_ids[0]] * 3
+    pool.take(pool.peek(provider_id, strategy), strategy)
+    assert pool.select(provider_id, strategy).id == key_ids[1]
+    assert pool.peek(provider_id, strategy).id == key_ids[2]
+
+def test_cooldown_expires_and_backs_off(keys, pool, clock):
+    """Test that 5xx cooldowns grow per consecutive failure and expire with time."""
+    provider_id, key_ids = keys
+    pool.select(provider_id)
+    pool.report_failure(key_ids[0], status_code=503)
+    pool.report_failure(key_ids[0], status_code=503)
+    assert pool.select(provider_id).id == key_ids[1]
+
+    clock.now += 5
+    assert pool.select(provider_id).id == key_ids[1]  # Second failure doubled the cooldown
+    clock.now += 5
+    assert pool.select(provider_id).id == key_ids[0]
+
+    # Client errors other than 429 do not affect key health
+    pool.report_failure(key_ids[0], status_code=400)
+    assert pool.select(provider_id).id == key_ids[0]
+
+def test_exhausted_keys_are_skipped(keys, pool, exhausted):
+    """Test that keys without free quota left are skipped unless allowed."""
+    provider_id, key_ids = keys
+    exhausted.add(key_ids[0])
+    assert pool.select(provider_id).id == key_ids[1]
+    assert pool.select(provider_id, skip_exhausted=False).id == key_ids[0]
+
+def test_no_key_available(keys, pool):
+    """Test that an error with the earliest retry time is raised when every key cools down."""
+    provider_id, key_ids = keys
+    pool.select(provider_id)
+    for key_id, retry_after in zip(key_ids, [30, 10, 20]):
+        pool.report_failure(key_id, status_code=429, retry_after=retry_after)
+
+    with pytest.raises(NoApiKeyAvailableError) as error:
+        pool.select(provider_id)
+    assert error.value.retry_after == 10
+
+def test_selection_does_not_query_after_load(keys, pool, query_counter):
+    """Test that only the first selection for a provider reads the database."""
+    provider_id, _ = keys
+    pool.select(provider_id)
+    query_counter.clear()
+    for strategy in KeySelectionStrategy:
+        pool.select(provider_id, strategy)
+    assert query_counter == []
+
+def test_invalidate_picks_up_key_changes(db, keys, pool, clock):
+    """Test that a rebuilt pool sees new keys and keeps the health of existing ones."""
+    provider_id, key_ids = keys
+    pool.select(provider_id)
+    pool.report_failure(key_ids[0], status_code=429, retry_after=60)
+
+    new_key = ApiKey(provider_id=provider_id, alias="Key-1", key="sk-pool-key-new", sort_order=-1)
+    db.add(new_key)
+    db.commit()
+    pool.invalidate(provider_id)
+
+    assert pool.select(provider_id).id == new_key.id
+    db.delete(new_key)
+    db.commit()
+    pool.refresh()
+    assert pool.select(provider_id).id == key_ids[1]
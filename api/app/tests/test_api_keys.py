@@ -2,6 +2,8 @@ import pytest
 import uuid
 from fastapi import status
 
+from app.models.provider import ApiKey
+
 @pytest.fixture
 def provider_id(client):
     """Create a test provider and return its ID."""
@@ -252,4 +254,50 @@ def test_partial_update_api_key(client, provider_id):
     
     # The key should still be the same
     response = client.get(f"/providers/{provider_id}/keys/{key_id}")
-    assert response.status_code == status.HTTP_200_OK
\ No newline at end of file
+    assert response.status_code == status.HTTP_200_OK
+
+def test_get_provider_api_keys_cursor_pagination(client, provider_id):
+    """Test walking a provider's API keys page by page in sort order."""
+    aliases = [f"PagedKey{i}" for i in range(5)]
+    for alias in aliases:
+        client.post(
+            f"/providers/{provider_id}/keys",
+            json={
+                "alias": alias,
+                "key": f"sk-{alias.lower()}-12345678"
+            }
+        )
+    
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get(f"/providers/{provider_id}/keys", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        seen.extend(k["alias"] for k in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        params = {"limit": 2, "cursor": next_cursor}
+    
+    assert seen == aliases
+
+def test_cursor_pagination_includes_keys_without_sort_order(client, provider_id, db):
+    """Test that keys with a NULL sort order are paged as if it were 0 instead of being skipped."""
+    for alias in ("First", "Second", "Third"):
+        client.post(f"/providers/{provider_id}/keys", json={"alias": alias, "key": f"sk-{alias.lower()}-12345678"})
+    db.query(ApiKey).filter(ApiKey.alias.in_(["First", "Third"])).update({ApiKey.sort_order: None}, synchronize_session=False)
+    db.commit()
+    
+    seen = []
+    params = {"limit": 1}
+    while True:
+        response = client.get(f"/providers/{provider_id}/keys", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        seen.extend(k["alias"] for k in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        params = {"limit": 1, "cursor": next_cursor}
+    
+    assert sorted(seen[:2]) == ["First", "Third"]
+    assert seen[2] == "Second"
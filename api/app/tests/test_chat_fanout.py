@@ -0,0 +1,226 @@
+import asyncio
+import json
+import uuid
+import httpx
+import pytest
+
+from app.models.provider import ModelProvider, ApiKey, Model, ModelImplementation, FreeQuota, FreeQuotaType, ResetPeriod
+from app.routers import chat
+from app.services.api_key_pool import ApiKeyPool
+from app.services.chat_fanout import FANOUT_ID_HEADER, ChatFanout, FanoutPrompt
+from app.services import circuit_breaker
+from app.services.circuit_breaker import CircuitBreakerRegistry
+from app.services.free_quota_ledger import FreeQuotaLedger
+from app.services.model_router import ModelRouter
+from app.services.pricing import PricingEngine
+from app.services.rate_limiter import RateLimiter, RateLimitExceeded
+from app.services.usage_recorder import UsageRecorder
+from app.tests.conftest import TestingSessionLocal
+
+def completion_stream(*contents):
+    """Body of a streamed OpenAI-compatible chat completion."""
+    chunks = [{"choices": [{"delta": {"content": content}}]} for content in contents]
+    chunks.append({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+    chunks.append({"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": len(contents), "total_tokens": 5 + len(contents)}})
+    return "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+@pytest.fixture
+def fanout_models(db):
+    """Create two implementations of one model on different providers."""
+    fast = ModelProvider(name="FastProvider", base_url="https://api.fast.com/v1")
+    slow = ModelProvider(name="SlowProvider", base_url="https://api.slow.com/v1")
+    model = Model(name="FanoutModel", capabilities=["text-generation"], family="TestFamily")
+    db.add_all([fast, slow, model])
+    db.flush()
+    implementations = [
+        ModelImplementation(provider_id=fast.id, model_id=model.id, provider_model_id="fast-model", sort_order=0),
+        ModelImplementation(provider_id=slow.id, model_id=model.id, provider_model_id="slow-model", sort_order=1),
+    ]
+    db.add_all(implementations + [
+        ApiKey(provider_id=fast.id, alias="FastKey", key="sk-fast-12345678"),
+        ApiKey(provider_id=slow.id, alias="SlowKey", key="sk-slow-12345678"),
+    ])
+    db.commit()
+    return [implementation.id for implementation in implementations]
+
+def make_fanout(handler):
+    pool = ApiKeyPool(session_factory=TestingSessionLocal, is_exhausted=lambda *args: False)
+    router = ModelRouter(
+        session_factory=TestingSessionLocal, key_pool=pool, free_quota_remaining=lambda *args: 0,
+        exploration_rate=0, breakers=CircuitBreakerRegistry(),
+    )
+    return ChatFanout(
+        router=router,
+        limiter=RateLimiter(session_factory=TestingSessionLocal),
+        recorder=UsageRecorder(session_factory=TestingSessionLocal),
+        ledger=FreeQuotaLedger(session_factory=TestingSessionLocal),
+        pricing=PricingEngine(session_factory=TestingSessionLocal),
+        transport=httpx.MockTransport(handler),
+    )
+
+def test_fanout_streams_all_models(fanout_models, client, monkeypatch):
+    """Test that both models' tokens arrive over one stream, tagged and with first-token latency."""
+    fast_id, slow_id = fanout_models
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        if request.url.host == "api.fast.com":
+            return httpx.Response(200, text=completion_stream("Hel", "lo"))
+        return httpx.Response(200, text=completion_stream("Bon", "jour"))
+
+    fanout = make_fanout(handler)
+    monkeypatch.setattr(chat, "chat_fanout", fanout)
+    response = client.post("/chat/fanout", json={
+        "prompt": "Say hello",
+        "system_prompt": "Be brief",
+        "implementation_ids": [str(fast_id), str(slow_id), str(fast_id)],
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    assert events[0] == ("fanout", {
+        "fanout_id": response.headers[FANOUT_ID_HEADER], "implementation_ids": [str(fast_id), str(slow_id)]
+    })
+    assert events[-1][0] == "end"
+
+    for implementation_id, text in ((fast_id, "Hello"), (slow_id, "Bonjour")):
+        own = [(event, data) for event, data in events if data.get("implementation_id") == str(implementation_id)]
+        names = [event for event, _ in own]
+        assert names[:2] == ["start", "first_token"]
+        assert names[-1] == "done"
+        assert "".join(data["content"] for event, data in own if event == "delta") == text
+        done = own[-1][1]
+        assert done["first_token_ms"] <= done["latency_ms"]
+        assert done["usage"]["total_tokens"] == 7
+        assert fanout.router.stats(implementation_id).calls == 1
+
+    assert sorted(request["model"] for request in requests) == ["fast-model", "slow-model"]
+    assert requests[0]["stream"] is True
+    assert requests[0]["messages"] == [
+        {"role": "system", "content": "Be brief"}, {"role": "user", "content": "Say hello"}
+    ]
+
+def test_fanout_reports_upstream_errors_per_model(fanout_models, client, monkeypatch):
+    """Test that one failing model gets an error event while the other completes."""
+    fast_id, slow_id = fanout_models
+
+    def handler(request):
+        if request.url.host == "api.slow.com":
+            return httpx.Response(429, headers={"retry-after": "20"}, text="rate limited")
+        return httpx.Response(200, text=completion_stream("ok"))
+
+    fanout = make_fanout(handler)
+    monkeypatch.setattr(chat, "chat_fanout", fanout)
+    response = client.post("/chat/fanout", json={"prompt": "Hi", "implementation_ids": [str(fast_id), str(slow_id)]})
+    events = parse_events(response.text)
+    errors = [data for event, data in events if event == "error"]
+    assert errors == [{
+        "implementation_id": str(slow_id), "error": "Upstream returned 429: rate limited", "status_code": 429, "retry_after": 20.0
+    }]
+    assert ("done", str(fast_id)) in [(event, data.get("implementation_id")) for event, data in events]
+    assert fanout.router.stats(slow_id).error_rate > 0
+
+def test_fanout_debits_free_quota(fanout_models, db):
+    """Test that the tokens of a finished call are debited from the key's free quota."""
+    fast_id, _ = fanout_models
+    provider = db.query(ModelProvider).filter(ModelProvider.name == "FastProvider").first()
+    provider.free_quota_type = FreeQuotaType.SHARED_TOKENS
+    db.add(FreeQuota(provider_id=provider.id, amount=100, reset_period=ResetPeriod.MONTHLY))
+    db.commit()
+    api_key_id = db.query(ApiKey.id).filter(ApiKey.provider_id == provider.id).scalar()
+
+    fanout = make_fanout(lambda request: httpx.Response(200, text=completion_stream("Hel", "lo")))
+    fanout.ledger.reconcile()
+    events = []
+    asyncio.run(fanout._call(fanout.router.route(fast_id), FanoutPrompt(messages=[{"role": "user", "content": "Hi"}]), events.append))
+    assert events[-1][0] == "done"
+    assert fanout.ledger.remaining(api_key_id, provider.id) == 93
+
+def test_fanout_cancels_single_model(fanout_models):
+    """Test that cancelling one model ends its stream while the other finishes."""
+    fast_id, slow_id = fanout_models
+
+    async def hang():
+        yield b'data: {"choices": [{"delta": {"content": "thinking"}}]}\n\n'
+        await asyncio.Event().wait()
+
+    def handler(request):
+        if request.url.host == "api.slow.com":
+            return httpx.Response(200, content=hang())
+        return httpx.Response(200, text=completion_stream("done"))
+
+    fanout = make_fanout(handler)
+    routes = [fanout.router.route(fast_id), fanout.router.route(slow_id)]
+    fanout_id = uuid.uuid4()
+
+    async def run():
+        events = []
+        finished = set()
+        async for message in fanout.stream(fanout_id, routes, FanoutPrompt(messages=[{"role": "user", "content": "Hi"}])):
+            event, data = parse_events(message)[0]
+            events.append((event, data))
+            if event in ("done", "delta"):
+                finished.add(data["implementation_id"])
+            if finished == {str(fast_id), str(slow_id)} and fanout.cancel(fanout_id, slow_id):
+                finished.add("cancel requested")
+        return events
+
+    events = asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert ("cancelled", {"implementation_id": str(slow_id)}) in events
+    assert ("done", str(fast_id)) in [(event, data.get("implementation_id")) for event, data in events]
+    assert events[-1][0] == "end"
+    # Cancelling is not a failure of the implementation
+    assert fanout.router.stats(slow_id).calls == 0
+    assert not fanout.cancel(fanout_id)
+
+def test_fanout_releases_probe_when_refused(fanout_models, monkeypatch):
+    """Test that a half-open probe taken for a call refused by the rate limiter is given back."""
+    fast_id, _ = fanout_models
+    fanout = make_fanout(lambda request: httpx.Response(200, text=completion_stream("ok")))
+    route = fanout.router.route(fast_id)
+    breakers = fanout.router.breakers
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breakers.record(None, fast_id, success=False)
+    monkeypatch.setattr(circuit_breaker, "OPEN_SECONDS", 0)
+
+    async def refuse(*args, **kwargs):
+        raise RateLimitExceeded(5)
+
+    monkeypatch.setattr(fanout.limiter, "acquire", refuse)
+    events = []
+    asyncio.run(fanout._call(route, FanoutPrompt(messages=[{"role": "user", "content": "Hi"}]), events.append))
+    assert events[0][0] == "error"
+    assert breakers.available(route.provider_id, fast_id)
+
+def test_fanout_reports_malformed_chunks(fanout_models, monkeypatch):
+    """Test that an unexpected chunk shape ends the call with an error event and frees the probe slot."""
+    fast_id, _ = fanout_models
+    fanout = make_fanout(lambda request: httpx.Response(200, text='data: ["not", "an", "object"]\n\n'))
+    route = fanout.router.route(fast_id)
+    breakers = fanout.router.breakers
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breakers.record(None, fast_id, success=False)
+    monkeypatch.setattr(circuit_breaker, "OPEN_SECONDS", 0)
+
+    events = []
+    asyncio.run(fanout._call(route, FanoutPrompt(messages=[{"role": "user", "content": "Hi"}]), events.append))
+    assert [event for event, _ in events] == ["start", "error"]
+    assert events[-1][1]["error"] == "'list' object has no attribute 'get'"
+    assert fanout.router.stats(fast_id).error_rate > 0
+    # The failed probe was recorded, so its slot is not held until PROBE_TIMEOUT_SECONDS
+    assert breakers.available(route.provider_id, fast_id)
+
+def test_fanout_rejects_unknown_implementations(fanout_models, client, monkeypatch):
+    """Test that unknown or unavailable implementations are rejected before streaming starts."""
+    monkeypatch.setattr(chat, "chat_fanout", make_fanout(lambda request: httpx.Response(500)))
+    response = client.post("/chat/fanout", json={"prompt": "Hi", "implementation_ids": [str(uuid.uuid4())]})
+    assert response.status_code == 404
+    assert client.delete(f"/chat/fanout/{uuid.uuid4()}").status_code == 404
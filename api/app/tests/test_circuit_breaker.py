@@ -0,0 +1,171 @@
+import uuid
+import pytest
+
+from app.models.provider import CircuitKind, CircuitState
+from app.services import circuit_breaker
+from app.services.api_key_pool import ApiKeyPool
+from app.services.circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, circuit_breakers
+from app.services.model_router import ModelRouter, NoRouteAvailableError, RoutingPolicy, model_router
+from app.tests.conftest import TestingSessionLocal
+
+def test_opens_on_error_rate(clock):
+    """Test that the circuit stays closed until enough calls fail, then rejects calls."""
+    breaker = CircuitBreaker(clock)
+    for _ in range(circuit_breaker.MIN_CALLS - 1):
+        breaker.record(success=False)
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record(success=False)
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(circuit_breaker.OPEN_SECONDS)
+
+def test_opens_on_slow_calls(clock):
+    """Test that successful but slow calls also open the circuit."""
+    breaker = CircuitBreaker(clock)
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breaker.record(success=True, latency=circuit_breaker.SLOW_CALL_SECONDS + 1)
+    assert breaker.state == CircuitState.OPEN
+
+def test_half_open_probe_closes_or_reopens(clock):
+    """Test that after the open period one probe is let through and its outcome decides the state."""
+    breaker = CircuitBreaker(clock)
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breaker.record(success=False)
+    clock.now += circuit_breaker.OPEN_SECONDS
+    assert breaker.allow()
+    assert breaker.state == CircuitState.HALF_OPEN
+    # The probe slot is taken until its outcome is recorded
+    assert not breaker.allow()
+    breaker.record(success=False)
+    assert breaker.state == CircuitState.OPEN
+
+    clock.now += circuit_breaker.OPEN_SECONDS
+    assert breaker.allow()
+    breaker.record(success=True, latency=0.5)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.calls == 0
+
+def test_provider_circuit_trips_all_implementations(clock):
+    """Test that an open provider circuit rejects every implementation of that provider."""
+    registry = CircuitBreakerRegistry(clock)
+    provider_id, first, second = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    for _ in range(circuit_breaker.MIN_CALLS):
+        registry.record(provider_id, first, success=False)
+    assert not registry.allow(provider_id, second)
+    assert registry.retry_after(provider_id, second) == pytest.approx(circuit_breaker.OPEN_SECONDS)
+    # An implementation-only failure leaves the provider alone
+    other_provider = uuid.uuid4()
+    for _ in range(circuit_breaker.MIN_CALLS):
+        registry.record(None, second, success=False)
+    assert registry.allow(other_provider, first)
+
+def test_router_skips_open_circuits(routed, clock):
+    """Test that routes behind an open circuit are skipped and the wait is reported."""
+    _, _, (primary_id, _, backup_id) = routed
+    registry = CircuitBreakerRegistry(clock)
+    pool = ApiKeyPool(session_factory=TestingSessionLocal, is_exhausted=lambda *args: False)
+    router = ModelRouter(
+        session_factory=TestingSessionLocal, key_pool=pool, free_quota_remaining=lambda *args: 0,
+        exploration_rate=0, breakers=registry,
+    )
+    router.resolve("RoutedModel")
+    for _ in range(circuit_breaker.MIN_CALLS):
+        router.report(primary_id, None, success=False)
+    assert [item.route.implementation_id for item in router.resolve("RoutedModel")] == [backup_id]
+
+    for _ in range(circuit_breaker.MIN_CALLS):
+        router.report(backup_id, None, success=False)
+    with pytest.raises(NoRouteAvailableError) as error:
+        router.resolve("RoutedModel")
+    assert error.value.retry_after == pytest.approx(circuit_breaker.OPEN_SECONDS)
+
+def test_only_selected_route_takes_probe(routed, clock):
+    """Test that listing routes leaves half-open circuits alone while select() takes and release() frees the probe."""
+    _, _, (primary_id, _, backup_id) = routed
+    registry = CircuitBreakerRegistry(clock)
+    pool = ApiKeyPool(session_factory=TestingSessionLocal, is_exhausted=lambda *args: False)
+    router = ModelRouter(
+        session_factory=TestingSessionLocal, key_pool=pool, free_quota_remaining=lambda *args: 0,
+        exploration_rate=0, breakers=registry,
+    )
+    router.resolve("RoutedModel")
+    for _ in range(circuit_breaker.MIN_CALLS):
+        router.report(primary_id, None, success=False)
+    clock.now += circuit_breaker.OPEN_SECONDS
+    # Sort order, so the failures that opened the circuit do not rank the primary last
+    policy = RoutingPolicy.SORT_ORDER
+
+    for _ in range(3):
+        assert [item.route.implementation_id for item in router.resolve("RoutedModel", policy=policy)] == [primary_id, backup_id]
+    selected = router.select("RoutedModel", policy=policy)
+    assert selected.route.implementation_id == primary_id
+    # The probe is in flight, so other calls go to the backup
+    assert router.select("RoutedModel", policy=policy).route.implementation_id == backup_id
+    registry.release(selected.route.provider_id, primary_id)
+    assert router.select("RoutedModel", policy=policy).route.implementation_id == primary_id
+
+def test_claim_keeps_only_closed_fallbacks(routed, clock):
+    """Test that claim() hands the probe to the first route and drops half-open fallbacks."""
+    _, _, (primary_id, _, backup_id) = routed
+    registry = CircuitBreakerRegistry(clock)
+    pool = ApiKeyPool(session_factory=TestingSessionLocal, is_exhausted=lambda *args: False)
+    router = ModelRouter(
+        session_factory=TestingSessionLocal, key_pool=pool, free_quota_remaining=lambda *args: 0,
+        exploration_rate=0, breakers=registry,
+    )
+    router.resolve("RoutedModel")
+    for _ in range(circuit_breaker.MIN_CALLS):
+        router.report(primary_id, None, success=False)
+    clock.now += circuit_breaker.OPEN_SECONDS
+    policy = RoutingPolicy.SORT_ORDER
+
+    claimed = router.claim("RoutedModel", policy=policy)
+    assert [(item.route.implementation_id, item.probe) for item in claimed] == [(primary_id, True), (backup_id, False)]
+    # The primary's probe is in flight and it is not offered as a fallback without one
+    claimed = router.claim("RoutedModel", policy=policy)
+    assert [(item.route.implementation_id, item.probe) for item in claimed] == [(backup_id, False)]
+    router.report(primary_id, 0.1, success=True)
+    claimed = router.claim("RoutedModel", policy=policy)
+    assert [(item.route.implementation_id, item.probe) for item in claimed] == [(primary_id, False), (backup_id, False)]
+
+def test_routes_endpoint_holds_probe_until_outcome(routed, client, clock, monkeypatch):
+    """Test that the routes endpoint takes the probe of its first route and the reported outcome frees it."""
+    _, _, (primary_id, _, backup_id) = routed
+    monkeypatch.setattr(model_router, "session_factory", TestingSessionLocal)
+    monkeypatch.setattr(model_router, "exploration_rate", 0)
+    monkeypatch.setattr(model_router, "breakers", CircuitBreakerRegistry(clock))
+    monkeypatch.setattr(model_router.key_pool, "session_factory", TestingSessionLocal)
+    model_router.invalidate()
+    model_router.key_pool.invalidate()
+    model_router.resolve("RoutedModel")
+    for _ in range(circuit_breaker.MIN_CALLS):
+        model_router.report(primary_id, None, success=False)
+    clock.now += circuit_breaker.OPEN_SECONDS
+    url = "/models/routes/RoutedModel?policy=SORT_ORDER"
+
+    data = client.get(url).json()
+    assert [(route["implementation_id"], route["probe"]) for route in data] == [(str(primary_id), True), (str(backup_id), False)]
+    assert [route["implementation_id"] for route in client.get(url).json()] == [str(backup_id)]
+
+    response = client.post("/models/routes/outcomes", json={"implementation_id": str(primary_id), "success": False})
+    assert response.status_code == 204
+    clock.now += circuit_breaker.OPEN_SECONDS
+    assert client.get(url).json()[0]["probe"] is True
+
+def test_circuits_endpoint(client, monkeypatch):
+    """Test that breaker state is exposed next to the health check."""
+    registry = CircuitBreakerRegistry()
+    monkeypatch.setattr(circuit_breakers, "_breakers", registry._breakers)
+    implementation_id = uuid.uuid4()
+    for _ in range(circuit_breaker.MIN_CALLS):
+        circuit_breakers.record(None, implementation_id, success=False)
+
+    response = client.get("/health/circuits")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["kind"] == CircuitKind.IMPLEMENTATION.value
+    assert data[0]["id"] == str(implementation_id)
+    assert data[0]["state"] == CircuitState.OPEN.value
+    assert data[0]["error_rate"] == pytest.approx(1.0)
+    assert data[0]["retry_after"] > 0
@@ -0,0 +1,128 @@
+import pytest
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app.models.provider import FreeQuotaUsage, ResetPeriod
+from app.services import free_quota_service
+from app.services.free_quota_ledger import FreeQuotaLedger
+from app.tests.conftest import TestingSessionLocal
+
+@pytest.fixture
+def ledger():
+    return FreeQuotaLedger(session_factory=TestingSessionLocal)
+
+def test_ledger_serves_checks_from_memory(db, usage_quota, ledger, query_counter):
+    """Test that remaining checks and consumption issue no queries."""
+    quota = usage_quota()
+    ledger.reconcile()
+    query_counter.clear()
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 1000
+    ledger.consume(quota["api_key_id"], quota["free_quota_id"], 150)
+    ledger.consume(quota["api_key_id"], quota["free_quota_id"], 50)
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 800
+    assert query_counter == []
+
+def test_ledger_flush_coalesces_increments(db, usage_quota, ledger, query_counter):
+    """Test that increments are written with one batched upsert."""
+    quota = usage_quota()
+    ledger.reconcile()
+    for _ in range(10):
+        ledger.consume(quota["api_key_id"], quota["free_quota_id"], 10)
+    
+    query_counter.clear()
+    assert ledger.flush() == 1
+    assert len([s for s in query_counter if "INSERT INTO free_quota_usages" in s]) == 1
+    
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    assert usage.used_amount == 100
+    
+    # Nothing left to write
+    assert ledger.flush() == 0
+    assert free_quota_service.get_remaining_quota(db, quota["api_key_id"], quota["provider_id"]) == 900
+
+def test_add_usage_amounts_upserts_in_one_statement(db, usage_quota, query_counter):
+    """Test that many increments are written by one unnest() upsert that skips unknown keys."""
+    quota = usage_quota()
+    api_key_id = quota["api_key_id"]
+    daily_id = usage_quota(amount=500, reset_period=ResetPeriod.DAILY)["free_quota_id"]
+    free_quota_service.create_or_update_usage(db, api_key_id, daily_id, 5)
+    
+    query_counter.clear()
+    free_quota_service.add_usage_amounts(db, {
+        (api_key_id, quota["free_quota_id"]): 10,
+        (api_key_id, daily_id): 20,
+        (uuid.uuid4(), daily_id): 30,
+    })
+    db.commit()
+    inserts = [s for s in query_counter if "INSERT INTO free_quota_usages" in s]
+    assert len(inserts) == 1
+    assert "unnest" in inserts[0]
+    
+    db.expire_all()
+    used = {usage.free_quota_id: usage.used_amount for usage in db.query(FreeQuotaUsage).all()}
+    assert used == {quota["free_quota_id"]: 10, daily_id: 25}
+
+def test_ledger_reconcile_keeps_unflushed_increments(db, usage_quota, ledger):
+    """Test that reloading picks up other writers without losing local increments."""
+    quota = usage_quota()
+    ledger.reconcile()
+    ledger.consume(quota["api_key_id"], quota["free_quota_id"], 30)
+    
+    # Another worker consumed directly in the database
+    free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 200)
+    
+    ledger.reconcile()
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 770
+    
+    ledger.flush()
+    db.expire_all()
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    assert usage.used_amount == 230
+
+def test_ledger_rolls_over_expired_period(db, usage_quota, ledger):
+    """Test that a counter past its reset date counts as a fresh period."""
+    quota = usage_quota()
+    ledger.reconcile()
+    free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 600)
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    usage.next_reset_date = datetime.now(timezone.utc) - timedelta(minutes=1)
+    db.commit()
+    ledger.reconcile()
+    
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 1000
+    ledger.consume(quota["api_key_id"], quota["free_quota_id"], 25)
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 975
+    
+    ledger.flush()
+    db.expire_all()
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    assert usage.used_amount == 25
+
+def test_ledger_keeps_usage_of_unknown_quota(db, usage_quota, ledger):
+    """Test that consuming a quota created since the last reconcile is kept and written."""
+    ledger.reconcile()
+    quota = usage_quota()
+    ledger.consume(quota["api_key_id"], quota["free_quota_id"], 40)
+    
+    ledger.maintain()
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 960
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    assert usage.used_amount == 40
+
+def test_ledger_record_usage_debits_applicable_quotas(usage_quota, ledger):
+    """Test that recorded calls are debited from the quotas of their provider."""
+    quota = usage_quota()
+    ledger.reconcile()
+    ledger.record_usage(quota["api_key_id"], quota["provider_id"], None, 120)
+    ledger.record_usage(quota["api_key_id"], uuid.uuid4(), None, 500)
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 880
+
+def test_ledger_holds_back_usage_until_reconcile(usage_quota, ledger):
+    """Test that usage recorded after invalidate() is debited from quotas created in the meantime."""
+    ledger.reconcile()
+    quota = usage_quota()
+    ledger.invalidate()
+    ledger.record_usage(quota["api_key_id"], quota["provider_id"], None, 75)
+    
+    ledger.maintain()
+    assert ledger.remaining(quota["api_key_id"], quota["provider_id"]) == 925
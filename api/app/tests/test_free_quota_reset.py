@@ -0,0 +1,65 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+
+from app.models.provider import ResetPeriod
+from app.services import free_quota_service
+from app.services.free_quota_reset_service import next_reset_date, next_reset_date_sql, reset_due_usages
+
+NOW = datetime(2026, 12, 31, 22, 30, tzinfo=timezone.utc)  # A Thursday
+
+@pytest.mark.parametrize("reset_period,expected", [
+    (ResetPeriod.DAILY, datetime(2027, 1, 1, tzinfo=timezone.utc)),
+    (ResetPeriod.WEEKLY, datetime(2027, 1, 4, tzinfo=timezone.utc)),
+    (ResetPeriod.MONTHLY, datetime(2027, 1, 1, tzinfo=timezone.utc)),
+    (ResetPeriod.YEARLY, datetime(2027, 1, 1, tzinfo=timezone.utc)),
+    (ResetPeriod.NEVER, None),
+])
+def test_next_reset_date(reset_period, expected):
+    """Test the end of the period containing a given moment."""
+    assert next_reset_date(reset_period, NOW) == expected
+
+def test_next_reset_date_matches_sql(db):
+    """Test that Postgres computes the same boundaries as Python."""
+    for reset_period in ResetPeriod:
+        sql = next_reset_date_sql(reset_period=":period", now="CAST(:now AS timestamptz)")
+        result = db.execute(text(f"SELECT {sql}"), {"period": reset_period.value, "now": NOW}).scalar()
+        assert result == next_reset_date(reset_period, NOW)
+
+def expire_usage(db, quota):
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    usage.next_reset_date = datetime.now(timezone.utc) - timedelta(minutes=1)
+    db.commit()
+
+def test_remaining_quota_is_a_pure_read(db, usage_quota, query_counter):
+    """Test that reading remaining quota ignores a finished period without writing."""
+    quota = usage_quota(reset_period=ResetPeriod.DAILY)
+    free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 400)
+    assert free_quota_service.get_remaining_quota(db, quota["api_key_id"], quota["provider_id"]) == 600
+    expire_usage(db, quota)
+
+    query_counter.clear()
+    assert free_quota_service.get_remaining_quota(db, quota["api_key_id"], quota["provider_id"]) == 1000
+    assert all(s.lstrip().upper().startswith("SELECT") for s in query_counter)
+
+    db.expire_all()
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    assert usage.used_amount == 400
+
+def test_sweeper_resets_due_usage(db, usage_quota, query_counter):
+    """Test that all due usage rows are reset with one UPDATE."""
+    quota = usage_quota(reset_period=ResetPeriod.DAILY)
+    free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 400)
+    expire_usage(db, quota)
+
+    query_counter.clear()
+    assert reset_due_usages(db) == 1
+    assert len([s for s in query_counter if "UPDATE free_quota_usages" in s]) == 1
+
+    db.expire_all()
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    assert usage.used_amount == 0
+    assert usage.next_reset_date == next_reset_date(ResetPeriod.DAILY)
+
+    # Rows in their current period are left alone
+    assert reset_due_usages(db) == 0
@@ -2,12 +2,16 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 import uuid
-from typing import Dict, List
-from datetime import datetime
+from typing import Callable, Dict, List
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
 
 from app.main import app
-from app.models.provider import ModelProvider, FreeQuota, FreeQuotaUsage, FreeQuotaType, ResetPeriod
+from app.models.provider import ModelProvider, ApiKey, FreeQuota, FreeQuotaUsage, FreeQuotaType, ResetPeriod
 from app.models.schemas import FreeQuotaCreate, ModelProviderCreate
+from app.services import free_quota_service
+from app.tests.conftest import TestingSessionLocal
 
 client = TestClient(app)
 
@@ -213,4 +217,89 @@ def test_provider_includes_free_quotas(test_provider: Dict):
     assert data["free_quota"] is not None
     
     # Check free_quota_type is set
-    assert data["free_quota_type"] == test_provider["free_quota_type"]
\ No newline at end of file
+    assert data["free_quota_type"] == test_provider["free_quota_type"]
+
+def test_concurrent_usage_updates_are_not_lost(db: Session, usage_quota: Callable[..., Dict]):
+    """Test that concurrent consumption of one key's quota adds up exactly"""
+    quota = usage_quota(amount=1_000_000)
+    threads, calls_per_thread, amount = 16, 25, 1.5
+    
+    def consume(_):
+        session = TestingSessionLocal()
+        try:
+            for _ in range(calls_per_thread):
+                free_quota_service.create_or_update_usage(
+                    session, quota["api_key_id"], quota["free_quota_id"], amount
+                )
+        finally:
+            session.close()
+    
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(consume, range(threads)))
+    
+    db.expire_all()
+    usage = free_quota_service.get_free_quota_usage(db, quota["api_key_id"], quota["free_quota_id"])
+    assert usage.used_amount == threads * calls_per_thread * amount
+    assert db.query(FreeQuotaUsage).count() == 1
+
+def test_usage_rolls_over_after_reset_date(db: Session, usage_quota: Callable[..., Dict]):
+    """Test that consumption after next_reset_date starts a new period atomically"""
+    quota = usage_quota(amount=1_000_000)
+    usage = free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 40)
+    assert usage.used_amount == 40
+    assert usage.next_reset_date > datetime.now(timezone.utc)
+    
+    # Move the period boundary into the past
+    usage.next_reset_date = datetime.now(timezone.utc) - timedelta(minutes=1)
+    db.commit()
+    
+    usage = free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 5)
+    assert usage.used_amount == 5
+    assert usage.next_reset_date > datetime.now(timezone.utc)
+    
+    usage = free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 5)
+    assert usage.used_amount == 10
+
+def test_usage_for_unknown_quota_or_key(db: Session, usage_quota: Callable[..., Dict]):
+    """Test that consuming an unknown quota or API key returns 404"""
+    quota = usage_quota(amount=1_000_000)
+    with pytest.raises(HTTPException) as e:
+        free_quota_service.create_or_update_usage(db, quota["api_key_id"], uuid.uuid4(), 1)
+    assert e.value.status_code == 404
+    
+    with pytest.raises(HTTPException) as e:
+        free_quota_service.create_or_update_usage(db, uuid.uuid4(), quota["free_quota_id"], 1)
+    assert e.value.status_code == 404
+
+def test_provider_remaining_free_quota(client, db: Session, usage_quota: Callable[..., Dict], query_counter):
+    """Test that remaining quota for all keys of a provider comes from one aggregate query"""
+    quota = usage_quota(amount=1_000_000)
+    api_key = db.query(ApiKey).filter(ApiKey.id == quota["api_key_id"]).first()
+    provider_id = api_key.provider_id
+    other_key = ApiKey(provider_id=provider_id, alias="OtherKey", key="sk-other-12345678", sort_order=1)
+    db.add(other_key)
+    db.commit()
+    free_quota_service.create_or_update_usage(db, quota["api_key_id"], quota["free_quota_id"], 250)
+    
+    query_counter.clear()
+    response = client.get(f"/providers/{provider_id}/free-quota/remaining")
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert [row["alias"] for row in data] == ["UsageKey", "OtherKey"]
+    assert data[0]["used_amount"] == 250
+    assert data[0]["remaining_amount"] == 1_000_000 - 250
+    assert data[1]["used_amount"] == 0
+    assert data[1]["remaining_amount"] == 1_000_000
+    # Keys without usage still report when the current period would end
+    assert all(row["next_reset_date"] is not None for row in data)
+    
+    # Provider lookup plus one aggregate, regardless of the number of keys
+    selects = [s for s in query_counter if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 2
+
+def test_provider_remaining_free_quota_unknown_provider(client):
+    """Test that the remaining quota endpoint returns 404 for unknown providers"""
+    response = client.get(f"/providers/{uuid.uuid4()}/free-quota/remaining")
+    assert response.status_code == 404
+
@@ -0,0 +1,48 @@
+import pytest
+import uuid
+from sqlalchemy import text
+
+def explain(db, sql, **params):
+    """Return the query plan for a statement with sequential scans disabled."""
+    # Tables are tiny in tests, so force the planner to consider the indexes
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    rows = db.execute(text(f"EXPLAIN {sql}"), params).scalars().all()
+    return "\n".join(rows)
+
+@pytest.mark.parametrize("sql, params, index_name", [
+    (
+        "SELECT * FROM api_keys WHERE provider_id = :id ORDER BY sort_order",
+        {"id": str(uuid.uuid4())},
+        "ix_api_keys_provider_id_sort_order",
+    ),
+    (
+        "SELECT * FROM model_implementations WHERE model_id = :id ORDER BY sort_order",
+        {"id": str(uuid.uuid4())},
+        "ix_model_implementations_model_id_sort_order",
+    ),
+    (
+        "SELECT * FROM model_implementations WHERE provider_id = :id",
+        {"id": str(uuid.uuid4())},
+        "ix_model_implementations_provider_id",
+    ),
+    (
+        "SELECT * FROM api_key_usage WHERE api_key_id = :id AND timestamp >= now() - interval '30 days'",
+        {"id": str(uuid.uuid4())},
+        # api_key_usage is partitioned, so the plan names the per-partition copy of the index
+        "api_key_id_timestamp",
+    ),
+    (
+        "SELECT * FROM free_quota_usages WHERE api_key_id = :key_id AND free_quota_id = :quota_id",
+        {"key_id": str(uuid.uuid4()), "quota_id": str(uuid.uuid4())},
+        "uq_free_quota_usage_api_key_quota",
+    ),
+    (
+        "DELETE FROM free_quota_usages WHERE free_quota_id = :id",
+        {"id": str(uuid.uuid4())},
+        "ix_free_quota_usages_free_quota_id",
+    ),
+])
+def test_lookup_uses_index(db, sql, params, index_name):
+    """Test that the common lookups are served by the matching index."""
+    plan = explain(db, sql, **params)
+    assert index_name in plan, plan
@@ -0,0 +1,185 @@
+import pytest
+
+from app.models.provider import ModelProvider, ApiKey, Model, ModelImplementation
+from app.services.api_key_pool import ApiKeyPool, KeySelectionStrategy
+from app.services.circuit_breaker import CircuitBreakerRegistry
+from app.services.model_router import (
+    ModelRouter, ModelNotFoundError, NoRouteAvailableError, RoutingPolicy, RoutingWeights, model_router, unit_price
+)
+from app.tests.conftest import TestingSessionLocal
+
+@pytest.fixture
+def free_quota():
+    """Remaining free quota per implementation ID, zero when missing."""
+    return {}
+
+@pytest.fixture
+def router(free_quota):
+    pool = ApiKeyPool(session_factory=TestingSessionLocal, is_exhausted=lambda *args: False)
+    return ModelRouter(
+        session_factory=TestingSessionLocal,
+        key_pool=pool,
+        free_quota_remaining=lambda api_key_id, provider_id, implementation_id: free_quota.get(implementation_id, 0),
+        weights=RoutingWeights(latency=1, error_rate=2, price=1, free_quota=1),
+        exploration_rate=0,
+        breakers=CircuitBreakerRegistry(),
+    )
+
+def test_resolve_orders_available_implementations(routed, router):
+    """Test that routes follow sort order, skip unavailable implementations and carry a key."""
+    _, key_ids, implementation_ids = routed
+    resolved = router.resolve("RoutedModel")
+    assert [item.route.implementation_id for item in resolved] == [implementation_ids[0], implementation_ids[2]]
+    assert [item.route.base_url for item in resolved] == ["https://api.primary.com", "https://api.backup.com"]
+    assert [item.api_key.id for item in resolved] == key_ids
+
+def test_resolve_serves_from_snapshot(routed, router, query_counter):
+    """Test that resolution only queries the database when the snapshot is loaded."""
+    router.resolve("RoutedModel")
+    query_counter.clear()
+    for _ in range(10):
+        router.resolve("RoutedModel")
+    assert query_counter == []
+
+def test_resolve_skips_providers_without_usable_keys(routed, router):
+    """Test that a provider whose keys are cooling down is skipped."""
+    _, key_ids, implementation_ids = routed
+    router.resolve("RoutedModel")
+    router.key_pool.report_failure(key_ids[0], status_code=429, retry_after=30)
+    assert router.select("RoutedModel").route.implementation_id == implementation_ids[2]
+
+    router.key_pool.report_failure(key_ids[1], status_code=429, retry_after=10)
+    with pytest.raises(NoRouteAvailableError) as error:
+        router.resolve("RoutedModel")
+    assert error.value.retry_after == pytest.approx(10, abs=1)
+
+@pytest.mark.parametrize("strategy", [KeySelectionStrategy.WEIGHTED_ROUND_ROBIN, KeySelectionStrategy.LEAST_RECENTLY_USED])
+def test_resolve_does_not_rotate_keys(db, router, strategy):
+    """Test that listing routes leaves the key rotation alone and only the selected route advances it."""
+    provider = ModelProvider(name="SharedProvider", base_url="https://api.shared.com")
+    model = Model(name="SharedModel", capabilities=["text-generation"], family="TestFamily")
+    db.add_all([provider, model])
+    db.flush()
+    keys = [ApiKey(provider_id=provider.id, alias=f"SharedKey{i}", key=f"sk-shared-{i}-12345678", sort_order=i) for i in range(2)]
+    db.add_all(keys + [
+        ModelImplementation(provider_id=provider.id, model_id=model.id, provider_model_id=f"shared-model-{i}", sort_order=i)
+        for i in range(2)
+    ])
+    db.commit()
+    key_ids = [key.id for key in keys]
+
+    for _ in range(3):
+        resolved = router.resolve("SharedModel", strategy, policy=RoutingPolicy.SORT_ORDER)
+        assert [item.api_key.id for item in resolved] == [key_ids[0], key_ids[0]]
+
+    assert router.select("SharedModel", strategy, policy=RoutingPolicy.SORT_ORDER).api_key.id == key_ids[0]
+    resolved = router.resolve("SharedModel", strategy, policy=RoutingPolicy.SORT_ORDER)
+    assert [item.api_key.id for item in resolved] == [key_ids[1], key_ids[1]]
+    assert router.select("SharedModel", strategy, policy=RoutingPolicy.SORT_ORDER).api_key.id == key_ids[1]
+    assert router.select("SharedModel", strategy, policy=RoutingPolicy.SORT_ORDER).api_key.id == key_ids[0]
+
+def test_unknown_model_raises(routed, router):
+    """Test that unknown names are distinguished from models without routes."""
+    with pytest.raises(ModelNotFoundError):
+        router.resolve("MissingModel")
+
+def test_invalidate_picks_up_changes(routed, router, db):
+    """Test that the snapshot is rebuilt after invalidate()."""
+    _, _, implementation_ids = routed
+    router.resolve("RoutedModel")
+    implementation = db.query(ModelImplementation).filter(ModelImplementation.id == implementation_ids[0]).first()
+    implementation.is_available = False
+    db.commit()
+    assert len(router.routes("RoutedModel")) == 2
+
+    router.invalidate()
+    assert [route.implementation_id for route in router.routes("RoutedModel")] == [implementation_ids[2]]
+
+def test_routes_endpoint(routed, client, monkeypatch):
+    """Test resolving a model through the API, including invalidation on implementation updates."""
+    model, _, implementation_ids = routed
+    monkeypatch.setattr(model_router, "session_factory", TestingSessionLocal)
+    monkeypatch.setattr(model_router, "exploration_rate", 0)
+    monkeypatch.setattr(model_router.key_pool, "session_factory", TestingSessionLocal)
+    model_router.invalidate()
+    model_router.key_pool.invalidate()
+
+    response = client.get("/models/routes/RoutedModel")
+    assert response.status_code == 200
+    data = response.json()
+    assert [route["provider_model_id"] for route in data] == ["primary-model", "backup-model"]
+    assert data[0]["key_preview"] == "sk-p****5678"
+    assert "api_key" not in data[0]
+    assert data[0]["api_key_id"] == str(routed[1][0])
+
+    response = client.put(
+        f"/models/{model.id}/implementations/{implementation_ids[0]}",
+        json={"is_available": False}
+    )
+    assert response.status_code == 200
+    assert [route["provider_model_id"] for route in client.get("/models/routes/RoutedModel").json()] == ["backup-model"]
+
+    assert client.get("/models/routes/MissingModel").status_code == 404
+
+def test_unit_price_normalises_units():
+    """Test that prices are compared per 1K tokens."""
+    assert unit_price({"input": 0.001, "output": 0.002, "unit": "1K tokens"}) == pytest.approx(0.003)
+    assert unit_price({"input": 1, "output": 2, "unit": "1M tokens"}) == pytest.approx(0.003)
+    assert unit_price({"input_price": 0.001, "output_price": 0.002, "tiers": [{"volume_threshold": 10_000, "input_price": 0}]}) == pytest.approx(0.003)
+    assert unit_price({"currency": "USD"}) is None
+    assert unit_price({"billing_mode": "request", "request_price": 0.01}) is None
+
+def test_scored_policy_prefers_faster_route(routed, router):
+    """Test that latency reports move traffic away from the slower implementation."""
+    _, _, implementation_ids = routed
+    for _ in range(5):
+        router.report(implementation_ids[0], 2.0, success=True)
+        router.report(implementation_ids[2], 0.5, success=True)
+    assert router.select("RoutedModel").route.implementation_id == implementation_ids[2]
+    # The static order is still available
+    assert router.select("RoutedModel", policy=RoutingPolicy.SORT_ORDER).route.implementation_id == implementation_ids[0]
+
+def test_scored_policy_penalises_errors(routed, router):
+    """Test that a failing implementation loses to a slightly slower healthy one."""
+    _, _, implementation_ids = routed
+    router.report(implementation_ids[0], 1.0, success=True)
+    router.report(implementation_ids[2], 1.2, success=True)
+    assert router.select("RoutedModel").route.implementation_id == implementation_ids[0]
+    for _ in range(3):
+        router.report(implementation_ids[0], None, success=False)
+    assert router.stats(implementation_ids[0]).error_rate == pytest.approx(1 - 0.8 ** 3)
+    assert router.select("RoutedModel").route.implementation_id == implementation_ids[2]
+
+def test_scored_policy_prefers_cheap_and_free_routes(routed, router, db, free_quota):
+    """Test that price and remaining free quota count toward the score."""
+    _, _, implementation_ids = routed
+    primary, _, backup = db.query(ModelImplementation).filter(ModelImplementation.id.in_(implementation_ids)).order_by(ModelImplementation.sort_order).all()
+    primary.pricing_info = {"input": 0.01, "output": 0.03, "unit": "1K tokens"}
+    backup.pricing_info = {"currency": "USD", "billing_mode": "token", "input_price": 1, "output_price": 2, "unit": "1M tokens"}
+    db.commit()
+    router.invalidate()
+    assert router.select("RoutedModel").route.implementation_id == implementation_ids[2]
+
+    free_quota[implementation_ids[0]] = 1000
+    assert router.select("RoutedModel").route.implementation_id == implementation_ids[0]
+
+def test_exploration_tries_other_routes(routed):
+    """Test that exploration occasionally puts a lower ranked route first."""
+    _, _, implementation_ids = routed
+    pool = ApiKeyPool(session_factory=TestingSessionLocal, is_exhausted=lambda *args: False)
+    router = ModelRouter(
+        session_factory=TestingSessionLocal, key_pool=pool, free_quota_remaining=lambda *args: 0, exploration_rate=0.5,
+        breakers=CircuitBreakerRegistry(),
+    )
+    firsts = {router.select("RoutedModel").route.implementation_id for _ in range(50)}
+    assert firsts == {implementation_ids[0], implementation_ids[2]}
+
+def test_outcomes_endpoint_updates_stats(routed, client):
+    """Test that reported outcomes reach the routing statistics."""
+    _, _, implementation_ids = routed
+    response = client.post(
+        "/models/routes/outcomes",
+        json={"implementation_id": str(implementation_ids[0]), "success": True, "latency_ms": 250}
+    )
+    assert response.status_code == 204
+    assert model_router.stats(implementation_ids[0]).latency == pytest.approx(0.25)
@@ -190,4 +190,121 @@ def test_delete_nonexistent_model(client):
     """Test that deleting a non-existent model returns a 404."""
     non_existent_id = str(uuid.uuid4())
     response = client.delete(f"/models/{non_existent_id}")
-    assert response.status_code == status.HTTP_404_NOT_FOUND
\ No newline at end of file
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+def _create_model_with_implementations(client, name, count):
+    """Create a provider and a model with the given number of implementations."""
+    provider_id = client.post(
+        "/providers/",
+        json={
+            "name": f"{name}Provider",
+            "base_url": "https://api.counted-models.com"
+        }
+    ).json()["id"]
+    model_id = client.post(
+        "/models/",
+        json={
+            "name": name,
+            "capabilities": ["text-generation"],
+            "family": "TestFamily"
+        }
+    ).json()["id"]
+    for i in range(count):
+        response = client.post(
+            f"/models/{model_id}/implementations",
+            json={
+                "provider_id": provider_id,
+                "model_id": model_id,
+                "provider_model_id": f"{name.lower()}-v{i}",
+                "pricing_info": {"input": 0.001, "output": 0.002}
+            }
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+    return model_id
+
+def test_get_models_counts_in_single_query(client, query_counter):
+    """Test that listing models computes implementation counts in one query."""
+    for i in range(3):
+        _create_model_with_implementations(client, f"CountedModel{i}", i + 1)
+    
+    query_counter.clear()
+    response = client.get("/models/")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    
+    counts = {m["name"]: m["implementations_count"] for m in data}
+    assert counts["CountedModel0"] == 1
+    assert counts["CountedModel1"] == 2
+    assert counts["CountedModel2"] == 3
+    assert all("implementations" not in m for m in data)
+    
+    selects = [s for s in query_counter if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 1
+
+def test_get_models_include_implementations(client, query_counter):
+    """Test that include=implementations eager loads children with selectinload."""
+    for i in range(3):
+        _create_model_with_implementations(client, f"IncludedModel{i}", 2)
+    
+    query_counter.clear()
+    response = client.get("/models/", params={"include": "implementations"})
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    
+    included = [m for m in data if m["name"].startswith("IncludedModel")]
+    assert len(included) == 3
+    for model in included:
+        assert model["implementations_count"] == 2
+        assert len(model["implementations"]) == 2
+    
+    # One query for the models and one for all of their implementations
+    selects = [s for s in query_counter if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 2
+
+def test_get_models_invalid_include(client):
+    """Test that an unknown include value is rejected."""
+    response = client.get("/models/", params={"include": "providers"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+def test_get_models_cursor_pagination(client):
+    """Test walking all models page by page with the next cursor header."""
+    names = [f"PagedModel{i:02d}" for i in range(5)]
+    for name in reversed(names):
+        client.post("/models/", json={"name": name, "capabilities": ["text-generation"], "family": "TestFamily"})
+    
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/models/", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        seen.extend(m["name"] for m in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        params = {"limit": 2, "cursor": next_cursor}
+    
+    assert seen == sorted(seen)
+    assert [n for n in seen if n.startswith("PagedModel")] == names
+
+def test_get_model_implementations_cursor_pagination(client):
+    """Test walking a model's implementations page by page and filtering them by provider."""
+    model_id = _create_model_with_implementations(client, "PagedImplModel", 5)
+    
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get(f"/models/{model_id}/implementations", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        seen.extend(i["provider_model_id"] for i in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        params = {"limit": 2, "cursor": next_cursor}
+    assert seen == [f"pagedimplmodel-v{i}" for i in range(5)]
+    
+    response = client.get(f"/models/{model_id}/implementations", params={"provider_id": str(uuid.uuid4())})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+    
+    response = client.get(f"/models/{model_id}/implementations", params={"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+from datetime import datetime, timedelta, timezone
+from fastapi import status
+from pydantic import ValidationError
+
+from app.models.provider import ApiKeyUsage, ModelImplementation
+from app.routers import usage
+from app.services.pricing import PricingEngine, compile_pricing, cost_batch
+from app.tests.conftest import TestingSessionLocal
+
+DAY = datetime(2026, 10, 15, tzinfo=timezone.utc)
+
+# Prompts of 200K tokens and more cost more, cached prompt tokens are charged a quarter of the price
+TIERED_PRICING = {
+    "currency": "USD",
+    "billing_mode": "token",
+    "input_price": 1.25,
+    "output_price": 10,
+    "cached_input_price": 0.3125,
+    "unit": "1M tokens",
+    "tiers": [{"tier_name": "long context", "volume_threshold": 200_000, "input_price": 2.5, "output_price": 15, "cached_input_price": 0.625}],
+}
+
+def test_compile_pricing_applies_tiers_and_cached_tokens():
+    """Test that the tier is picked by prompt size and cached tokens get their own rate."""
+    pricing = compile_pricing(TIERED_PRICING)
+    assert pricing.currency == "USD"
+    assert pricing.cost(1_000_000 // 10, 10_000) == pytest.approx(0.125 + 0.1)
+    assert pricing.cost(150_000, 0, cached_tokens=100_000) == pytest.approx(0.0625 + 0.03125)
+    assert pricing.cost(200_000, 0) == pytest.approx(0.5)
+    assert pricing.cost(400_000, 0) == pytest.approx(1.0)
+    # Cached tokens never exceed the prompt
+    assert pricing.cost(1_000, 0, cached_tokens=5_000) == pytest.approx(1_000 * 0.3125e-6)
+
+def test_compile_pricing_web_client_shape():
+    """Test pricing_info as entered in the web client: unordered tiers overriding some prices, and per-call prices."""
+    pricing = compile_pricing({
+        "currency": "USD",
+        "billing_mode": "hybrid",
+        "input_price": 0.001,
+        "output_price": 0.002,
+        "request_price": 0.01,
+        "tiers": [
+            {"tier_name": "bulk", "volume_threshold": 100_000, "input_price": 0.0005},
+            {"tier_name": "medium", "volume_threshold": 10_000, "input_price": 0.0008},
+        ],
+        "notes": "kept as is",
+    })
+    assert pricing.cost(1_000, 1_000) == pytest.approx(0.001 + 0.002 + 0.01)
+    assert pricing.cost(10_000, 1_000) == pytest.approx(0.008 + 0.002 + 0.01)
+    assert pricing.cost(100_000, 1_000) == pytest.approx(0.05 + 0.002 + 0.01)
+    assert compile_pricing({"billing_mode": "request", "request_price": 0.02}).cost(5_000, 100) == pytest.approx(0.02)
+
+def test_compile_pricing_units_and_missing_prices():
+    """Test unit conversion, the input/output aliases, defaults and pricing_info without prices."""
+    assert compile_pricing({"input": 0.001, "output": 0.002}).cost(1_000, 1_000) == pytest.approx(0.003)
+    assert compile_pricing({"input_price": 0.5, "unit": "token"}).cost(2, 10) == pytest.approx(1.0)
+    assert compile_pricing({"currency": "USD", "billing_mode": "token"}) is None
+    assert compile_pricing({"currency": "USD", "tiers": [{"tier_name": "free", "volume_threshold": 0}]}) is None
+    assert compile_pricing(None) is None
+
+def test_compile_pricing_leaves_minute_billing_unpriced():
+    """Test that per-minute prices make the cost unknown instead of understating it."""
+    assert compile_pricing({"billing_mode": "minute", "minute_price": 0.1}) is None
+    assert compile_pricing({"billing_mode": "hybrid", "input_price": 0.001, "minute_price": 0.1}) is None
+    assert compile_pricing({"billing_mode": "hybrid", "input_price": 0.001, "minute_price": 0}).cost(1_000, 0) == pytest.approx(0.001)
+
+@pytest.mark.parametrize("pricing_info", [
+    {"input": -1, "output": 1},
+    {"input_price": 1, "output_price": 1, "unit": "1 page"},
+    {"input_price": 1, "billing_mode": "yearly"},
+    {"input_price": 1, "tiers": [{"tier_name": "bulk", "input_price": 1}]},
+    {"input_price": 1, "tiers": [
+        {"volume_threshold": 1000, "input_price": 1},
+        {"volume_threshold": 1000, "input_price": 2},
+    ]},
+])
+def test_compile_pricing_rejects_invalid_pricing(pricing_info):
+    """Test that negative prices, unknown units and billing modes, and tiers without distinct thresholds are rejected."""
+    with pytest.raises(ValidationError):
+        compile_pricing(pricing_info)
+
+def test_cost_batch_matches_single_calls():
+    """Test that vectorized costing gives the same result as costing calls one by one."""
+    pricings = [compile_pricing(TIERED_PRICING), None, compile_pricing({"input_price": 0.001, "output_price": 0.002})]
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, len(pricings), 1_000)
+    prompt = rng.integers(0, 400_000, 1_000).astype(np.float64)
+    completion = rng.integers(0, 4_000, 1_000).astype(np.float64)
+    cached = rng.integers(0, 100_000, 1_000).astype(np.float64)
+
+    costs = cost_batch(pricings, codes, prompt, completion, cached)
+    for i in range(len(codes)):
+        pricing = pricings[codes[i]]
+        if pricing is None:
+            assert np.isnan(costs[i])
+        else:
+            assert costs[i] == pytest.approx(pricing.cost(prompt[i], completion[i], cached[i]))
+
+def test_invalid_pricing_rejected_by_api(client, usage_refs, db):
+    """Test that implementations cannot be saved with pricing the engine cannot compile."""
+    _, implementation_id = usage_refs
+    implementation = db.query(ModelImplementation).filter(ModelImplementation.id == implementation_id).first()
+    response = client.put(
+        f"/models/{implementation.model_id}/implementations/{implementation_id}",
+        json={"pricing_info": {"input_price": "free"}}
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    response = client.put(
+        f"/models/{implementation.model_id}/implementations/{implementation_id}",
+        json={"pricing_info": TIERED_PRICING}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+def test_usage_costs_endpoint(client, usage_refs, db, monkeypatch):
+    """Test that the cost report sums raw usage per key and implementation in the window."""
+    api_key_id, implementation_id = usage_refs
+    implementation = db.query(ModelImplementation).filter(ModelImplementation.id == implementation_id).first()
+    implementation.pricing_info = TIERED_PRICING
+    for minutes, prompt_tokens, cached_tokens in ((5, 100_000, None), (10, 300_000, 200_000), (60 * 24 * 2, 1_000, None)):
+        db.add(ApiKeyUsage(
+            api_key_id=api_key_id,
+            model_implementation_id=implementation_id,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=1_000,
+            total_tokens=prompt_tokens + 1_000,
+            prompt_tokens_details={"cached_tokens": cached_tokens} if cached_tokens else None,
+            timestamp=DAY + timedelta(minutes=minutes),
+        ))
+    db.commit()
+
+    engine = PricingEngine(session_factory=TestingSessionLocal)
+    monkeypatch.setattr(usage, "pricing_engine", engine)
+    response = client.get("/usage/costs", params={
+        "start": DAY.isoformat(), "end": (DAY + timedelta(days=1)).isoformat()
+    })
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{
+        "api_key_id": str(api_key_id),
+        "model_implementation_id": str(implementation_id),
+        "request_count": 2,
+        "prompt_tokens": 400_000,
+        "cached_tokens": 200_000,
+        "completion_tokens": 2_000,
+        "cost": pytest.approx(0.125 + 0.01 + 0.25 + 0.125 + 0.015),
+        "currency": "USD",
+    }]
@@ -2,6 +2,8 @@ import pytest
 import uuid
 from fastapi import status
 
+from app.services.pagination import encode_cursor
+
 def test_create_provider(client):
     """Test creating a new model provider."""
     # Create a provider without initial API key
@@ -237,4 +239,61 @@ def test_get_providers_with_api_key_count(client):
     provider_without_keys = next(p for p in data if p["name"] == "ProviderWithoutKeys")
     
     assert provider_with_keys["api_keys_count"] == 2
-    assert provider_without_keys["api_keys_count"] == 0
\ No newline at end of file
+    assert provider_without_keys["api_keys_count"] == 0
+
+def test_get_providers_runs_single_query(client, query_counter):
+    """Test that listing providers does not issue one query per provider."""
+    for i in range(5):
+        client.post(
+            "/providers/",
+            json={
+                "name": f"CountedProvider{i}",
+                "base_url": f"https://api.counted{i}.com",
+                "initial_api_key": {
+                    "alias": "InitialKey",
+                    "key": f"sk-counted-{i}-12345678"
+                }
+            }
+        )
+    
+    query_counter.clear()
+    response = client.get("/providers/")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert len(data) >= 5
+    assert all(p["api_keys_count"] == 1 for p in data if p["name"].startswith("CountedProvider"))
+    
+    # A single aggregated SELECT regardless of the number of providers
+    selects = [s for s in query_counter if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 1
+
+def test_get_providers_cursor_pagination(client):
+    """Test walking all providers page by page with the next cursor header."""
+    names = [f"PagedProvider{i:02d}" for i in range(7)]
+    for name in reversed(names):
+        client.post("/providers/", json={"name": name, "base_url": "https://api.paged.com"})
+    
+    seen = []
+    params = {"limit": 3}
+    while True:
+        response = client.get("/providers/", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        seen.extend(p["name"] for p in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        params = {"limit": 3, "cursor": next_cursor}
+    
+    # Every provider is returned exactly once, ordered by name
+    assert seen == sorted(seen)
+    assert [n for n in seen if n.startswith("PagedProvider")] == names
+
+def test_get_providers_invalid_cursor(client):
+    """Test that a malformed cursor is rejected."""
+    response = client.get("/providers/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    # Well-formed JSON with a number where the id should be
+    response = client.get("/providers/", params={"cursor": encode_cursor(["Provider", 123])})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
@@ -0,0 +1,89 @@
+import asyncio
+import time
+import pytest
+
+from app.models.provider import ModelProvider, ModelImplementation
+from app.services.rate_limiter import InMemoryBackend, PostgresBackend, RateLimiter, RateLimitExceeded
+from app.tests.conftest import TestingSessionLocal
+
+@pytest.fixture
+def limited(db, usage_refs):
+    """Limit the usage provider to 60 requests per key and its implementation to 600 tokens per minute."""
+    api_key_id, implementation_id = usage_refs
+    provider = db.query(ModelProvider).filter(ModelProvider.name == "UsageProvider").first()
+    provider.rate_limits = {"per_key": {"requests_per_minute": 60}, "total": {"requests_per_minute": 120}}
+    implementation = db.query(ModelImplementation).filter(ModelImplementation.id == implementation_id).first()
+    implementation.custom_parameters = {"rate_limit": {"tokens_per_minute": 600}}
+    db.commit()
+    return provider.id, api_key_id, implementation_id
+
+@pytest.fixture
+def limiter(clock):
+    limiter = RateLimiter(InMemoryBackend(clock=clock), session_factory=TestingSessionLocal)
+    limiter.refresh()
+    return limiter
+
+def test_bucket_allows_burst_then_paces(clock):
+    """Test that a bucket serves its capacity at once and then one token per refill interval."""
+    backend = InMemoryBackend(clock=clock)
+    assert [backend.reserve("bucket", 3, 1, 1) for _ in range(3)] == [0, 0, 0]
+    assert backend.reserve("bucket", 3, 1, 1) == 1
+    assert backend.reserve("bucket", 3, 1, 1) == 2
+    clock.now += 2
+    assert backend.reserve("bucket", 3, 1, 1) == 1
+
+def test_limits_loaded_from_provider_and_implementation(limited, limiter):
+    """Test that provider and implementation settings become request and token buckets."""
+    provider_id, api_key_id, implementation_id = limited
+    reservations = limiter.reservations(provider_id, api_key_id, implementation_id, tokens=100)
+    assert {key.rsplit(":", 1)[-1] for key, _, _, _ in reservations} == {"requests", "tokens"}
+    assert len(reservations) == 3
+    # Calls without a limited implementation only draw from the provider buckets
+    assert len(limiter.reservations(provider_id, api_key_id, tokens=100)) == 2
+
+def test_token_budget_delays_calls(limited, limiter):
+    """Test that calls beyond the token budget are told to wait."""
+    provider_id, api_key_id, implementation_id = limited
+    assert limiter.reserve(provider_id, api_key_id, implementation_id, tokens=600) == 0
+    # 600 tokens per minute refill at 10 per second
+    assert limiter.reserve(provider_id, api_key_id, implementation_id, tokens=100) == pytest.approx(10)
+
+def test_max_wait_rejects_without_keeping_reservation(limited, limiter):
+    """Test that a rejected call gives its reservation back."""
+    provider_id, api_key_id, implementation_id = limited
+    limiter.reserve(provider_id, api_key_id, implementation_id, tokens=600)
+    with pytest.raises(RateLimitExceeded) as error:
+        limiter.reserve(provider_id, api_key_id, implementation_id, tokens=100, max_wait=1)
+    assert error.value.retry_after == pytest.approx(10)
+    assert limiter.reserve(provider_id, api_key_id, implementation_id, tokens=100) == pytest.approx(10)
+
+def test_record_usage_refunds_overestimate(limited, limiter):
+    """Test that unused estimated tokens are returned to the bucket."""
+    provider_id, api_key_id, implementation_id = limited
+    limiter.reserve(provider_id, api_key_id, implementation_id, tokens=600)
+    limiter.record_usage(provider_id, api_key_id, implementation_id, estimated_tokens=600, actual_tokens=200)
+    assert limiter.reserve(provider_id, api_key_id, implementation_id, tokens=400) == 0
+
+def test_acquire_waits_instead_of_rejecting(limited):
+    """Test that acquire sleeps until the request budget allows the call."""
+    provider_id, api_key_id, _ = limited
+    limiter = RateLimiter(session_factory=TestingSessionLocal)
+    limiter.refresh()
+
+    async def run():
+        waits = [await limiter.acquire(provider_id, api_key_id) for _ in range(61)]
+        return waits
+
+    started = time.monotonic()
+    waits = asyncio.run(run())
+    assert waits[:60] == [0] * 60
+    assert waits[60] == pytest.approx(1, abs=0.05)
+    assert time.monotonic() - started >= 0.95
+
+def test_postgres_backend_shares_buckets(db):
+    """Test that separate backend instances draw from the same bucket."""
+    first = PostgresBackend(session_factory=TestingSessionLocal)
+    second = PostgresBackend(session_factory=TestingSessionLocal)
+    assert first.reserve("shared", 2, 1, 1) == 0
+    assert second.reserve("shared", 2, 1, 1) == 0
+    assert first.reserve("shared", 2, 1, 1) == pytest.approx(1, abs=0.05)
@@ -0,0 +1,140 @@
+import asyncio
+import re
+import pytest
+from datetime import datetime, timedelta, timezone
+from fastapi import status
+
+from app.models.provider import ApiKeyUsageHourly, ApiKeyUsageDaily, RollupGranularity
+from app.models.schemas import ApiKeyUsageCreate
+from app.services import usage_rollup_service
+from app.services.usage_recorder import UsageRecorder
+from app.tests.conftest import TestingSessionLocal
+
+DAY = datetime(2026, 10, 15, tzinfo=timezone.utc)
+
+# Three calls in the first hour, one in the next hour and one on the next day
+TIMESTAMPS = [
+    DAY + timedelta(minutes=5),
+    DAY + timedelta(minutes=10),
+    DAY + timedelta(minutes=59),
+    DAY + timedelta(hours=1, minutes=1),
+    DAY + timedelta(days=1, hours=3),
+]
+
+@pytest.fixture
+def recorded_usage(db, usage_refs):
+    """Write usage through the recorder so the rollups are maintained incrementally."""
+    api_key_id, implementation_id = usage_refs
+    recorder = UsageRecorder(session_factory=TestingSessionLocal, batch_size=2, flush_interval=60)
+    
+    async def run():
+        await recorder.start()
+        for timestamp in TIMESTAMPS:
+            await recorder.record(ApiKeyUsageCreate(
+                api_key_id=api_key_id,
+                model_implementation_id=implementation_id,
+                prompt_tokens=100,
+                completion_tokens=10,
+                timestamp=timestamp
+            ))
+        await recorder.stop()
+    
+    asyncio.run(run())
+    return usage_refs
+
+def test_recorder_maintains_rollups(db, recorded_usage):
+    """Test that ingested batches are added to the hourly and daily rollups."""
+    hourly = {r.bucket: r for r in db.query(ApiKeyUsageHourly).all()}
+    assert hourly[DAY].request_count == 3
+    assert hourly[DAY].prompt_tokens == 300
+    assert hourly[DAY + timedelta(hours=1)].request_count == 1
+    assert hourly[DAY + timedelta(days=1, hours=3)].total_tokens == 110
+    
+    daily = {r.bucket: r for r in db.query(ApiKeyUsageDaily).all()}
+    assert daily[DAY].request_count == 4
+    assert daily[DAY + timedelta(days=1)].request_count == 1
+
+def test_rebuild_matches_incremental_rollups(db, recorded_usage):
+    """Test that rebuilding from raw usage reproduces the incremental rollups."""
+    def snapshot(model):
+        return sorted(
+            (r.bucket, r.request_count, r.prompt_tokens, r.completion_tokens, r.total_tokens)
+            for r in db.query(model).all()
+        )
+    
+    before = (snapshot(ApiKeyUsageHourly), snapshot(ApiKeyUsageDaily))
+    usage_rollup_service.rebuild_rollups(db, DAY, DAY + timedelta(days=2))
+    db.expire_all()
+    assert (snapshot(ApiKeyUsageHourly), snapshot(ApiKeyUsageDaily)) == before
+
+def test_usage_timeseries_endpoint(client, recorded_usage):
+    """Test the hourly time series endpoint."""
+    api_key_id, _ = recorded_usage
+    response = client.get("/usage/timeseries", params={
+        "granularity": "HOUR",
+        "start": DAY.isoformat(),
+        "end": (DAY + timedelta(days=2)).isoformat(),
+        "api_key_id": str(api_key_id)
+    })
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [b["request_count"] for b in data] == [3, 1, 1]
+    assert data[0]["prompt_tokens"] == 300
+
+def test_usage_timeseries_keeps_partial_buckets(db, recorded_usage):
+    """Test that buckets overlapping either end of the window are returned whole."""
+    api_key_id, _ = recorded_usage
+    buckets = usage_rollup_service.get_usage_timeseries(
+        db, RollupGranularity.DAY, DAY + timedelta(hours=12), DAY + timedelta(days=1, hours=4), api_key_id=api_key_id
+    )
+    assert [(b["bucket"], b["request_count"]) for b in buckets] == [(DAY, 4), (DAY + timedelta(days=1), 1)]
+
+    # A window inside one bucket still returns that bucket
+    buckets = usage_rollup_service.get_usage_timeseries(
+        db, RollupGranularity.HOUR, DAY + timedelta(minutes=6), DAY + timedelta(minutes=20), api_key_id=api_key_id
+    )
+    assert [(b["bucket"], b["request_count"]) for b in buckets] == [(DAY, 3)]
+
+    # An aligned end is exclusive
+    buckets = usage_rollup_service.get_usage_timeseries(
+        db, RollupGranularity.DAY, DAY, DAY + timedelta(days=1), api_key_id=api_key_id
+    )
+    assert [b["request_count"] for b in buckets] == [4]
+
+def test_usage_totals_counts_partial_hours_from_raw_usage(db, recorded_usage):
+    """Test that calls in the partial hours at both ends of the window are counted exactly."""
+    # Raw usage for 00:07-01:00 and 03:00-03:30 of the next day, hourly rollups in between
+    totals = usage_rollup_service.get_usage_totals(db, DAY + timedelta(minutes=7), DAY + timedelta(days=1, hours=3, minutes=30))
+    assert [t["request_count"] for t in totals] == [4]
+    assert totals[0]["prompt_tokens"] == 400
+
+    # A window inside one hour reads only raw usage
+    totals = usage_rollup_service.get_usage_totals(db, DAY + timedelta(minutes=7), DAY + timedelta(minutes=30))
+    assert [t["request_count"] for t in totals] == [1]
+
+def test_usage_totals_endpoint_reads_only_rollups(client, recorded_usage, query_counter):
+    """Test that window totals combine daily and hourly rollups without touching raw usage."""
+    api_key_id, implementation_id = recorded_usage
+    query_counter.clear()
+    response = client.get("/usage/totals", params={
+        # Partial day before, one whole day, partial day after
+        "start": (DAY - timedelta(hours=1)).isoformat(),
+        "end": (DAY + timedelta(days=1, hours=4)).isoformat(),
+    })
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["api_key_id"] == str(api_key_id)
+    assert data[0]["model_implementation_id"] == str(implementation_id)
+    assert data[0]["request_count"] == 5
+    assert data[0]["total_tokens"] == 550
+    
+    assert not any(re.search(r"\bapi_key_usage\b(?!_)", s) for s in query_counter)
+
+def test_usage_invalid_window(client):
+    """Test that an empty time window is rejected."""
+    response = client.get("/usage/totals", params={
+        "start": DAY.isoformat(),
+        "end": DAY.isoformat()
+    })
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,92 @@
+import pytest
+from datetime import datetime, timezone
+from sqlalchemy import text
+
+from app.models.provider import ApiKeyUsage
+from app.services import usage_partition_service
+
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+
+def add_usage(db, refs, timestamp):
+    api_key_id, implementation_id = refs
+    db.add(ApiKeyUsage(
+        api_key_id=api_key_id,
+        model_implementation_id=implementation_id,
+        prompt_tokens=10,
+        completion_tokens=5,
+        total_tokens=15,
+        timestamp=timestamp
+    ))
+    db.commit()
+
+def test_ensure_partitions_creates_upcoming_months(db):
+    """Test that the current and upcoming monthly partitions are created once."""
+    created = usage_partition_service.ensure_partitions(db, now=NOW, months_ahead=2)
+    assert created == ["api_key_usage_p202610", "api_key_usage_p202611", "api_key_usage_p202612"]
+    
+    # Running maintenance again is a no-op
+    assert usage_partition_service.ensure_partitions(db, now=NOW, months_ahead=2) == []
+    assert usage_partition_service.list_partitions(db) == created
+
+def test_usage_rows_land_in_monthly_partition(db, usage_refs):
+    """Test that rows are routed to the partition of their month."""
+    usage_partition_service.ensure_partitions(db, now=NOW, months_ahead=1)
+    add_usage(db, usage_refs, datetime(2026, 11, 3, tzinfo=timezone.utc))
+    add_usage(db, usage_refs, datetime(2020, 1, 1, tzinfo=timezone.utc))
+    
+    partitions = db.execute(text(
+        "SELECT tableoid::regclass::text FROM api_key_usage ORDER BY timestamp"
+    )).scalars().all()
+    assert partitions == ["api_key_usage_default", "api_key_usage_p202611"]
+
+def test_ensure_partitions_moves_rows_out_of_default(db, usage_refs):
+    """Test that rows written before their month's partition existed are moved into it."""
+    add_usage(db, usage_refs, datetime(2026, 10, 3, tzinfo=timezone.utc))
+    add_usage(db, usage_refs, datetime(2026, 11, 20, tzinfo=timezone.utc))
+    add_usage(db, usage_refs, datetime(2020, 1, 1, tzinfo=timezone.utc))
+    
+    created = usage_partition_service.ensure_partitions(db, now=NOW, months_ahead=2)
+    assert created == ["api_key_usage_p202610", "api_key_usage_p202611", "api_key_usage_p202612"]
+    partitions = db.execute(text(
+        "SELECT tableoid::regclass::text FROM api_key_usage ORDER BY timestamp"
+    )).scalars().all()
+    assert partitions == ["api_key_usage_default", "api_key_usage_p202610", "api_key_usage_p202611"]
+    
+    # The default partition is attached again and still takes rows outside every range
+    add_usage(db, usage_refs, datetime(2030, 1, 1, tzinfo=timezone.utc))
+    assert db.query(ApiKeyUsage).count() == 4
+
+def test_time_window_query_prunes_partitions(db, usage_refs):
+    """Test that a bounded time window only scans the matching partition."""
+    usage_partition_service.ensure_partitions(db, now=NOW, months_ahead=2)
+    add_usage(db, usage_refs, datetime(2026, 10, 20, tzinfo=timezone.utc))
+    add_usage(db, usage_refs, datetime(2026, 12, 1, tzinfo=timezone.utc))
+    
+    plan = "\n".join(db.execute(text(
+        "EXPLAIN SELECT * FROM api_key_usage "
+        "WHERE timestamp >= '2026-10-01T00:00:00+00:00' AND timestamp < '2026-11-01T00:00:00+00:00'"
+    )).scalars().all())
+    assert "api_key_usage_p202610" in plan
+    assert "api_key_usage_p202611" not in plan
+    assert "api_key_usage_p202612" not in plan
+    
+    usage = usage_partition_service.get_api_key_usage(
+        db,
+        usage_refs[0],
+        datetime(2026, 10, 1, tzinfo=timezone.utc),
+        datetime(2026, 11, 1, tzinfo=timezone.utc)
+    )
+    assert len(usage) == 1
+
+def test_drop_expired_partitions(db, usage_refs):
+    """Test that retention drops whole partitions older than the window and expired rows of the default partition."""
+    usage_partition_service.ensure_partitions(db, now=datetime(2025, 8, 1, tzinfo=timezone.utc), months_ahead=0)
+    usage_partition_service.ensure_partitions(db, now=NOW, months_ahead=0)
+    add_usage(db, usage_refs, datetime(2025, 8, 15, tzinfo=timezone.utc))
+    # Lands in the default partition, as no monthly partition covers it
+    add_usage(db, usage_refs, datetime(2020, 1, 1, tzinfo=timezone.utc))
+    
+    dropped = usage_partition_service.drop_expired_partitions(db, now=NOW, retention_months=12)
+    assert dropped == ["api_key_usage_p202508"]
+    assert usage_partition_service.list_partitions(db) == ["api_key_usage_p202610"]
+    assert db.query(ApiKeyUsage).count() == 0
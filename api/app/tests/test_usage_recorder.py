@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from datetime import datetime, timezone
+
+from app.models.provider import ApiKeyUsage
+from app.models.schemas import ApiKeyUsageCreate
+from app.services.usage_recorder import UsageRecorder, UsageWriteError
+from app.tests.conftest import TestingSessionLocal
+
+def make_usage(refs, prompt_tokens=10):
+    api_key_id, implementation_id = refs
+    return ApiKeyUsageCreate(
+        api_key_id=api_key_id,
+        model_implementation_id=implementation_id,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=5,
+        prompt_tokens_details={"cached_tokens": 2},
+        timestamp=datetime(2026, 10, 17, tzinfo=timezone.utc)
+    )
+
+@pytest.mark.parametrize("method", ["copy", "executemany"])
+def test_recorder_writes_in_batches(db, usage_refs, method):
+    """Test that queued records are written in size-bounded batches and flushed on stop."""
+    recorder = UsageRecorder(session_factory=TestingSessionLocal, batch_size=10, flush_interval=60, method=method)
+    
+    async def run():
+        await recorder.start()
+        for i in range(25):
+            await recorder.record(make_usage(usage_refs, prompt_tokens=i))
+        await recorder.stop()
+    
+    asyncio.run(run())
+    
+    assert recorder.rows_written == 25
+    assert recorder.batches_written == 3
+    rows = db.query(ApiKeyUsage).all()
+    assert len(rows) == 25
+    assert sorted(r.prompt_tokens for r in rows) == list(range(25))
+    assert all(r.total_tokens == r.prompt_tokens + 5 for r in rows)
+    assert all(r.prompt_tokens_details == {"cached_tokens": 2} for r in rows)
+
+def test_recorder_flushes_on_interval(db, usage_refs):
+    """Test that a partial batch is written once the flush interval elapses."""
+    recorder = UsageRecorder(session_factory=TestingSessionLocal, batch_size=1000, flush_interval=0.05)
+    
+    async def run():
+        await recorder.start()
+        await recorder.record(make_usage(usage_refs))
+        await asyncio.sleep(0.5)
+        written = recorder.rows_written
+        await recorder.stop()
+        return written
+    
+    assert asyncio.run(run()) == 1
+    assert db.query(ApiKeyUsage).count() == 1
+
+def test_recorder_explicit_flush(db, usage_refs):
+    """Test that flush() returns only after queued records are committed."""
+    recorder = UsageRecorder(session_factory=TestingSessionLocal, batch_size=1000, flush_interval=60)
+    
+    async def run():
+        await recorder.start()
+        for _ in range(3):
+            await recorder.record(make_usage(usage_refs))
+        await recorder.flush()
+        written = db.query(ApiKeyUsage).count()
+        await recorder.stop()
+        return written
+    
+    assert asyncio.run(run()) == 3
+
+def test_recorder_flush_raises_when_write_fails(usage_refs):
+    """Test that flush() reports records left unwritten instead of returning as if they were committed."""
+    def unavailable():
+        raise RuntimeError("database unavailable")
+
+    recorder = UsageRecorder(session_factory=unavailable, batch_size=1000, flush_interval=60)
+
+    async def run():
+        await recorder.start()
+        await recorder.record(make_usage(usage_refs))
+        try:
+            with pytest.raises(UsageWriteError) as error:
+                await recorder.flush()
+            return error.value.pending
+        finally:
+            await recorder.stop()
+
+    assert asyncio.run(run()) == 1
+    assert recorder.rows_written == 0
+
+def test_recorder_rejects_records_when_stopped(usage_refs):
+    """Test that recording without a running recorder fails loudly."""
+    recorder = UsageRecorder(session_factory=TestingSessionLocal)
+    with pytest.raises(RuntimeError):
+        asyncio.run(recorder.record(make_usage(usage_refs)))
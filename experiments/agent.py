@@ -25,6 +25,18 @@ def test_text_model():
 # 测试结束: 文本模型
 
 
+# 测试开始: 流式输出
+def test_stream_model():
+    user_input = "What is the meaning of life?"
+    model_spec = "zhipu:glm-4-flash"
+    stream = chat(prompt=user_input, model_spec=model_spec, stream=True)
+    for delta in stream:
+        print(delta, end="", flush=True)
+    print()
+    print("Usage:", stream.usage)  # 可写入 ApiKeyUsage
+# 测试结束: 流式输出
+
+
 # 测试开始: 视觉理解 模型 
 def test_vlm_model():
     user_input = "extract the main content of the image"
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+对比每次调用新建客户端与复用注册表客户端的单次调用开销
+
+用法: python benchmark_clients.py [调用次数]
+"""
+
+# 功能开始: 导入必要模块
+import os
+import sys
+import time
+import statistics
+
+import openai
+
+from stub_server import start_stub_server
+# 功能结束: 导入必要模块
+
+
+# 功能开始: 计时
+def measure(label, call, calls):
+    durations = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call()
+        durations.append((time.perf_counter() - started) * 1000)
+    durations.sort()
+    print(f"{label:<10} mean {statistics.mean(durations):7.3f} ms  "
+          f"p50 {durations[len(durations) // 2]:7.3f} ms  "
+          f"p95 {durations[int(len(durations) * 0.95)]:7.3f} ms")
+    return statistics.mean(durations)
+# 功能结束: 计时
+
+
+# 功能开始: 主程序入口
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server, base_url = start_stub_server()
+
+    # 让 model_api 的 vllm 配置指向桩服务
+    os.environ["VLLM_ENDPOINT"] = base_url
+    os.environ["VLLM_API_KEY"] = "sk-stub"
+    from model_api import chat, close_clients
+
+    def fresh_client_call():
+        # 旧实现: 每次调用都新建客户端和连接
+        client = openai.OpenAI(base_url=base_url, api_key="sk-stub")
+        client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}], temperature=0.6)
+        client.close()
+
+    def pooled_client_call():
+        chat("hi", model_spec="vllm:stub")
+
+    # 预热，排除导入与首次连接的影响
+    fresh_client_call()
+    pooled_client_call()
+
+    print(f"{calls} chat calls against {base_url}")
+    before = measure("fresh", fresh_client_call, calls)
+    after = measure("pooled", pooled_client_call, calls)
+    print(f"per-call overhead saved: {before - after:.3f} ms ({(1 - after / before) * 100:.1f}%)")
+    print("Note: the stub is plain HTTP; real endpoints also save the TLS handshake per call.")
+
+    close_clients()
+    server.shutdown()
+# 功能结束: 主程序入口
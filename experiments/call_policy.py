@@ -0,0 +1,261 @@
+# 功能开始: 导入必要模块
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import openai
+# 功能结束: 导入必要模块
+
+
+# 功能开始: 调用异常
+class ModelAPIError(Exception):
+    """上游模型调用失败；retryable 表示可以重试，retry_after 为服务商要求的等待秒数"""
+
+    retryable = False
+
+    def __init__(self, message, model_spec=None, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.model_spec = model_spec
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ModelTimeoutError(ModelAPIError):
+    """单次请求超时或超过总时限"""
+    retryable = True
+
+
+class ModelRateLimitError(ModelAPIError):
+    """服务商限流 (HTTP 429)"""
+    retryable = True
+
+
+class ModelUnavailableError(ModelAPIError):
+    """连接失败或服务商内部错误 (HTTP 5xx)"""
+    retryable = True
+
+
+class ModelRequestError(ModelAPIError):
+    """请求本身有误，例如参数错误、鉴权失败 (其余 HTTP 4xx)，重试无效"""
+
+
+def _retry_after(response):
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def translate_error(error, model_spec=None):
+    """将 SDK 异常转换为 ModelAPIError 子类"""
+    if isinstance(error, ModelAPIError):
+        return error
+    message = f"{model_spec} 调用失败: {error}"
+    if isinstance(error, (openai.APITimeoutError, TimeoutError, asyncio.TimeoutError)):
+        return ModelTimeoutError(f"{model_spec} 请求超时", model_spec)
+    if isinstance(error, openai.APIConnectionError):
+        return ModelUnavailableError(message, model_spec)
+    if isinstance(error, openai.APIStatusError):
+        status_code, retry_after = error.status_code, _retry_after(error.response)
+    else:
+        # google-genai 的 APIError 使用 code 属性表示 HTTP 状态码
+        status_code, retry_after = getattr(error, "code", None), None
+        if not isinstance(status_code, int):
+            return ModelAPIError(message, model_spec)
+    if status_code == 429:
+        return ModelRateLimitError(message, model_spec, status_code, retry_after)
+    if status_code >= 500 or status_code in (408, 409):
+        return ModelUnavailableError(message, model_spec, status_code, retry_after)
+    return ModelRequestError(message, model_spec, status_code)
+# 功能结束: 调用异常
+
+
+# 功能开始: 调用策略
+class CallPolicy:
+    """
+    上游调用策略
+    参数:
+        attempt_timeout: 单次请求超时 (秒)
+        deadline: 包含重试与退避在内的总时限 (秒)
+        max_attempts: 最多尝试次数
+        backoff_base / backoff_max: 指数退避的基数与上限，实际等待在 [0, base * 2^n] 内随机 (full jitter)
+        hedge: 是否对冲请求；请求超过对冲延迟仍未完成时，向备用目标再发一份，取先完成的结果；没有备用目标时不对冲
+        hedge_delay: 延迟样本不足时使用的对冲延迟
+        hedge_quantile: 对冲延迟取该目标最近延迟的分位数
+    """
+
+    def __init__(self, attempt_timeout=None, deadline=None, max_attempts=None, backoff_base=None, backoff_max=None,
+                 hedge=None, hedge_delay=None, hedge_quantile=0.95):
+        # 显式传入的 0 也要生效，只有 None 才取环境变量
+        self.attempt_timeout = (
+            float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "60")) if attempt_timeout is None else attempt_timeout
+        )
+        self.deadline = float(os.getenv("LLM_DEADLINE_SECONDS", "180")) if deadline is None else deadline
+        self.max_attempts = int(os.getenv("LLM_MAX_ATTEMPTS", "3")) if max_attempts is None else max_attempts
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5")) if backoff_base is None else backoff_base
+        self.backoff_max = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20")) if backoff_max is None else backoff_max
+        self.hedge = os.getenv("LLM_HEDGE", "0") == "1" if hedge is None else hedge
+        self.hedge_delay = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "2")) if hedge_delay is None else hedge_delay
+        self.hedge_quantile = hedge_quantile
+
+    def backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, error.retry_after or 0)
+
+
+# 对冲请求至少积累这么多延迟样本后才使用分位数
+LATENCY_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+
+class LatencyTracker:
+    """按 model_spec 记录最近成功请求的耗时"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, model_spec, seconds):
+        with self._lock:
+            self._samples.setdefault(model_spec, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, model_spec, q):
+        """最近耗时的 q 分位数，样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(model_spec, ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+latency_tracker = LatencyTracker()
+DEFAULT_POLICY = CallPolicy()
+# 对冲请求在线程池中执行，同步调用无法取消，落后的请求会在后台自然结束
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_MAX_WORKERS", "32")), thread_name_prefix="hedge")
+
+
+def hedge_delay(policy, model_spec):
+    return latency_tracker.quantile(model_spec, policy.hedge_quantile) or policy.hedge_delay
+# 功能结束: 调用策略
+
+
+# 功能开始: 按策略执行调用
+# targets 为 [(model_spec, call), ...]：第一个是主目标，第二个 (若有) 是对冲目标，只有一个目标时不对冲，
+# call(timeout) 执行一次请求并返回结果；异步版本中 call(timeout) 返回协程
+
+def _timed(target, timeout):
+    model_spec, call = target
+    started = time.monotonic()
+    try:
+        result = call(timeout)
+    except Exception as e:
+        raise translate_error(e, model_spec) from e
+    latency_tracker.record(model_spec, time.monotonic() - started)
+    return result
+
+
+def _attempt(targets, policy, timeout):
+    if not policy.hedge or len(targets) < 2:
+        return _timed(targets[0], timeout)
+    started = time.monotonic()
+    futures = [_hedge_pool.submit(_timed, targets[0], timeout)]
+    done, _ = wait(futures, timeout=min(hedge_delay(policy, targets[0][0]), timeout))
+    if not done:
+        remaining = timeout - (time.monotonic() - started)
+        futures.append(_hedge_pool.submit(_timed, targets[1], remaining))
+    pending, error = set(futures), None
+    while pending:
+        done, pending = wait(pending, timeout=timeout - (time.monotonic() - started), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error or ModelTimeoutError(f"{targets[0][0]} 请求超过 {timeout:.1f}s", targets[0][0])
+
+
+def call_with_policy(targets, policy=None):
+    """按策略执行同步调用: 可重试错误指数退避重试，超过总时限抛出 ModelTimeoutError"""
+    policy = policy or DEFAULT_POLICY
+    deadline = time.monotonic() + policy.deadline
+    last_error = None
+    for attempt in range(policy.max_attempts):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            return _attempt(targets, policy, min(policy.attempt_timeout, remaining))
+        except ModelAPIError as e:
+            last_error = e
+            if not e.retryable or attempt == policy.max_attempts - 1:
+                raise
+            delay = policy.backoff(attempt, e)
+            if time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+    raise ModelTimeoutError(f"{targets[0][0]} 调用超过总时限 {policy.deadline:g}s", targets[0][0]) from last_error
+
+
+async def _atimed(target, timeout):
+    model_spec, call = target
+    started = time.monotonic()
+    try:
+        result = await asyncio.wait_for(call(timeout), timeout)
+    except Exception as e:
+        raise translate_error(e, model_spec) from e
+    latency_tracker.record(model_spec, time.monotonic() - started)
+    return result
+
+
+async def _aattempt(targets, policy, timeout):
+    if not policy.hedge or len(targets) < 2:
+        return await _atimed(targets[0], timeout)
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(_atimed(targets[0], timeout))]
+    done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay(policy, targets[0][0]), timeout))
+    if not done:
+        remaining = timeout - (time.monotonic() - started)
+        tasks.append(asyncio.ensure_future(_atimed(targets[1], remaining)))
+    pending, error = set(tasks), None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # 取消落后的请求，释放连接与并发名额
+        for task in pending:
+            task.cancel()
+
+
+async def acall_with_policy(targets, policy=None):
+    """call_with_policy 的异步版本，对冲时落后的请求会被取消"""
+    policy = policy or DEFAULT_POLICY
+    deadline = time.monotonic() + policy.deadline
+    last_error = None
+    for attempt in range(policy.max_attempts):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            return await _aattempt(targets, policy, min(policy.attempt_timeout, remaining))
+        except ModelAPIError as e:
+            last_error = e
+            if not e.retryable or attempt == policy.max_attempts - 1:
+                raise
+            delay = policy.backoff(attempt, e)
+            if time.monotonic() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+    raise ModelTimeoutError(f"{targets[0][0]} 调用超过总时限 {policy.deadline:g}s", targets[0][0]) from last_error
+# 功能结束: 按策略执行调用
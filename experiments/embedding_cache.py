@@ -0,0 +1,191 @@
+# 功能开始: 导入必要模块
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict
+# 功能结束: 导入必要模块
+
+
+# 功能开始: 缓存配置
+# SQLite 持久化文件路径，设为空字符串则只使用内存缓存
+EMBEDDING_CACHE_PATH = os.getenv("LLM_EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3")
+# 内存 LRU 缓存的向量条数上限
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+# 持久化缓存的向量条数上限，超出时淘汰最久未使用的条目
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("LLM_EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+# 功能结束: 缓存配置
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# 功能开始: 向量缓存
+class EmbeddingCache:
+    """
+    按 (model_spec, dimensions, sha256(text)) 寻址的向量缓存
+
+    两级存储: 内存 LRU 缓存最近使用的向量，SQLite 持久化全部向量 (float32 存储)，
+    进程重启后相同文本无需再次请求服务商。两级均有条数上限，超出时淘汰最久未使用的条目。
+    SQLite 中的条数在打开时统计一次，之后随写入与淘汰在内存中累计，写入时无需扫描全表；
+    多个进程共用同一文件时各自的计数只是近似值，重新打开时校正。
+    线程安全。
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, memory_items=EMBEDDING_CACHE_MEMORY_ITEMS,
+                 max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.memory_items = memory_items
+        self.max_entries = max_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        self._disk_items = 0
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model_spec TEXT NOT NULL,
+                    dimensions INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model_spec, dimensions, text_hash)
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+            self._disk_items = self._db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model_spec, dimensions, texts):
+        """按顺序返回每个文本的缓存向量，未命中的位置为 None"""
+        keys = [(model_spec, dimensions or 0, text_hash(text)) for text in texts]
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing and self._db is not None:
+                found = self._load(list(missing))
+                for key, vector in found.items():
+                    self._remember(key, vector)
+                    for i in missing.pop(key):
+                        results[i] = vector
+                        self.hits += 1
+                        self.disk_hits += 1
+            self.misses += sum(len(positions) for positions in missing.values())
+        return results
+
+    def put_many(self, model_spec, dimensions, texts, vectors):
+        """写入向量到两级缓存"""
+        now = time.time()
+        rows = {}
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = (model_spec, dimensions or 0, text_hash(text))
+                vector = list(vector)
+                self._remember(key, vector)
+                rows[key] = (*key, array("f", vector).tobytes(), now)
+            if self._db is not None and rows:
+                # 按主键查出已有的条目，只有新条目增加计数
+                existing = sum(1 for _ in self._select("1", list(rows)))
+                self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", list(rows.values()))
+                self._disk_items += len(rows) - existing
+                self._evict()
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": self._disk_items,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+                self._disk_items = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _select(self, columns, keys):
+        """按主键查询 keys 对应的行"""
+        # SQLite 单条语句的参数个数有限，分段查询
+        for start in range(0, len(keys), 300):
+            chunk = keys[start:start + 300]
+            placeholders = " OR ".join(["(model_spec = ? AND dimensions = ? AND text_hash = ?)"] * len(chunk))
+            params = [value for key in chunk for value in key]
+            yield from self._db.execute(f"SELECT {columns} FROM embeddings WHERE {placeholders}", params)
+
+    def _load(self, keys):
+        found = {}
+        now = time.time()
+        for model_spec, dimensions, hashed, blob in self._select("model_spec, dimensions, text_hash, vector", keys):
+            found[(model_spec, dimensions, hashed)] = array("f", blob).tolist()
+        if found:
+            self._db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model_spec = ? AND dimensions = ? AND text_hash = ?",
+                [(now, *key) for key in found],
+            )
+            self._db.commit()
+        return found
+
+    def _evict(self):
+        excess = self._disk_items - self.max_entries
+        if excess > 0:
+            deleted = self._db.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            ).rowcount
+            self._disk_items -= deleted
+# 功能结束: 向量缓存
+
+
+# 功能开始: 默认缓存
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """进程共享的默认缓存，首次使用时创建"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = EmbeddingCache()
+    return _default_cache
+# 功能结束: 默认缓存
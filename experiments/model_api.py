@@ -1,10 +1,14 @@
 # 功能开始: 导入必要模块
 import os
+import asyncio
+import atexit
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 import openai
 
-# 如果使用 gemini 则需要导入 google.genai
-from google import genai
-
 import base64
 
 # 从 .env 文件中加载环境变量
@@ -12,6 +16,15 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+from embedding_cache import get_embedding_cache
+from call_policy import (
+    DEFAULT_POLICY, ModelRequestError, ModelTimeoutError, ModelUnavailableError, acall_with_policy, call_with_policy,
+    translate_error,
+)
+from response_cache import (
+    CACHE_MODES, RESPONSE_CACHE_EMBEDDING_MODEL, RESPONSE_CACHE_MODE, cache_key, file_hash, get_response_cache,
+)
+
 # 功能结束: 导入必要模块
 
 
@@ -85,9 +98,282 @@ class ModelProvider:
             }
 
 
+    @staticmethod
+    def get_routed_config(model_name):
+        """
+        通过管理 API 的路由快照解析逻辑模型名 (Model.name)，返回首选实现的 (config, provider_model_id)
+        实现的顺序、可用状态、服务商地址与密钥均来自数据库，而不是环境变量
+        管理 API 只返回选中密钥的 api_key_id，密钥明文由 get_api_key 直接从数据库读取
+        """
+        return ModelProvider.get_route_config(ModelProvider.get_routes(model_name)[0])
+
+    @staticmethod
+    def get_routes(model_name):
+        """
+        管理 API 解析出的全部可用路由，最优的在前；结果在本进程内缓存 MODEL_ROUTER_CACHE_SECONDS
+        首条路由占用半开熔断器的探测名额 (probe) 时不缓存，探测名额只对应这一次调用
+        """
+        now = time.monotonic()
+        cached = _route_cache.get(model_name)
+        if cached is None or cached[0] <= now:
+            response = httpx.get(f"{MODEL_ROUTER_URL}/models/routes/{model_name}", timeout=10)
+            if response.status_code == 503:
+                # 所有实现的密钥都在冷却或熔断中
+                raise ModelUnavailableError(
+                    f"router:{model_name} 暂无可用实现", f"router:{model_name}", 503, _retry_after_header(response)
+                )
+            if response.status_code == 404:
+                raise ModelRequestError(f"模型 {model_name} 不存在", f"router:{model_name}", 404)
+            response.raise_for_status()
+            routes = response.json()
+            if routes[0].get("probe"):
+                return routes
+            cached = _route_cache[model_name] = (now + MODEL_ROUTER_CACHE_SECONDS, routes)
+        return cached[1]
+
+    @staticmethod
+    def get_route_config(route):
+        """单条路由的 (config, provider_model_id)"""
+        # 管理 API 中的服务商名称不一定是已知的 vendor，统一按 OpenAI 兼容接口调用
+        vendor = route["provider_name"].lower()
+        config = {
+            "type": vendor if vendor in OPENAI_VENDOR_LIST else "openai",
+            "endpoint": route["base_url"],
+            "api_key": ModelProvider.get_api_key(route["api_key_id"]),
+        }
+        return config, route["provider_model_id"]
+
+    @staticmethod
+    def get_api_key(api_key_id):
+        """按 ApiKey.id 从管理 API 使用的数据库读取密钥明文，经共享连接池查询，结果只缓存在本进程内存中"""
+        now = time.monotonic()
+        cached = _api_key_cache.get(api_key_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        if not MODEL_ROUTER_DATABASE_URL:
+            raise ModelRequestError("未配置 MODEL_ROUTER_DATABASE_URL，无法读取路由选中的密钥")
+        row = _read_api_key(api_key_id)
+        if row is None:
+            raise ModelRequestError(f"密钥 {api_key_id} 不存在")
+        _api_key_cache[api_key_id] = (now + MODEL_ROUTER_KEY_CACHE_SECONDS, row[0])
+        return row[0]
+
+
+# 管理 API 地址，model_spec 写作 "router:<模型名>" 时由其解析服务商、模型 ID 与密钥
+MODEL_ROUTER_URL = os.getenv("MODEL_ROUTER_URL", "http://localhost:8000")
+# 路由结果在本进程内的缓存时间
+MODEL_ROUTER_CACHE_SECONDS = float(os.getenv("MODEL_ROUTER_CACHE_SECONDS", "10"))
+# 管理 API 的数据库，路由只返回密钥 ID，密钥明文从这里读取；须显式配置，不沿用其他程序的 DATABASE_URL
+MODEL_ROUTER_DATABASE_URL = os.getenv("MODEL_ROUTER_DATABASE_URL", "")
+# 读取密钥的数据库连接池大小
+MODEL_ROUTER_DATABASE_POOL_SIZE = int(os.getenv("MODEL_ROUTER_DATABASE_POOL_SIZE", "2"))
+# 密钥明文在本进程内的缓存时间
+MODEL_ROUTER_KEY_CACHE_SECONDS = float(os.getenv("MODEL_ROUTER_KEY_CACHE_SECONDS", "300"))
+_route_cache = {}
+_api_key_cache = {}
+_api_key_db_pool = None
+_api_key_db_lock = threading.Lock()
+# ThreadedConnectionPool 连接用尽时直接报错，用信号量让多出的线程等待空闲连接
+_api_key_db_slots = threading.BoundedSemaphore(MODEL_ROUTER_DATABASE_POOL_SIZE)
+
+
+def _read_api_key(api_key_id):
+    """经进程共享的连接池读取一条密钥，返回 (key,) 或 None；连接池首次使用时创建"""
+    global _api_key_db_pool
+    if _api_key_db_pool is None:
+        with _api_key_db_lock:
+            if _api_key_db_pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+
+                _api_key_db_pool = ThreadedConnectionPool(1, MODEL_ROUTER_DATABASE_POOL_SIZE, MODEL_ROUTER_DATABASE_URL)
+    pool = _api_key_db_pool
+    with _api_key_db_slots:
+        db = pool.getconn()
+        try:
+            # 只读查询，自动提交避免连接停留在事务中
+            db.autocommit = True
+            with db.cursor() as cursor:
+                cursor.execute("SELECT key FROM api_keys WHERE id = %s", (str(api_key_id),))
+                return cursor.fetchone()
+        finally:
+            pool.putconn(db, close=bool(db.closed))
+
+
+def close_api_key_db():
+    """关闭读取密钥的连接池"""
+    global _api_key_db_pool
+    with _api_key_db_lock:
+        pool, _api_key_db_pool = _api_key_db_pool, None
+    if pool is not None:
+        pool.closeall()
+
+
+atexit.register(close_api_key_db)
+
+
+def _retry_after_header(response):
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+def report_route_outcome(route, latency, error=None):
+    """
+    向管理 API 上报一次经路由的调用结果，供路由评分、熔断器与密钥冷却使用
+    上报失败只打印警告，不影响调用本身
+    """
+    outcome = {
+        "implementation_id": route["implementation_id"],
+        "api_key_id": route["api_key_id"],
+        "success": error is None,
+        "latency_ms": latency * 1000,
+    }
+    if error is not None:
+        outcome["status_code"] = error.status_code
+        outcome["retry_after"] = error.retry_after
+    try:
+        httpx.post(f"{MODEL_ROUTER_URL}/models/routes/outcomes", json=outcome, timeout=5).raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Warning: 上报路由调用结果失败: {e}")
 # 功能结束: 定义服务商选择器类
 
 
+# 功能开始: 客户端注册表
+# 每个 (vendor, endpoint, api_key) 的连接池上限及空闲连接保活时间
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "30"))
+
+
+class ClientRegistry:
+    """
+    按 (vendor, endpoint, api_key) 缓存 SDK 客户端
+
+    同一服务商端点和密钥的调用复用同一个客户端及其 HTTP 连接池，
+    避免每次请求重新建立 TCP/TLS 连接。线程安全，close() 关闭全部连接。
+    """
+
+    def __init__(self, max_connections=HTTP_MAX_CONNECTIONS,
+                 max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=HTTP_KEEPALIVE_EXPIRY):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._lock = threading.Lock()
+        self._clients = {}
+        # 异步连接池绑定创建它的事件循环，因此按事件循环分别缓存
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _get(self, kind, config, factory, clients=None):
+        clients = self._clients if clients is None else clients
+        key = (kind, config["type"], config["endpoint"], config["api_key"])
+        client = clients.get(key)
+        if client is None:
+            with self._lock:
+                client = clients.get(key)
+                if client is None:
+                    client = clients[key] = factory()
+        return client
+
+    def _loop_clients(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            return self._async_clients.setdefault(loop, {})
+
+    def openai(self, config):
+        """OpenAI 兼容服务商的同步客户端"""
+        return self._get("openai", config, lambda: openai.OpenAI(
+            base_url=config["endpoint"],
+            api_key=config["api_key"],
+            max_retries=0,  # 重试由 CallPolicy 负责
+            http_client=openai.DefaultHttpxClient(limits=self.limits),
+        ))
+
+    def async_openai(self, config):
+        """OpenAI 兼容服务商的异步客户端，需在事件循环中调用"""
+        return self._get("async_openai", config, lambda: openai.AsyncOpenAI(
+            base_url=config["endpoint"],
+            api_key=config["api_key"],
+            max_retries=0,  # 重试由 CallPolicy 负责
+            http_client=openai.DefaultAsyncHttpxClient(limits=self.limits),
+        ), self._loop_clients())
+
+    def close(self):
+        """关闭所有同步客户端及其连接池，并丢弃异步客户端"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._async_clients.clear()
+        for client in clients:
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
+
+    async def aclose(self):
+        """关闭当前事件循环中的异步客户端"""
+        clients = self._loop_clients()
+        with self._lock:
+            pending = list(clients.values())
+            clients.clear()
+        for client in pending:
+            await client.close()
+
+
+client_registry = ClientRegistry()
+
+
+def close_clients():
+    client_registry.close()
+
+
+async def aclose_clients():
+    await client_registry.aclose()
+
+
+atexit.register(close_clients)
+# 功能结束: 客户端注册表
+
+
+# 功能开始: 异步并发控制
+# 每个服务商同时进行的异步请求上限，可用 LLM_CONCURRENCY_<VENDOR> 单独设置
+VENDOR_CONCURRENCY = int(os.getenv("LLM_VENDOR_CONCURRENCY", "16"))
+
+_vendor_semaphores = weakref.WeakKeyDictionary()
+
+
+def vendor_semaphore(vendor):
+    """当前事件循环中该服务商的并发信号量"""
+    semaphores = _vendor_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if vendor not in semaphores:
+        limit = int(os.getenv(f"LLM_CONCURRENCY_{vendor.upper()}", VENDOR_CONCURRENCY))
+        semaphores[vendor] = asyncio.Semaphore(limit)
+    return semaphores[vendor]
+
+
+async def gather_limited(aws, limit=None, return_exceptions=False):
+    """
+    并发执行一组协程，按输入顺序返回结果
+    参数:
+        aws: 协程列表，例如 [achat(...), aembedding(...)]
+        limit: 同时运行的协程数上限，None 表示不限制；
+               achat/aembedding 另外受按服务商的并发上限约束
+        return_exceptions: 与 asyncio.gather 相同
+    """
+    if limit is None:
+        return await asyncio.gather(*aws, return_exceptions=return_exceptions)
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=return_exceptions)
+# 功能结束: 异步并发控制
+
+
 # 功能开始: encode image to base64
 def encode_image(image_path):
     # get image format
@@ -102,19 +388,15 @@ def encode_image(image_path):
 
 def parse_model_spec(model_spec):
     vendor = model_spec.split(":")[0]
+    if vendor == "router":
+        return ModelProvider.get_routed_config(model_spec.split(":", 1)[1])
     config = ModelProvider.get_vendor_config(vendor=vendor)
     model_variant = model_spec.split(":")[1]
     return config, model_variant
 
 
 # 功能开始: 文本模型及视觉理解模型请求处理方法
-def chat(prompt, model_spec="zhipu:glm-4-flash", image_path=None):
-    """
-    根据服务商配置调用对应 API 生成回复
-    参数:
-        prompt: 用户输入
-        model_spec: 格式为 "vendor:model_variant"，例如 "zhipu:glm-4-flash"
-    """
+def _resolve_chat(prompt, model_spec, image_path):
     if model_spec is None:
         model_spec = os.getenv("DEFAULT_MODEL")
     config, model_variant = parse_model_spec(model_spec)
@@ -125,58 +407,541 @@ def chat(prompt, model_spec="zhipu:glm-4-flash", image_path=None):
     
     if model_variant is None:
         raise ValueError("DEFAULT_MODEL 环境变量未设置")
-    
-    if config["type"] in OPENAI_VENDOR_LIST:
-        base_url = config["endpoint"]
-        api_key = config["api_key"]
-        client = openai.OpenAI(base_url=base_url, api_key=api_key)
-        if image_path:
-            with open(image_path, "rb") as f:
-                img_encode_data = encode_image(image_path)
-                content = [
-                    {"type": "image_url", "image_url": {"url": f"data:image/{img_encode_data[0]};base64,{img_encode_data[1]}"}},
-                    {"type": "text", "text": prompt}
-                ]
-        else:
-            content = prompt
-        
+    return config, model_variant
+
+
+def _chat_messages(prompt, image_path):
+    if image_path:
+        img_encode_data = encode_image(image_path)
+        content = [
+            {"type": "image_url", "image_url": {"url": f"data:image/{img_encode_data[0]};base64,{img_encode_data[1]}"}},
+            {"type": "text", "text": prompt}
+        ]
+    else:
+        content = prompt
+    return [{"role": "user", "content": content}]
+
+
+def _response_cache_entry(config, model_variant, prompt, image_path, temperature, cache):
+    """
+    返回 (缓存, 缓存键, model_spec, 是否做语义匹配)；缓存关闭时返回 None
+    未传 cache 时按 LLM_RESPONSE_CACHE 处理，但 temperature > 0 的采样请求不缓存，需显式传入 cache 才会缓存
+    """
+    mode = RESPONSE_CACHE_MODE if cache is None else {True: "exact", False: "off"}.get(cache, cache)
+    if mode not in CACHE_MODES:
+        raise ValueError(f"未知的缓存模式: {mode}")
+    if mode == "off" or (cache is None and temperature):
+        return None
+    response_cache = get_response_cache()
+    spec = f"{config['type']}:{model_variant}"
+    # 图像以内容哈希参与缓存键，而不是 base64 编码后的消息
+    key = cache_key(spec, [{"role": "user", "content": prompt}], temperature, file_hash(image_path) if image_path else None)
+    semantic = mode == "semantic" and image_path is None and response_cache.semantic_enabled
+    return response_cache, key, spec, semantic
+
+
+def _prompt_vector(prompt, response_cache):
+    try:
+        return embedding(prompt, model_spec=RESPONSE_CACHE_EMBEDDING_MODEL, dimensions=response_cache.dimensions)
+    except Exception as e:
+        print(f"Warning: 计算提示词向量失败，跳过语义匹配: {e}")
+        return None
+
+
+async def _aprompt_vector(prompt, response_cache):
+    try:
+        return await aembedding(prompt, model_spec=RESPONSE_CACHE_EMBEDDING_MODEL, dimensions=response_cache.dimensions)
+    except Exception as e:
+        print(f"Warning: 计算提示词向量失败，跳过语义匹配: {e}")
+        return None
+
+
+def _check_vendor(config):
+    # gemini 也在 OPENAI_VENDOR_LIST 中，经其 OpenAI 兼容端点调用
+    if config["type"] not in OPENAI_VENDOR_LIST:
+        raise ValueError(f"未知的服务商类型: {config['type']}")
+
+
+def _chat_target(config, model_variant, prompt, image_path, temperature):
+    """(model_spec, call)，call(timeout) 同步请求一次并返回回复文本"""
+    _check_vendor(config)
+    client = client_registry.openai(config)
+
+    def call(timeout):
         response = client.chat.completions.create(
-            model=model_variant, messages=[
-                {"role": "user", "content": content}
-            ],
-            temperature=0.6
+            model=model_variant,
+            messages=_chat_messages(prompt, image_path),
+            temperature=temperature,
+            timeout=timeout,
         )
-        reply = response.choices[0].message.content
-    elif config["type"] == "gemini":
-        try:
-            client = genai.Client(
-                api_key=config["api_key"],   
-                http_options={'api_version':'v1alpha'},
-                )
-            response = client.models.generate_content(model=model_variant, contents=prompt)
-            reply = response.text.strip()
-        except Exception as e:
-            reply = f"调用 gemini API 时出错: {e}"
+        return response.choices[0].message.content
 
-    else:
-        reply = f"未知的服务商类型: {config['type']}"
+    return f"{config['type']}:{model_variant}", call
+
+
+def _routed_model(model_spec):
+    """model_spec 写作 "router:<模型名>" 时返回模型名，否则返回 None"""
+    model_spec = model_spec or os.getenv("DEFAULT_MODEL") or ""
+    return model_spec.split(":", 1)[1] if model_spec.startswith("router:") else None
+
+
+def _routed_chat_target(model_name, prompt, image_path, temperature, tried=None, avoid=None):
+    """
+    (model_spec, call)，call(timeout) 按路由顺序依次尝试各实现:
+    可重试的失败 (超时、限流、5xx) 换下一个实现，不可重试的失败直接抛出；
+    每次调用的结果都上报给管理 API。全部失败时丢弃路由缓存，下次重试重新解析
+    tried 收集调用过的 implementation_id，avoid 中的实现会被跳过，对冲目标借此避开主目标调用过的实现
+    """
+    spec = f"router:{model_name}"
+
+    def call(timeout):
+        deadline = time.monotonic() + timeout
+        last_error = None
+        routes = [route for route in ModelProvider.get_routes(model_name) if route["implementation_id"] not in (avoid or ())]
+        if not routes:
+            raise ModelUnavailableError(f"{spec} 没有其他可用实现", spec)
+        for route in routes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if tried is not None:
+                tried.add(route["implementation_id"])
+            config, model_variant = ModelProvider.get_route_config(route)
+            route_spec, attempt = _chat_target(config, model_variant, prompt, image_path, temperature)
+            started = time.monotonic()
+            try:
+                reply = attempt(remaining)
+            except Exception as e:
+                error = translate_error(e, route_spec)
+                report_route_outcome(route, time.monotonic() - started, error)
+                if not error.retryable:
+                    raise error from e
+                last_error = error
+                continue
+            report_route_outcome(route, time.monotonic() - started)
+            return reply
+        _route_cache.pop(model_name, None)
+        raise last_error or ModelTimeoutError(f"{spec} 请求超时", spec)
+
+    return spec, call
+
+
+def _routed_achat_target(model_name, prompt, image_path, temperature, tried=None, avoid=None):
+    """_routed_chat_target 的异步版本，路由解析与结果上报在线程中执行"""
+    spec = f"router:{model_name}"
+
+    async def call(timeout):
+        deadline = time.monotonic() + timeout
+        last_error = None
+        routes = await asyncio.to_thread(ModelProvider.get_routes, model_name)
+        routes = [route for route in routes if route["implementation_id"] not in (avoid or ())]
+        if not routes:
+            raise ModelUnavailableError(f"{spec} 没有其他可用实现", spec)
+        for route in routes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if tried is not None:
+                tried.add(route["implementation_id"])
+            config, model_variant = await asyncio.to_thread(ModelProvider.get_route_config, route)
+            route_spec, attempt = _achat_target(config, model_variant, prompt, image_path, temperature)
+            started = time.monotonic()
+            try:
+                reply = await asyncio.wait_for(attempt(remaining), remaining)
+            except Exception as e:
+                error = translate_error(e, route_spec)
+                await asyncio.to_thread(report_route_outcome, route, time.monotonic() - started, error)
+                if not error.retryable:
+                    raise error from e
+                last_error = error
+                continue
+            await asyncio.to_thread(report_route_outcome, route, time.monotonic() - started)
+            return reply
+        _route_cache.pop(model_name, None)
+        raise last_error or ModelTimeoutError(f"{spec} 请求超时", spec)
+
+    return spec, call
+
+
+def _achat_target(config, model_variant, prompt, image_path, temperature):
+    """(model_spec, call)，call(timeout) 返回请求一次的协程，受该服务商的并发上限约束"""
+    _check_vendor(config)
+
+    async def call(timeout):
+        async with vendor_semaphore(config["type"]):
+            client = client_registry.async_openai(config)
+            response = await client.chat.completions.create(
+                model=model_variant,
+                messages=_chat_messages(prompt, image_path),
+                temperature=temperature,
+                timeout=timeout,
+            )
+            return response.choices[0].message.content
+
+    return f"{config['type']}:{model_variant}", call
+
+
+def _chat_targets(model_spec, config, model_variant, prompt, image_path, temperature, asynchronous=False,
+                  tried=None, avoid=None):
+    """model_spec 对应的调用目标；router: 模型按路由顺序回退，其余直接调用解析出的服务商"""
+    model_name = _routed_model(model_spec)
+    if model_name is not None:
+        target = _routed_achat_target if asynchronous else _routed_chat_target
+        return target(model_name, prompt, image_path, temperature, tried, avoid)
+    target = _achat_target if asynchronous else _chat_target
+    return target(config, model_variant, prompt, image_path, temperature)
+
+
+def chat(prompt, model_spec="zhipu:glm-4-flash", image_path=None, stream=False, temperature=0.6, cache=None, cache_ttl=None,
+         policy=None, hedge_model_spec=None):
+    """
+    根据服务商配置调用对应 API 生成回复
+    参数:
+        prompt: 用户输入
+        model_spec: 格式为 "vendor:model_variant"，例如 "zhipu:glm-4-flash"
+        stream: 为 True 时返回 ChatStream，逐段产出增量文本 (不经过回复缓存)
+        cache: 回复缓存模式 "off" / "exact" / "semantic"，也可传 True/False；默认取 LLM_RESPONSE_CACHE (默认 off)，
+            且 temperature > 0 时不缓存
+        cache_ttl: 本次回复的缓存有效期 (秒)，默认取 LLM_RESPONSE_CACHE_TTL_SECONDS
+        policy: CallPolicy，超时、重试与对冲设置，默认取 LLM_* 环境变量
+        hedge_model_spec: 对冲请求发往的 model_spec；默认 router: 模型发往主请求未调用过的下一个实现，
+            其余模型没有可替换的目标，不做对冲
+    异常:
+        ModelAPIError 的子类，重试耗尽或遇到不可重试的错误时抛出
+    """
+    config, model_variant = _resolve_chat(prompt, model_spec, image_path)
+    if stream:
+        # 生成器在首次迭代时才执行，服务商类型需在返回流对象前检查
+        _check_vendor(config)
+        return ChatStream(_stream_chunks(config, model_variant, prompt, image_path, temperature))
+
+    entry = _response_cache_entry(config, model_variant, prompt, image_path, temperature, cache)
+    if entry:
+        response_cache, key, spec, semantic = entry
+        vector = _prompt_vector(prompt, response_cache) if semantic else None
+        reply = response_cache.get(key, spec, temperature, vector)
+        if reply is not None:
+            return reply
+
+    tried = set()
+    targets = [_chat_targets(model_spec, config, model_variant, prompt, image_path, temperature, tried=tried)]
+    if hedge_model_spec:
+        targets.append(_chat_targets(
+            hedge_model_spec, *_resolve_chat(prompt, hedge_model_spec, image_path), prompt, image_path, temperature
+        ))
+    elif _routed_model(model_spec) is not None:
+        targets.append(_chat_targets(model_spec, config, model_variant, prompt, image_path, temperature, avoid=tried))
+    reply = call_with_policy(targets, policy)
+    if entry:
+        response_cache.put(key, reply, spec, temperature, prompt, vector, cache_ttl)
     return reply
 
 
+async def achat(prompt, model_spec="zhipu:glm-4-flash", image_path=None, temperature=0.6, cache=None, cache_ttl=None,
+                policy=None, hedge_model_spec=None):
+    """
+    chat 的异步版本，复用注册表中的连接池，并受该服务商的并发上限约束
+    流式输出使用 astream_chat
+    """
+    # router: 模型的解析会访问管理 API 与数据库，放到线程中执行
+    config, model_variant = await asyncio.to_thread(_resolve_chat, prompt, model_spec, image_path)
+    entry = _response_cache_entry(config, model_variant, prompt, image_path, temperature, cache)
+    if entry:
+        response_cache, key, spec, semantic = entry
+        vector = await _aprompt_vector(prompt, response_cache) if semantic else None
+        # 缓存查找可能访问数据库，放到线程中执行
+        reply = await asyncio.to_thread(response_cache.get, key, spec, temperature, vector)
+        if reply is not None:
+            return reply
+
+    tried = set()
+    targets = [_chat_targets(
+        model_spec, config, model_variant, prompt, image_path, temperature, asynchronous=True, tried=tried
+    )]
+    if hedge_model_spec:
+        hedge_config, hedge_variant = await asyncio.to_thread(_resolve_chat, prompt, hedge_model_spec, image_path)
+        targets.append(_chat_targets(
+            hedge_model_spec, hedge_config, hedge_variant, prompt, image_path, temperature, asynchronous=True
+        ))
+    elif _routed_model(model_spec) is not None:
+        targets.append(_chat_targets(
+            model_spec, config, model_variant, prompt, image_path, temperature, asynchronous=True, avoid=tried
+        ))
+    reply = await acall_with_policy(targets, policy)
+    if entry:
+        await asyncio.to_thread(response_cache.put, key, reply, spec, temperature, prompt, vector, cache_ttl)
+    return reply
+
+
+def astream_chat(prompt, model_spec="zhipu:glm-4-flash", image_path=None, temperature=0.6):
+    """
+    chat(..., stream=True) 的异步版本，返回 AsyncChatStream:
+    async for delta in astream_chat(...) 逐段产出增量文本，不经过回复缓存
+    """
+    config, model_variant = _resolve_chat(prompt, model_spec, image_path)
+    _check_vendor(config)
+    return AsyncChatStream(_astream_chunks(config, model_variant, prompt, image_path, temperature))
+
+
 # 功能结束: 文本模型及视觉理解模型请求处理方法
 
+
+# 功能开始: 流式输出
+def _usage(prompt_tokens, completion_tokens, total_tokens=None):
+    """与 ApiKeyUsage 字段一致的用量字典"""
+    prompt_tokens = prompt_tokens or 0
+    completion_tokens = completion_tokens or 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens or prompt_tokens + completion_tokens,
+    }
+
+
+def _openai_chunk(chunk):
+    # 开启 include_usage 后，最后一个分片只携带用量，choices 为空
+    delta = chunk.choices[0].delta.content if chunk.choices else None
+    usage = _usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens, chunk.usage.total_tokens) if chunk.usage else None
+    return delta, usage
+
+
+def _openai_stream_kwargs(model_variant, prompt, image_path, temperature):
+    return {
+        "model": model_variant,
+        "messages": _chat_messages(prompt, image_path),
+        "temperature": temperature,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+        "timeout": DEFAULT_POLICY.attempt_timeout,
+    }
+
+
+def _stream_chunks(config, model_variant, prompt, image_path, temperature):
+    # 流式输出不重试 (已产出的内容无法撤回)，只统一异常类型
+    try:
+        client = client_registry.openai(config)
+        response = client.chat.completions.create(**_openai_stream_kwargs(model_variant, prompt, image_path, temperature))
+        try:
+            for chunk in response:
+                yield _openai_chunk(chunk)
+        finally:
+            response.close()  # 提前停止迭代时释放连接
+    except ValueError:
+        raise
+    except Exception as e:
+        raise translate_error(e, f"{config['type']}:{model_variant}") from e
+
+
+async def _astream_chunks(config, model_variant, prompt, image_path, temperature):
+    try:
+        async with vendor_semaphore(config["type"]):
+            client = client_registry.async_openai(config)
+            response = await client.chat.completions.create(**_openai_stream_kwargs(model_variant, prompt, image_path, temperature))
+            try:
+                async for chunk in response:
+                    yield _openai_chunk(chunk)
+            finally:
+                await response.close()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise translate_error(e, f"{config['type']}:{model_variant}") from e
+
+
+class ChatStream:
+    """
+    流式回复，迭代得到增量文本
+    迭代结束后 text 为完整回复，usage 为 {"prompt_tokens", "completion_tokens", "total_tokens"}，
+    可直接写入 ApiKeyUsage；服务商未返回用量时 usage 为 None
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._parts = []
+        self.usage = None
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def __iter__(self):
+        for delta, usage in self._chunks:
+            if usage:
+                self.usage = usage
+            if delta:
+                self._parts.append(delta)
+                yield delta
+
+    def close(self):
+        self._chunks.close()
+
+
+class AsyncChatStream(ChatStream):
+    """ChatStream 的异步版本，用 async for 迭代"""
+
+    def __iter__(self):
+        raise TypeError("AsyncChatStream 需要使用 async for 迭代")
+
+    async def __aiter__(self):
+        async for delta, usage in self._chunks:
+            if usage:
+                self.usage = usage
+            if delta:
+                self._parts.append(delta)
+                yield delta
+
+    async def aclose(self):
+        await self._chunks.aclose()
+
+    def close(self):
+        raise TypeError("AsyncChatStream 需要使用 aclose() 关闭")
+# 功能结束: 流式输出
+
+
 # 功能开始: embedding 模型
-def embedding(input, model_spec="dashscope:text-embedding-v3", dimensions=1024, **kwargs):
+# 单次请求的条数、估算 token 数与字符数上限，超出时自动拆分为多个批次
+EMBEDDING_BATCH_LIMITS = {
+    "openai": {"max_items": 2048, "max_tokens": 300000, "max_chars": 1000000},
+    "dashscope": {"max_items": 10, "max_tokens": 8192 * 10, "max_chars": 60000},
+    "zhipu": {"max_items": 64, "max_tokens": 8192 * 64, "max_chars": 300000},
+    "ollama": {"max_items": 64, "max_tokens": 2048 * 64, "max_chars": 200000},
+}
+DEFAULT_EMBEDDING_BATCH_LIMITS = {"max_items": 16, "max_tokens": 8192 * 16, "max_chars": 100000}
+# 同步 embedding 同时发送的批次数
+EMBEDDING_MAX_WORKERS = int(os.getenv("LLM_EMBEDDING_MAX_WORKERS", "4"))
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数: 英文约 4 个字符一个 token，中文等非 ASCII 字符约一个字符一个 token"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+
+def embedding_batches(texts, vendor):
+    """按服务商上限顺序切分文本，返回文本列表的列表"""
+    limits = EMBEDDING_BATCH_LIMITS.get(vendor, DEFAULT_EMBEDDING_BATCH_LIMITS)
+    batches = []
+    start, tokens, chars = 0, 0, 0
+    for i, text in enumerate(texts):
+        text_tokens, text_chars = estimate_tokens(text), len(text)
+        full = (
+            i - start >= limits["max_items"]
+            or tokens + text_tokens > limits["max_tokens"]
+            or chars + text_chars > limits["max_chars"]
+        )
+        # 单条超出上限时独占一个批次，由服务商决定截断或报错
+        if full and i > start:
+            batches.append(texts[start:i])
+            start, tokens, chars = i, 0, 0
+        tokens += text_tokens
+        chars += text_chars
+    if start < len(texts):
+        batches.append(texts[start:])
+    return batches
+
+
+def _resolve_embedding(model_spec):
     if model_spec is None:
         model_spec = os.getenv("DEFAULT_EMBEDDING_MODEL")
     config, model_variant = parse_model_spec(model_spec)
-    if config["type"] in OPENAI_VENDOR_LIST:
-        base_url = config["endpoint"]
-        api_key = config["api_key"]
-        client = openai.OpenAI(base_url=base_url, api_key=api_key)
-        response = client.embeddings.create(
-            model=model_variant, input=input, dimensions=dimensions
-        )
-        return response
-    raise ValueError("未知的服务商类型")
+    if config["type"] not in OPENAI_VENDOR_LIST:
+        raise ValueError("未知的服务商类型")
+    return config, model_variant
+
+
+def _embedding_texts(input):
+    if isinstance(input, str):
+        return [input], True
+    return list(input), False
+
+
+def _embedding_vectors(response):
+    # 按 index 排序，不依赖服务商返回顺序
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def _embedding_result(vectors, single, as_numpy, dimensions):
+    if as_numpy:
+        import numpy as np
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1) if vectors else np.empty((0, dimensions), dtype=np.float32)
+        return matrix[0] if single else matrix
+    return vectors[0] if single else vectors
+
+
+def _embedding_cache(cache):
+    # True 使用进程共享的默认缓存，False/None 关闭缓存，也可传入 EmbeddingCache 实例
+    return get_embedding_cache() if cache is True else cache or None
+
+
+def _cache_lookup(cache, cache_key, dimensions, texts):
+    """返回 (按输入顺序的缓存向量，未命中处为 None; 去重后需要请求的文本)"""
+    cached = cache.get_many(cache_key, dimensions, texts) if cache else [None] * len(texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+    return cached, missing
+
+
+def _cache_merge(cache, cache_key, dimensions, texts, cached, missing, fetched):
+    if cache and missing:
+        cache.put_many(cache_key, dimensions, missing, fetched)
+    by_text = dict(zip(missing, fetched))
+    return [vector if vector is not None else by_text[text] for text, vector in zip(texts, cached)]
+
+
+def embedding(input, model_spec="dashscope:text-embedding-v3", dimensions=1024, as_numpy=False, cache=True, policy=None, **kwargs):
+    """
+    计算文本向量
+    参数:
+        input: 单个文本或文本列表；列表按服务商上限自动分批并发请求，结果保持输入顺序
+        as_numpy: 为 True 时返回 float32 的 NumPy 数组 (列表输入为矩阵)
+        cache: 是否使用向量缓存；命中的文本与重复文本不会再次请求服务商
+        policy: CallPolicy，每个批次的超时与重试设置
+    返回:
+        单个文本返回 List[float]，文本列表返回 List[List[float]]
+    """
+    config, model_variant = _resolve_embedding(model_spec)
+    texts, single = _embedding_texts(input)
+    cache = _embedding_cache(cache)
+    cache_key = f"{config['type']}:{model_variant}"
+    cached, missing = _cache_lookup(cache, cache_key, dimensions, texts)
+    client = client_registry.openai(config)
+
+    def run(batch):
+        response = call_with_policy([(cache_key, lambda timeout: client.embeddings.create(
+            model=model_variant, input=batch, dimensions=dimensions, timeout=timeout,
+        ))], policy)
+        return _embedding_vectors(response)
+
+    batches = embedding_batches(missing, config["type"])
+    if len(batches) <= 1:
+        results = [run(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(EMBEDDING_MAX_WORKERS, len(batches))) as pool:
+            results = list(pool.map(run, batches))
+    fetched = [vector for result in results for vector in result]
+    vectors = _cache_merge(cache, cache_key, dimensions, texts, cached, missing, fetched)
+    return _embedding_result(vectors, single, as_numpy, dimensions)
+
+
+async def aembedding(input, model_spec="dashscope:text-embedding-v3", dimensions=1024, as_numpy=False, cache=True, policy=None, **kwargs):
+    """embedding 的异步版本，复用注册表中的连接池，批次并发数受该服务商的并发上限约束"""
+    config, model_variant = _resolve_embedding(model_spec)
+    texts, single = _embedding_texts(input)
+    cache = _embedding_cache(cache)
+    cache_key = f"{config['type']}:{model_variant}"
+    # 缓存读写涉及磁盘 I/O，放到线程中执行以免阻塞事件循环
+    cached, missing = await asyncio.to_thread(_cache_lookup, cache, cache_key, dimensions, texts)
+    client = client_registry.async_openai(config)
+
+    async def call(batch, timeout):
+        async with vendor_semaphore(config["type"]):
+            return await client.embeddings.create(model=model_variant, input=batch, dimensions=dimensions, timeout=timeout)
+
+    async def run(batch):
+        response = await acall_with_policy([(cache_key, lambda timeout: call(batch, timeout))], policy)
+        return _embedding_vectors(response)
+
+    results = await asyncio.gather(*(run(batch) for batch in embedding_batches(missing, config["type"])))
+    fetched = [vector for result in results for vector in result]
+    vectors = await asyncio.to_thread(_cache_merge, cache, cache_key, dimensions, texts, cached, missing, fetched)
+    return _embedding_result(vectors, single, as_numpy, dimensions)
 # 功能结束: embedding 模型
\ No newline at end of file
@@ -10,6 +10,7 @@ import numpy as np
 from collections import Counter
 import random
 import sys
+import asyncio
 
 logger = getLogger(__name__)
 # file_handler = FileHandler("rag_process.log")
@@ -30,7 +31,7 @@ COLORS = [
     "\033[35m",  # Magenta
     "\033[36m",  # Cyan
 ]
-from model_api import embedding, chat
+from model_api import embedding, chat, achat, gather_limited
 
 embedding_model_spec = "ollama:nomic-embed-text"
 llm_model_spec = "volcengine:deepseek-v3-241226"
@@ -81,25 +82,27 @@ def load_document(document_path = 'resouce/《西游记》.txt'):
     logger.info(f"Document split into {len(splits)} chunks using improved chunking")
     print(splits[:2])
     
-    # embedding paragraph
+    # embedding paragraph: 所有段落一次提交，由 embedding 自动分批并发请求
     logger.info("Embedding paragraphs...")
-    for idx, split in enumerate(tqdm(splits, desc="Embedding paragraphs")):
-        paragraph = split.page_content
-        embedding_resp = embedding(input=paragraph, model_spec=embedding_model_spec)
-        
+    paragraphs = [split.page_content for split in splits]
+    vectors = embedding(input=paragraphs, model_spec=embedding_model_spec)
+    
+    metadatas = []
+    for idx, paragraph in enumerate(tqdm(paragraphs, desc="Extracting keywords")):
         # 新增: 提取关键词并存储
         keywords = extract_keywords(paragraph)
-        
-        collection.add(
-            ids=[f"id_{idx}"],
-            embeddings=[embedding_resp.data[0].embedding],
-            metadatas=[{
-                "index": idx, 
-                "chunk_length": len(paragraph),
-                "keywords": ",".join(keywords)  # 存储关键词以供检索
-            }],
-            documents=[paragraph],
-        )
+        metadatas.append({
+            "index": idx, 
+            "chunk_length": len(paragraph),
+            "keywords": ",".join(keywords)  # 存储关键词以供检索
+        })
+    
+    collection.add(
+        ids=[f"id_{idx}" for idx in range(len(paragraphs))],
+        embeddings=vectors,
+        metadatas=metadatas,
+        documents=paragraphs,
+    )
     logger.info(f"Embedding completed. Total chunks: {len(splits)}")
 
 # 重置和重新加载数据 (取消注释以重新处理数据)
@@ -121,7 +124,7 @@ def hybrid_query(input_text, n_results=5, keyword_weight=0.3, vector_weight=0.7)
     logger.info(f"Processing hybrid query: {input_text}")
     
     # 1. 向量搜索部分
-    input_embedding = embedding(input=input_text, model_spec=embedding_model_spec).data[0].embedding
+    input_embedding = embedding(input=input_text, model_spec=embedding_model_spec)
     vector_results = collection.query(
         query_embeddings=input_embedding,
         n_results=n_results * 2  # 获取更多候选结果以进行排序
@@ -345,6 +348,7 @@ HELPFUL_PROMPT = """你的任务是判断给定的文本块对解决特定问题
 def retrieve_relevant_chunks(questions, top_k=5):
     """对每个问题使用混合搜索检索相关文本块，并进行相关性评分"""
     all_relevant_chunks = []
+    candidates = []
     
     for question in questions:
         logger.info(f"{COLORS[0]}Querying for question: {question}\033[0m")
@@ -352,30 +356,37 @@ def retrieve_relevant_chunks(questions, top_k=5):
         
         for i, doc in enumerate(results['documents'][0]):
             # 混合搜索得分
-            hybrid_score = results['scores'][0][i]
-            
-            # 使用LLM进行相关性评分
-            chat_prompt = HELPFUL_PROMPT.format(query=question, retrieved_chunk=doc)
-            chat_resp = chat(prompt=chat_prompt, model_spec=llm_model_spec)
+            candidates.append((question, doc, results['scores'][0][i]))
+    
+    # 使用LLM并发进行相关性评分
+    chat_resps = asyncio.run(gather_limited(
+        [achat(prompt=HELPFUL_PROMPT.format(query=question, retrieved_chunk=doc), model_spec=llm_model_spec)
+         for question, doc, _ in candidates],
+        return_exceptions=True,
+    ))
+    
+    for (question, doc, hybrid_score), chat_resp in zip(candidates, chat_resps):
+        if isinstance(chat_resp, Exception):
+            logger.warning(f"Failed to score chunk: {chat_resp}")
+            continue
+        try:
+            score_text = chat_resp.split("<answer>")[1].split("</answer>")[0].strip()
+            llm_score = float(score_text)
+            # 综合考虑混合搜索得分和LLM评分
+            final_score = (hybrid_score * 0.4) + (llm_score / 10 * 0.6)
             
-            try:
-                score_text = chat_resp.split("<answer>")[1].split("</answer>")[0].strip()
-                llm_score = float(score_text)
-                # 综合考虑混合搜索得分和LLM评分
-                final_score = (hybrid_score * 0.4) + (llm_score / 10 * 0.6)
-                
-                if final_score >= 0.6:  # 设置相关性阈值
-                    all_relevant_chunks.append({
-                        "question": question,
-                        "chunk": doc,
-                        "hybrid_score": hybrid_score,
-                        "llm_score": llm_score,
-                        "final_score": final_score
-                    })
-                    logger.info(f"Found relevant chunk with final score {final_score:.2f} (hybrid: {hybrid_score:.2f}, llm: {llm_score:.1f}): {doc[:100]}...")
-            except Exception as e:
-                logger.warning(f"Failed to parse relevance score: {e}")
-        
+            if final_score >= 0.6:  # 设置相关性阈值
+                all_relevant_chunks.append({
+                    "question": question,
+                    "chunk": doc,
+                    "hybrid_score": hybrid_score,
+                    "llm_score": llm_score,
+                    "final_score": final_score
+                })
+                logger.info(f"Found relevant chunk with final score {final_score:.2f} (hybrid: {hybrid_score:.2f}, llm: {llm_score:.1f}): {doc[:100]}...")
+        except Exception as e:
+            logger.warning(f"Failed to parse relevance score: {e}")
+    
     # 按相关性分数排序
     all_relevant_chunks.sort(key=lambda x: x['final_score'], reverse=True)
     return all_relevant_chunks
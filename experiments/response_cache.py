@@ -0,0 +1,265 @@
+# 功能开始: 导入必要模块
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+# 功能结束: 导入必要模块
+
+
+# 功能开始: 缓存配置
+# 默认缓存模式: off 关闭，exact 仅精确匹配，semantic 精确匹配未命中时再按向量相似度查找
+# 缓存会让采样结果不再随机，默认关闭，需要时显式开启
+RESPONSE_CACHE_MODE = os.getenv("LLM_RESPONSE_CACHE", "off")
+# 缓存回复的有效期
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("LLM_RESPONSE_CACHE_TTL_SECONDS", "86400"))
+# 内存中保留的精确匹配条数
+RESPONSE_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_RESPONSE_CACHE_MEMORY_ITEMS", "1000"))
+# 启用 pgvector 的 Postgres 连接串，为空时只使用内存缓存，语义匹配不可用
+RESPONSE_CACHE_DATABASE_URL = os.getenv("LLM_RESPONSE_CACHE_DATABASE_URL", os.getenv("DATABASE_URL", ""))
+# 数据库连接池大小，即可同时查询缓存的线程数
+RESPONSE_CACHE_POOL_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_POOL_SIZE", "8"))
+# 语义匹配的余弦相似度阈值
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("LLM_RESPONSE_CACHE_SIMILARITY", "0.95"))
+# 计算提示词向量使用的模型与维度，维度需与表结构一致
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("LLM_RESPONSE_CACHE_EMBEDDING_MODEL", "dashscope:text-embedding-v3")
+RESPONSE_CACHE_DIMENSIONS = int(os.getenv("LLM_RESPONSE_CACHE_DIMENSIONS", "1024"))
+# 过期条目的清理间隔
+RESPONSE_CACHE_PURGE_INTERVAL_SECONDS = 600
+
+CACHE_MODES = ("off", "exact", "semantic")
+# 功能结束: 缓存配置
+
+
+# 功能开始: 缓存键
+def file_hash(path):
+    """图像等文件内容的 SHA-256，路径不同但内容相同的文件命中同一缓存"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(model_spec, messages, temperature, image_hash=None):
+    """(model_spec, messages, temperature, 图像哈希) 的 SHA-256"""
+    payload = json.dumps(
+        {"model_spec": model_spec, "messages": messages, "temperature": temperature, "image": image_hash},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+# 功能结束: 缓存键
+
+
+# 功能开始: 回复缓存
+class ResponseCache:
+    """
+    chat 回复缓存
+
+    精确匹配: 以 cache_key 为键，先查内存 LRU，再查 Postgres 表。
+    语义匹配: 提示词向量存入 pgvector 列，按 (model_spec, temperature) 查找余弦距离最近的
+    历史提示词，相似度不低于阈值时复用其回复。带图像的请求只做精确匹配。
+    所有条目在 TTL 后过期。线程安全: 锁只保护内存 LRU，数据库查询经连接池并发执行。
+    """
+
+    def __init__(self, database_url=RESPONSE_CACHE_DATABASE_URL, memory_items=RESPONSE_CACHE_MEMORY_ITEMS,
+                 ttl=RESPONSE_CACHE_TTL_SECONDS, similarity=RESPONSE_CACHE_SIMILARITY,
+                 dimensions=RESPONSE_CACHE_DIMENSIONS, pool_size=RESPONSE_CACHE_POOL_SIZE):
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self.similarity = similarity
+        self.dimensions = dimensions
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        # 只保护内存 LRU 与计数器，数据库查询不持有该锁
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (reply, expires_at)
+        self._last_purge = 0.0
+        # ThreadedConnectionPool 连接用尽时直接报错，用信号量让多出的线程等待空闲连接
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._pool = self._connect(database_url, pool_size) if database_url else None
+
+    @property
+    def semantic_enabled(self):
+        return self._pool is not None
+
+    def _connect(self, database_url, pool_size):
+        try:
+            from psycopg2.pool import ThreadedConnectionPool
+        except ImportError:
+            print("Warning: psycopg2 未安装，回复缓存仅使用内存，语义匹配不可用")
+            return None
+        try:
+            pool = ThreadedConnectionPool(1, pool_size, database_url)
+        except Exception as e:
+            print(f"Warning: 无法连接回复缓存数据库，仅使用内存缓存: {e}")
+            return None
+        try:
+            db = pool.getconn()
+            try:
+                db.autocommit = True
+                with db.cursor() as cursor:
+                    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+                    cursor.execute(f"""
+                        CREATE TABLE IF NOT EXISTS chat_response_cache (
+                            cache_key TEXT PRIMARY KEY,
+                            model_spec TEXT NOT NULL,
+                            temperature DOUBLE PRECISION NOT NULL,
+                            prompt TEXT NOT NULL,
+                            embedding vector({self.dimensions}),
+                            reply TEXT NOT NULL,
+                            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                            expires_at TIMESTAMPTZ NOT NULL
+                        )
+                    """)
+                    cursor.execute(
+                        "CREATE INDEX IF NOT EXISTS ix_chat_response_cache_embedding "
+                        "ON chat_response_cache USING hnsw (embedding vector_cosine_ops)"
+                    )
+                    cursor.execute(
+                        "CREATE INDEX IF NOT EXISTS ix_chat_response_cache_expires_at ON chat_response_cache (expires_at)"
+                    )
+            finally:
+                pool.putconn(db)
+            return pool
+        except Exception as e:
+            pool.closeall()
+            print(f"Warning: 无法连接回复缓存数据库，仅使用内存缓存: {e}")
+            return None
+
+    @contextmanager
+    def _cursor(self):
+        """从连接池借一个自动提交的连接，用完归还；连接已断开时丢弃而不放回池中"""
+        with self._slots:
+            db = self._pool.getconn()
+            try:
+                db.autocommit = True
+                with db.cursor() as cursor:
+                    yield cursor
+            finally:
+                self._pool.putconn(db, close=bool(db.closed))
+
+    def get(self, key, model_spec=None, temperature=None, vector=None):
+        """
+        查找缓存的回复，未命中返回 None
+        传入 vector 时，精确匹配未命中后按向量相似度查找同一模型与温度下的历史提示词
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._memory.pop(key, None)
+
+        row, semantic = None, False
+        if self._pool is not None:
+            with self._cursor() as cursor:
+                cursor.execute(
+                    "SELECT reply, extract(epoch FROM expires_at) FROM chat_response_cache "
+                    "WHERE cache_key = %s AND expires_at > now()",
+                    (key,),
+                )
+                row = cursor.fetchone()
+                if row is None and vector is not None:
+                    # 先按距离排序取最近的一条，再判断阈值，以便使用 HNSW 索引
+                    cursor.execute(
+                        "SELECT reply, extract(epoch FROM expires_at), 1 - (embedding <=> %s::vector) "
+                        "FROM chat_response_cache "
+                        "WHERE model_spec = %s AND temperature = %s AND embedding IS NOT NULL AND expires_at > now() "
+                        "ORDER BY embedding <=> %s::vector LIMIT 1",
+                        (_vector_literal(vector), model_spec, temperature, _vector_literal(vector)),
+                    )
+                    candidate = cursor.fetchone()
+                    if candidate is not None and candidate[2] >= self.similarity:
+                        row, semantic = candidate, True
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if semantic:
+                self.semantic_hits += 1
+            else:
+                self._remember(key, row[0], float(row[1]))
+            return row[0]
+
+    def put(self, key, reply, model_spec, temperature, prompt, vector=None, ttl=None):
+        """写入回复；vector 为提示词向量，提供时该条目可被语义匹配"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, reply, expires_at)
+            purge = time.time() - self._last_purge > RESPONSE_CACHE_PURGE_INTERVAL_SECONDS
+            if purge:
+                self._last_purge = time.time()
+        if self._pool is None:
+            return
+        with self._cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO chat_response_cache "
+                "(cache_key, model_spec, temperature, prompt, embedding, reply, expires_at) "
+                "VALUES (%s, %s, %s, %s, %s::vector, %s, to_timestamp(%s)) "
+                "ON CONFLICT (cache_key) DO UPDATE SET "
+                "embedding = coalesce(EXCLUDED.embedding, chat_response_cache.embedding), "
+                "reply = EXCLUDED.reply, created_at = now(), expires_at = EXCLUDED.expires_at",
+                (key, model_spec, temperature, prompt,
+                 _vector_literal(vector) if vector is not None else None, reply, expires_at),
+            )
+            if purge:
+                cursor.execute("DELETE FROM chat_response_cache WHERE expires_at <= now()")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_items": len(self._memory),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._pool is not None:
+            with self._cursor() as cursor:
+                cursor.execute("DELETE FROM chat_response_cache")
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.closeall()
+
+    def _remember(self, key, reply, expires_at):
+        self._memory[key] = (reply, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+
+def _vector_literal(vector):
+    # pgvector 的文本格式: [1,2,3]
+    return "[" + ",".join(str(float(value)) for value in vector) + "]"
+# 功能结束: 回复缓存
+
+
+# 功能开始: 默认缓存
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """进程共享的默认缓存，首次使用时创建"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ResponseCache()
+    return _default_cache
+# 功能结束: 默认缓存
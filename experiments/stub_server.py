@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+本地 OpenAI 兼容桩服务，用于在不访问真实服务商的情况下测量客户端开销
+
+支持 POST /v1/chat/completions 与 POST /v1/embeddings，响应固定内容，
+可通过 latency 参数模拟上游处理耗时。
+"""
+
+# 功能开始: 导入必要模块
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# 功能结束: 导入必要模块
+
+
+# 功能开始: 桩服务请求处理
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive，连接可被客户端复用
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.path.endswith("/chat/completions") and body.get("stream"):
+            self._stream_chat(body)
+            return
+        if self.path.endswith("/chat/completions"):
+            payload = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "ok"},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        elif self.path.endswith("/embeddings"):
+            inputs = body.get("input", "")
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            dimensions = body.get("dimensions") or 8
+            payload = {
+                "object": "list",
+                "model": body.get("model", "stub"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": [float(len(text) % 7)] * dimensions}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+            }
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_chat(self, body):
+        # 以 SSE 逐字返回 "stub reply"，最后一个分片携带用量
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = ["stub", " reply"]
+        for word in words:
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.latency:
+                time.sleep(self.latency)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [],
+                "usage": {"prompt_tokens": 1, "completion_tokens": len(words), "total_tokens": 1 + len(words)},
+            }
+            self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+# 功能结束: 桩服务请求处理
+
+
+# 功能开始: 启动桩服务
+def start_stub_server(port=0, latency=0.0):
+    """在后台线程启动桩服务，返回 (server, base_url)，用 server.shutdown() 停止"""
+    handler = type("Handler", (StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+# 功能结束: 启动桩服务
+
+
+if __name__ == "__main__":
+    server, base_url = start_stub_server(port=18080)
+    print(f"Stub server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()